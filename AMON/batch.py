@@ -0,0 +1,135 @@
+"""Run AMON on many gene sets while loading the KEGG records they need only once.
+
+A manifest is a tsv with a row per cohort and the columns name, gene_set and optionally other_gene_set and
+detected_compounds. Paths in the manifest are relative to the manifest's directory. Records for the union of all
+cohorts' ids are loaded up front and every cohort is run with main() into its own directory under the output
+directory, in parallel when more than one process is used.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from os import path, makedirs
+
+import pandas as pd
+
+from AMON.figures import FIGURE_LOG_NAMES, FigureRenderer
+from AMON.kegg_index import KEGGIndex, KEGGRecords, normalize_pathway_id
+from AMON.kegg_cache import KEGGCache
+from AMON.kegg_snapshot import load_snapshot
+from AMON.predict_metabolites import read_in_ids, get_records, get_pathways_from_cos, main
+from AMON.sparse_engine import get_sample_rns, get_sample_cos
+
+MANIFEST_COLUMNS = ('name', 'gene_set', 'other_gene_set', 'detected_compounds')
+
+
+def read_manifest(manifest_loc):
+    manifest = pd.read_csv(manifest_loc, sep='\t', dtype=str)
+    if 'name' not in manifest.columns or 'gene_set' not in manifest.columns:
+        raise ValueError('Manifest %s must have name and gene_set columns' % manifest_loc)
+    if manifest['name'].duplicated().any():
+        raise ValueError('Manifest %s has duplicated names' % manifest_loc)
+    manifest_dir = path.dirname(path.abspath(manifest_loc))
+    cohorts = list()
+    for _, row in manifest.iterrows():
+        cohort = dict()
+        for column in MANIFEST_COLUMNS:
+            value = row.get(column)
+            if pd.isnull(value) or value == '':
+                cohort[column] = None
+            elif column == 'name':
+                cohort[column] = value
+            else:
+                cohort[column] = path.join(manifest_dir, value)
+        cohorts.append(cohort)
+    return cohorts
+
+
+def load_kegg_records(cohorts, keep_separated=False, samples_are_columns=False, ko_file_loc=None, rn_file_loc=None,
+                      co_file_loc=None, pathway_file_loc=None, kegg_index=None, kegg_cache=None, kegg_fetcher=None,
+                      flat_file_processes=1, load_entries=None, background_kos=()):
+    """Get the KO, reaction, compound and pathway records needed by all cohorts and by the KOs background_kos of
+    the permutation null model with one lookup per kind, records in the snapshot load_entries are not looked up
+    again"""
+    if isinstance(kegg_index, str):
+        kegg_index = KEGGIndex.load(kegg_index)
+    if isinstance(kegg_cache, str):
+        kegg_cache = KEGGCache(kegg_cache)
+    if isinstance(load_entries, str):
+        load_entries = load_snapshot(load_entries)
+    sample_kos = dict()
+    cos_measured = set()
+    for cohort in cohorts:
+        for column in ('gene_set', 'other_gene_set'):
+            if cohort[column] is not None:
+                ids = read_in_ids(cohort[column], keep_separated=keep_separated,
+                                  samples_are_columns=samples_are_columns, name=column)
+                sample_kos.update({(cohort['name'], column, sample): kos for sample, kos in ids.items()})
+        if cohort['detected_compounds'] is not None:
+            cos_measured.update(list(read_in_ids(cohort['detected_compounds'], name='Compounds').values())[0])
+    if len(background_kos) > 0:
+        sample_kos[('null background',)] = set(background_kos)
+    all_kos = set(ko for kos in sample_kos.values() for ko in kos)
+    ko_dict = get_records(all_kos, 'ko', ko_file_loc, kegg_index, kegg_cache, kegg_fetcher, flat_file_processes,
+                          load_entries)
+    sample_rns = get_sample_rns(sample_kos, ko_dict)
+    rn_dict = get_records(sample_rns.present_column_ids(), 'rn', rn_file_loc, kegg_index, kegg_cache, kegg_fetcher,
+                          flat_file_processes, load_entries)
+    # detected compounds are included for runs using detected_only
+    all_cos = set(get_sample_cos(sample_rns, rn_dict).present_column_ids()) | cos_measured
+    co_dict = get_records(all_cos, 'co', co_file_loc, kegg_index, kegg_cache, kegg_fetcher, flat_file_processes,
+                          load_entries)
+    all_pathways = [normalize_pathway_id(pathway) for pathway in get_pathways_from_cos(co_dict)]
+    pathway_dict = get_records(all_pathways, 'pathway', pathway_file_loc, kegg_index, kegg_cache, kegg_fetcher,
+                               flat_file_processes, load_entries)
+    return KEGGRecords({'ko': ko_dict, 'rn': rn_dict, 'co': co_dict, 'pathway': pathway_dict})
+
+
+_worker_records = None
+
+
+def _init_worker(kegg_records):
+    global _worker_records
+    _worker_records = kegg_records
+
+
+def _run_cohort(cohort, output_dir, options):
+    main(cohort['gene_set'], path.join(output_dir, cohort['name']), cohort['other_gene_set'],
+         cohort['detected_compounds'], kegg_index=_worker_records, **options)
+    return cohort['name']
+
+
+def batch_main(manifest_loc, output_dir, processes=1, keep_separated=False, samples_are_columns=False,
+               ko_file_loc=None, rn_file_loc=None, co_file_loc=None, pathway_file_loc=None, kegg_index=None,
+               kegg_cache=None, kegg_fetcher=None, flat_file_processes=1, load_entries=None, **options):
+    """Run main() for every cohort in a manifest, options are passed on to main()"""
+    cohorts = read_manifest(manifest_loc)
+    makedirs(output_dir)
+    # the background of the permutation null model is read once and its records loaded with the cohorts'
+    background_kos = set()
+    if options.get('permutations', 0) > 0 and options.get('null_background') is not None:
+        null_background = options['null_background']
+        if isinstance(null_background, str):
+            null_background = [ko for kos in read_in_ids(null_background, name='background').values() for ko in kos]
+        background_kos = set(null_background)
+        options['null_background'] = background_kos
+    kegg_records = load_kegg_records(cohorts, keep_separated, samples_are_columns, ko_file_loc, rn_file_loc,
+                                     co_file_loc, pathway_file_loc, kegg_index, kegg_cache, kegg_fetcher,
+                                     flat_file_processes, load_entries, background_kos)
+    options.update(keep_separated=keep_separated, samples_are_columns=samples_are_columns)
+    if processes == 1:
+        _init_worker(kegg_records)
+        if not options.get('make_plots', True) or options.get('defer_plots', False):
+            return [_run_cohort(cohort, output_dir, options) for cohort in cohorts]
+        # figures of each cohort are rendered in the background while the next cohorts run
+        with FigureRenderer(options.get('plot_processes', 1), figure_format=options.get('figure_format', 'png'),
+                            dpi=options.get('figure_dpi'), max_pathways=options.get('max_pathways'),
+                            pathway_order=options.get('pathway_order')) as figure_renderer:
+            names = [_run_cohort(cohort, output_dir, dict(options, figure_renderer=figure_renderer))
+                     for cohort in cohorts]
+            # cohort logs are written before their figures are done, so figure locations are added to them after
+            for cohort_dir, figure_locations in figure_renderer.wait().items():
+                with open(path.join(cohort_dir, 'AMON_log.txt'), 'a') as f:
+                    for figure, figure_loc in figure_locations.items():
+                        f.write('%s: %s\n' % (FIGURE_LOG_NAMES[figure], path.abspath(figure_loc)))
+        return names
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(kegg_records,)) as executor:
+        return list(executor.map(_run_cohort, cohorts, [output_dir] * len(cohorts), [options] * len(cohorts)))
@@ -0,0 +1,211 @@
+"""Offline benchmarks of AMON on a synthetic KEGG database and synthetic gene sets.
+
+The synthetic KO, reaction, compound and pathway flat files and the synthetic sample tables are generated from a seed
+so every run of a benchmark sees the same data. Each stage is timed as the fastest of a number of repeats and, when
+memory is measured, run once more under tracemalloc to find its peak allocated memory.
+"""
+
+import time
+import tracemalloc
+from itertools import count
+from os import path, makedirs
+
+import numpy as np
+import pandas as pd
+
+from KEGG_parser.parsers import parse_ko, parse_rn, parse_co, parse_pathway
+
+from AMON.predict_metabolites import read_in_ids, get_rns_from_kos, get_products_from_rns, \
+    make_compound_origin_table, get_unique_from_dict_of_lists, get_pathway_to_co_dict, calculate_enrichment, main
+from AMON.sparse_engine import IncidenceMatrix, get_sample_rns, get_sample_cos
+from AMON.enrichment import calculate_enrichment_batch, make_pathway_co_matrix
+from AMON.kegg_flat_file import read_flat_file
+
+# number of KOs in data/ko_list.txt
+DEFAULT_KO_COUNT = 4400
+STAGES = ('read_in_ids', 'get_rns_from_kos', 'get_products_from_rns', 'get_sample_rns', 'get_sample_cos',
+          'make_compound_origin_table', 'get_unique_from_dict_of_lists', 'calculate_enrichment',
+          'calculate_enrichment_batch', 'main')
+RESULT_COLUMNS = ('samples', 'kos', 'stage', 'seconds', 'peak memory MB')
+
+
+def format_field(name, values):
+    return '\n'.join('%-12s%s' % (name if i == 0 else '', value) for i, value in enumerate(values))
+
+
+def make_synthetic_kegg(num_kos=DEFAULT_KO_COUNT, seed=0):
+    """Random KEGG like database with twice as many reactions and compounds as KOs and a pathway per 25 KOs.
+    Returns dicts of KO to reactions, reaction to (substrates, products) and pathway to compounds."""
+    rng = np.random.RandomState(seed)
+    kos = ['K%05d' % i for i in range(1, num_kos + 1)]
+    rns = np.array(['R%05d' % i for i in range(1, 2 * num_kos + 1)])
+    cos = np.array(['C%05d' % i for i in range(1, 2 * num_kos + 1)])
+    pathways = ['ko%05d' % i for i in range(1, max(2, num_kos // 25) + 1)]
+
+    def sample(ids, size):
+        # drawing with replacement and dropping repeats keeps each draw from permuting all of the ids
+        return sorted(set(str(id_) for id_ in ids[rng.randint(0, len(ids), size)]))
+    ko_rns = {ko: sample(rns, rng.randint(0, 4)) for ko in kos}
+    rn_equations = {str(rn): (sample(cos, rng.randint(1, 4)), sample(cos, rng.randint(1, 4))) for rn in rns}
+    pathway_cos = {pathway: sample(cos, min(len(cos), rng.randint(15, 81))) for pathway in pathways}
+    return ko_rns, rn_equations, pathway_cos
+
+
+def write_synthetic_kegg(directory, num_kos=DEFAULT_KO_COUNT, seed=0):
+    """Write a synthetic KEGG database as KO, reaction, compound and pathway flat files, returns their locations"""
+    ko_rns, rn_equations, pathway_cos = make_synthetic_kegg(num_kos, seed)
+    co_rns = dict()
+    for rn, (substrates, products) in rn_equations.items():
+        for co in set(substrates) | set(products):
+            co_rns.setdefault(co, list()).append(rn)
+    co_pathways = dict()
+    for pathway, cos in pathway_cos.items():
+        for co in cos:
+            co_pathways.setdefault(co, list()).append(pathway)
+    all_cos = sorted(set(co_rns) | set(co_pathways))
+
+    entries = {'ko': list(), 'rn': list(), 'co': list(), 'pathway': list()}
+    for ko, rns in ko_rns.items():
+        dblinks = ['COG: COG0001'] if len(rns) == 0 else ['RN: %s' % ' '.join(rns), 'COG: COG0001']
+        entries['ko'].append('\n'.join((format_field('ENTRY', ['%s                      KO' % ko]),
+                                        format_field('NAME', ['synthetic%s' % ko]),
+                                        format_field('DBLINKS', dblinks))))
+    for rn, (substrates, products) in rn_equations.items():
+        entries['rn'].append('\n'.join((format_field('ENTRY', ['%s                      Reaction' % rn]),
+                                        format_field('EQUATION', ['%s <=> %s' % (' + '.join(substrates),
+                                                                                 ' + '.join(products))]))))
+    for co in all_cos:
+        fields = [format_field('ENTRY', ['%s                      Compound' % co]),
+                  format_field('NAME', ['synthetic %s;' % co])]
+        if co in co_rns:
+            fields.append(format_field('REACTION', [' '.join(co_rns[co])]))
+        if co in co_pathways:
+            fields.append(format_field('PATHWAY', ['%s  synthetic pathway %s' % (pathway.replace('ko', 'map'),
+                                                                                 pathway)
+                                                   for pathway in co_pathways[co]]))
+        entries['co'].append('\n'.join(fields))
+    for pathway, cos in pathway_cos.items():
+        entries['pathway'].append('\n'.join((format_field('ENTRY', ['%s                     Pathway' % pathway]),
+                                             format_field('NAME', ['synthetic pathway %s' % pathway]),
+                                             format_field('COMPOUND', ['%s  synthetic %s' % (co, co)
+                                                                       for co in cos]))))
+    makedirs(directory, exist_ok=True)
+    file_locs = dict()
+    for kind, kind_entries in entries.items():
+        file_locs[kind] = path.join(directory, '%s.txt' % kind)
+        with open(file_locs[kind], 'w') as f:
+            f.write(''.join('%s\n///\n' % entry for entry in kind_entries))
+    return file_locs
+
+
+def write_synthetic_gene_sets(output_loc, num_samples, num_kos=DEFAULT_KO_COUNT, ko_fraction=.5, seed=0,
+                              chunksize=1000):
+    """Write a samples x KOs table where each sample has each KO with probability ko_fraction, as a tsv with samples
+    as rows or a biom table with KOs as observations depending on the file ending"""
+    rng = np.random.RandomState(seed)
+    kos = ['K%05d' % i for i in range(1, num_kos + 1)]
+    samples = ['sample%s' % i for i in range(num_samples)]
+    if output_loc.endswith('.tsv'):
+        with open(output_loc, 'w') as f:
+            f.write('\t'.join([''] + kos) + '\n')
+            for start in range(0, num_samples, chunksize):
+                chunk = (rng.random_sample((min(chunksize, num_samples - start), num_kos)) < ko_fraction)
+                pd.DataFrame(chunk.astype(int), index=samples[start:start + chunksize]) \
+                    .to_csv(f, sep='\t', header=False)
+    elif output_loc.endswith('.biom'):
+        import h5py
+        from biom import Table
+        from scipy import sparse
+        chunks = [sparse.csr_matrix(rng.random_sample((min(chunksize, num_samples - start), num_kos)) < ko_fraction)
+                  for start in range(0, num_samples, chunksize)]
+        matrix = sparse.vstack(chunks).transpose().astype(float)
+        with h5py.File(output_loc, 'w') as f:
+            Table(matrix, kos, samples).to_hdf5(f, 'AMON benchmark')
+    else:
+        raise ValueError('Synthetic gene sets must be written to a .tsv or .biom file, not %s' % output_loc)
+    return output_loc
+
+
+def measure(function, *args, repeats=1, memory=True, **kwargs):
+    """Run a function repeats times, returns its result, the fastest time in seconds and the peak memory allocated
+    in MB during one more run under tracemalloc, or None if memory is False"""
+    seconds = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            peak_memory = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return result, min(seconds), peak_memory
+
+
+def run_benchmarks(sample_counts, work_dir, num_kos=DEFAULT_KO_COUNT, ko_fraction=.5, input_format='biom', seed=0,
+                   repeats=1, memory=True, stages=STAGES):
+    """Benchmark each stage for each number of samples, returns a table with a row per number of samples and stage"""
+    unknown_stages = set(stages) - set(STAGES)
+    if len(unknown_stages) > 0:
+        raise ValueError('Unknown benchmark stages: %s' % ', '.join(sorted(unknown_stages)))
+    # import the libraries AMON imports lazily so the first stage to use them is not timed importing them
+    import scipy.stats
+    import statsmodels.sandbox.stats.multicomp
+    import biom
+    file_locs = write_synthetic_kegg(path.join(work_dir, 'kegg'), num_kos, seed)
+    records = {kind: {record['ENTRY']: record for record in read_flat_file(file_locs[kind], parser)}
+               for kind, parser in (('ko', parse_ko), ('rn', parse_rn), ('co', parse_co),
+                                    ('pathway', parse_pathway))}
+    pathway_to_co_dict = get_pathway_to_co_dict(records['pathway'], no_glycan=False)
+    pathway_cos = make_pathway_co_matrix(pathway_to_co_dict)
+
+    results = list()
+    main_runs = count()
+    for num_samples in sample_counts:
+        input_loc = write_synthetic_gene_sets(path.join(work_dir, 'gene_sets_%s.%s' % (num_samples, input_format)),
+                                              num_samples, num_kos, ko_fraction, seed)
+
+        def record(stage, function, *args, **kwargs):
+            if stage not in stages:
+                return function(*args, **kwargs)
+            result, seconds, peak_memory = measure(function, *args, repeats=repeats, memory=memory, **kwargs)
+            results.append([num_samples, num_kos, stage, seconds, peak_memory])
+            return result
+
+        def run_main():
+            main_dir = path.join(work_dir, 'main_%s_%s' % (num_samples, next(main_runs)))
+            main(input_loc, main_dir, keep_separated=True, ko_file_loc=file_locs['ko'],
+                 rn_file_loc=file_locs['rn'], co_file_loc=file_locs['co'], pathway_file_loc=file_locs['pathway'],
+                 make_plots=False)
+
+        # the first stages make the inputs of the later ones so they are always run, but only measured if asked for
+        sample_kos = record('read_in_ids', read_in_ids, input_loc, keep_separated=True)
+        sample_rns = record('get_rns_from_kos', get_rns_from_kos, sample_kos, records['ko'])
+        sample_cos = record('get_products_from_rns', get_products_from_rns, sample_rns, records['rn'])
+        if 'get_sample_rns' in stages or 'get_sample_cos' in stages:
+            sample_rns_matrix = record('get_sample_rns', get_sample_rns, sample_kos, records['ko'])
+            record('get_sample_cos', get_sample_cos, sample_rns_matrix, records['rn'])
+        if 'make_compound_origin_table' in stages:
+            record('make_compound_origin_table', make_compound_origin_table, sample_cos)
+        unique_cos = record('get_unique_from_dict_of_lists', get_unique_from_dict_of_lists, sample_cos)
+        if 'calculate_enrichment' in stages:
+            record('calculate_enrichment', lambda: [calculate_enrichment(cos, pathway_to_co_dict)
+                                                    for cos in unique_cos.values()])
+        if 'calculate_enrichment_batch' in stages:
+            record('calculate_enrichment_batch', calculate_enrichment_batch,
+                   IncidenceMatrix.from_dict_of_lists(unique_cos), pathway_cos)
+        if 'main' in stages:
+            record('main', run_main)
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def compare_benchmarks(results, baseline, tolerance=1.5):
+    """Rows of results whose time or peak memory is more than tolerance times that of the same stage and size in a
+    baseline table"""
+    merged = results.merge(baseline, on=['samples', 'kos', 'stage'], suffixes=('', ' baseline'))
+    slower = merged['seconds'] > merged['seconds baseline'] * tolerance
+    larger = merged['peak memory MB'] > merged['peak memory MB baseline'] * tolerance
+    return merged.loc[slower | larger].reset_index(drop=True)
@@ -0,0 +1,103 @@
+"""Reading and writing samples in fixed size chunks so memory does not grow with the number of samples.
+
+HDF5 biom tables are read a chunk of samples at a time straight from the sample major copy of their matrix, and tsv
+or csv tables with samples as rows a chunk of rows at a time. The compounds produced by each chunk are kept on disk
+as compounds x samples CSR arrays that are memory mapped when the origin table is written, so only a block of
+compound rows is ever held densely.
+"""
+
+from os import path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from AMON.sparse_engine import IncidenceMatrix
+
+# most True/False cells held at once when writing an origin table
+ORIGIN_BLOCK_CELLS = 2 ** 21
+
+
+def iter_biom_chunks(file_loc, chunksize):
+    """Samples x observations IncidenceMatrix for each chunk of samples of an HDF5 biom table"""
+    import h5py
+    with h5py.File(file_loc, 'r') as f:
+        observation_ids = [id_.decode() if isinstance(id_, bytes) else id_ for id_ in f['observation/ids'][:]]
+        sample_ids = f['sample/ids']
+        indptr = f['sample/matrix/indptr']
+        indices = f['sample/matrix/indices']
+        data = f['sample/matrix/data']
+        for start in range(0, len(sample_ids), chunksize):
+            end = min(start + chunksize, len(sample_ids))
+            chunk_indptr = indptr[start:end + 1]
+            chunk_indices = indices[chunk_indptr[0]:chunk_indptr[-1]]
+            chunk_data = data[chunk_indptr[0]:chunk_indptr[-1]] != 0
+            matrix = sparse.csr_matrix((chunk_data, chunk_indices, chunk_indptr - chunk_indptr[0]),
+                                       shape=(end - start, len(observation_ids)))
+            yield IncidenceMatrix(matrix, [id_.decode() if isinstance(id_, bytes) else id_
+                                           for id_ in sample_ids[start:end]], observation_ids)
+
+
+def iter_table_chunks(file_loc, chunksize, sep):
+    """Samples x ids IncidenceMatrix for each chunk of rows of a tsv or csv with samples as rows"""
+    for chunk in pd.read_csv(file_loc, sep=sep, index_col=0, chunksize=chunksize):
+        yield IncidenceMatrix(sparse.csr_matrix(chunk.to_numpy().astype(bool)), [str(row_id) for row_id in chunk.index],
+                              chunk.columns)
+
+
+def save_chunk(chunk_dir, chunk_number, sample_cos):
+    """Save a samples x compounds chunk as compounds x samples CSR arrays"""
+    origin_matrix = sample_cos.matrix.transpose().tocsr()
+    np.save(path.join(chunk_dir, 'chunk_%s_indptr.npy' % chunk_number), origin_matrix.indptr)
+    np.save(path.join(chunk_dir, 'chunk_%s_indices.npy' % chunk_number), origin_matrix.indices)
+
+
+def load_chunk(chunk_dir, chunk_number, num_compounds, num_samples, mmap=True):
+    """Compounds x samples CSR matrix of a saved chunk"""
+    mmap_mode = 'r' if mmap else None
+    indptr = np.load(path.join(chunk_dir, 'chunk_%s_indptr.npy' % chunk_number), mmap_mode=mmap_mode)
+    indices = np.load(path.join(chunk_dir, 'chunk_%s_indices.npy' % chunk_number), mmap_mode=mmap_mode)
+    return sparse.csr_matrix((np.ones(len(indices), dtype=bool), indices, indptr),
+                             shape=(num_compounds, num_samples))
+
+
+def load_chunk_arrays(chunk_dir, chunk_number):
+    """Memory mapped indptr and indices arrays of a saved chunk"""
+    return (np.load(path.join(chunk_dir, 'chunk_%s_indptr.npy' % chunk_number), mmap_mode='r'),
+            np.load(path.join(chunk_dir, 'chunk_%s_indices.npy' % chunk_number), mmap_mode='r'))
+
+
+def select_csr_rows(indptr, indices, rows, num_columns):
+    """CSR matrix of the rows of a boolean CSR matrix given as indptr and indices, only the rows' indices are read"""
+    starts = np.asarray(indptr[rows], dtype=np.int64)
+    lengths = np.asarray(indptr[rows + 1], dtype=np.int64) - starts
+    row_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    positions = np.arange(row_indptr[-1]) + np.repeat(starts - row_indptr[:-1], lengths)
+    return sparse.csr_matrix((np.ones(len(positions), dtype=bool), indices[positions], row_indptr),
+                             shape=(len(rows), num_columns))
+
+
+def iter_origin_blocks(chunk_dir, chunk_samples, chunk_keep, compound_rows, detected=None):
+    """Dense blocks of compound rows of the origin table from saved chunks, with the samples of each chunk that are
+    kept and a detected column if detected is given. Yields the positions of the rows in each block and the block."""
+    num_columns = sum(int(np.sum(keep)) for keep in chunk_keep) + (detected is not None)
+    block_rows = max(1, ORIGIN_BLOCK_CELLS // max(1, num_columns))
+    # chunks are opened once and each block only reads the entries of its rows
+    chunk_arrays = [load_chunk_arrays(chunk_dir, chunk_number) for chunk_number in range(len(chunk_samples))]
+    compound_rows = np.asarray(compound_rows, dtype=np.int64)
+    for start in range(0, len(compound_rows), block_rows):
+        rows = compound_rows[start:start + block_rows]
+        blocks = [select_csr_rows(indptr, indices, rows, len(samples))[:, np.flatnonzero(keep)]
+                  for (indptr, indices), samples, keep in zip(chunk_arrays, chunk_samples, chunk_keep)]
+        if detected is not None:
+            blocks.append(sparse.csr_matrix(detected[start:start + block_rows, np.newaxis]))
+        yield rows, sparse.hstack(blocks).toarray() if len(blocks) > 0 else np.zeros((len(rows), 0), dtype=bool)
+
+
+def write_origin_table_chunks(output_loc, column_ids, row_ids, blocks):
+    """Write an origin table tsv of True/False values from dense blocks of rows"""
+    with open(output_loc, 'w') as f:
+        f.write('\t'.join([''] + [str(column_id) for column_id in column_ids]) + '\n')
+        for rows, block in blocks:
+            block = np.where(block, 'True', 'False')
+            f.writelines('%s\t%s\n' % (row_ids[row], '\t'.join(values)) for row, values in zip(rows, block))
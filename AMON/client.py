@@ -0,0 +1,39 @@
+"""Client of the AMON prediction server in AMON.server, kept apart from it so clients do not import the server."""
+
+import json
+from os import path, makedirs
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pandas as pd
+
+DEFAULT_PORT = 8657
+
+
+def frame_from_json(frame_json):
+    return pd.DataFrame(frame_json['data'], index=frame_json['index'], columns=frame_json['columns'])
+
+
+def send_request(url, request_path, request=None, timeout=600):
+    """Response to a request to a PredictionServer, a GET if there is no request, raises ValueError for errors"""
+    data = None if request is None else json.dumps(request).encode()
+    http_request = Request(url.rstrip('/') + request_path, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(http_request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except HTTPError as e:
+        raise ValueError('AMON server error %s: %s' % (e.code, json.loads(e.read()).get('error')))
+
+
+def write_response(response, output_dir):
+    """Write the tables of a /predict response to output_dir as main() does"""
+    makedirs(output_dir, exist_ok=True)
+    origin_table = frame_from_json(response['origin_table'])
+    origin_table.to_csv(path.join(output_dir, 'origin_table.tsv'), sep='\t')
+    if response.get('kegg_mapper') is not None:
+        pd.Series(response['kegg_mapper']).to_csv(path.join(output_dir, 'kegg_mapper.tsv'), sep='\t')
+    for sample, enrichment_json in response['enrichment'].items():
+        frame_from_json(enrichment_json).to_csv(path.join(output_dir, '%s_compound_pathway_enrichment.tsv' % sample),
+                                                sep='\t')
+    with open(path.join(output_dir, 'AMON_stages.json'), 'w') as f:
+        json.dump({'stages': response['stages']}, f, indent=2)
@@ -0,0 +1,214 @@
+"""Pathway enrichment of predicted compounds for all samples at once.
+
+The overlap of every sample with every pathway is one sparse product of the samples x compounds and compounds x
+pathways matrices, all p-values come from a single vectorized hypergeometric call and the Benjamini-Hochberg
+adjustment is applied to every sample's row of p-values together.
+
+The hypergeometric test treats compounds as independent draws, but compounds are produced by reactions in blocks that
+follow the structure of KEGG. PermutationNull instead draws random sets of KOs or reactions the size of each sample's
+and puts them through the same sparse products, giving empirical p-values of each sample's overlap with every pathway.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from AMON.sparse_engine import IncidenceMatrix
+
+ENRICHMENT_COLUMNS = ["pathway size", "overlap", "probability", "adjusted probability"]
+PERMUTATION_COLUMNS = ["permutation probability", "adjusted permutation probability"]
+NULL_MODELS = ('ko', 'reaction')
+# random sets drawn together in one sparse product
+PERMUTATION_BATCH_SIZE = 200
+
+
+def fdr_bh_rows(pvalues):
+    """Benjamini-Hochberg adjusted p-values for each row of a 2-D array, same as p_adjust on each row"""
+    pvalues = np.atleast_2d(np.asarray(pvalues, dtype=float))
+    num_tests = pvalues.shape[1]
+    if num_tests == 0:
+        return pvalues.copy()
+    order = np.argsort(pvalues, axis=1)
+    sorted_pvalues = np.take_along_axis(pvalues, order, axis=1)
+    adjusted = sorted_pvalues * num_tests / np.arange(1, num_tests + 1)
+    adjusted = np.minimum.accumulate(adjusted[:, ::-1], axis=1)[:, ::-1]
+    adjusted = np.minimum(adjusted, 1)
+    unsorted = np.empty_like(adjusted)
+    np.put_along_axis(unsorted, order, adjusted, axis=1)
+    return unsorted
+
+
+def make_pathway_co_matrix(pathway_to_co_dict):
+    """Pathways x compounds from the output of get_pathway_to_co_dict"""
+    return IncidenceMatrix.from_dict_of_lists(pathway_to_co_dict)
+
+
+def select_tested_pathways(pathway_cos, min_pathway_size=10):
+    """Pathways with more than min_pathway_size compounds"""
+    return pathway_cos.select_rows(pathway_cos.row_counts() > min_pathway_size)
+
+
+def hypergeometric_probabilities(overlaps, sample_sizes, pathway_sizes, all_cos_size):
+    """Samples x pathways hypergeometric p-values of the overlaps of samples with sample_sizes compounds with pathways
+    of pathway_sizes compounds out of all_cos_size compounds"""
+    from scipy.stats import hypergeom
+    probabilities = hypergeom.sf(overlaps, all_cos_size, np.asarray(pathway_sizes)[np.newaxis, :],
+                                 np.asarray(sample_sizes)[:, np.newaxis])
+    return np.atleast_2d(probabilities).reshape(overlaps.shape)
+
+
+def calculate_enrichment_batch(sample_cos, pathway_cos, min_pathway_size=10, null=None):
+    """Hypergeometric enrichment of each sample's compounds in each pathway.
+
+    sample_cos is a samples x compounds IncidenceMatrix and pathway_cos a pathways x compounds IncidenceMatrix. The
+    background is all compounds in any pathway and only pathways with more than min_pathway_size compounds are tested.
+    If a PermutationNull is given its empirical p-values are added. Returns a long form table with a row per sample
+    and pathway.
+    """
+    all_cos_size = len(pathway_cos.present_column_ids())
+    pathway_cos = select_tested_pathways(pathway_cos, min_pathway_size)
+    pathway_sizes = pathway_cos.row_counts()
+
+    overlaps = sample_cos.count_dot(pathway_cos.transpose()).toarray()
+    probabilities = hypergeometric_probabilities(overlaps, sample_cos.row_counts(), pathway_sizes, all_cos_size)
+    adjusted_probabilities = fdr_bh_rows(probabilities)
+
+    num_samples, num_pathways = overlaps.shape
+    enrichment_table = pd.DataFrame({'sample': np.repeat(np.asarray(sample_cos.row_ids, dtype=object), num_pathways),
+                                     'pathway': np.tile(np.asarray(pathway_cos.row_ids, dtype=object), num_samples),
+                                     'pathway size': np.tile(pathway_sizes, num_samples),
+                                     'overlap': overlaps.ravel(),
+                                     'probability': probabilities.ravel(),
+                                     'adjusted probability': adjusted_probabilities.ravel()},
+                                    columns=['sample', 'pathway'] + ENRICHMENT_COLUMNS)
+    if null is not None:
+        permutation_probabilities = null.probabilities(sample_cos.row_ids, pathway_cos, overlaps)
+        enrichment_table['permutation probability'] = permutation_probabilities.ravel()
+        enrichment_table['adjusted permutation probability'] = fdr_bh_rows(permutation_probabilities).ravel()
+    return enrichment_table
+
+
+def split_enrichment_table(enrichment_table):
+    """Per sample tables matching calculate_enrichment, samples where calculate_enrichment gives None are left out"""
+    pathway_enrichment_dfs = dict()
+    for sample, sample_table in enrichment_table.groupby('sample', sort=False):
+        sample_table = sample_table.set_index('pathway').drop(columns='sample')
+        sample_table.index.name = None
+        if np.any((sample_table['adjusted probability'] < .05) & (sample_table['overlap'] == 0)):
+            continue
+        pathway_enrichment_dfs[sample] = sample_table.sort_values('adjusted probability')
+    return pathway_enrichment_dfs
+
+
+def make_unique_masks(sample_cos, column_ids, max_samples=1):
+    """Samples x column_ids boolean array of the compounds a random set replacing each sample would keep as unique,
+    those found in fewer than max_samples of the other samples of sample_cos"""
+    column_positions = {column_id: i for i, column_id in enumerate(sample_cos.column_ids)}
+    positions = np.array([column_positions.get(column_id, -1) for column_id in column_ids], dtype=np.int64)
+    present = positions >= 0
+    own = np.zeros((sample_cos.shape[0], len(column_ids)), dtype=np.int64)
+    own[:, present] = sample_cos.matrix[:, positions[present]].toarray()
+    return own.sum(axis=0)[np.newaxis, :] - own < max_samples
+
+
+class PermutationNull(object):
+    """Null model of pathway overlaps from random sets of elements, KOs or reactions, drawn from a universe.
+
+    element_cos is an elements x compounds IncidenceMatrix of the universe and sample_sizes gives the number of
+    elements drawn for each of sample_ids. compound_masks is a compounds or samples x compounds boolean array over the
+    columns of element_cos of the compounds kept, matching filters applied to the samples' own compounds. Each random
+    set is the start of a random order of the universe, so one order gives a random set of every sample's size, and
+    every batch of orders gets its own seed spawned from seed, so results do not depend on the number of processes.
+    """
+    def __init__(self, element_cos, sample_ids, sample_sizes, compound_masks=None, permutations=1000, seed=0,
+                 processes=1):
+        self.element_cos = element_cos
+        self.sample_positions = {sample: i for i, sample in enumerate(sample_ids)}
+        self.sample_sizes = np.asarray(sample_sizes, dtype=np.int64)
+        self.compound_masks = compound_masks
+        self.permutations = permutations
+        self.seed = seed
+        self.processes = processes
+
+    def _mask_groups(self, positions, observed_overlaps):
+        """Rows of the samples sharing a mask with the mask, their sizes and their observed overlaps"""
+        groups = dict()
+        for row, position in enumerate(positions):
+            if self.compound_masks is None or self.compound_masks.ndim == 1:
+                key = None
+            else:
+                key = self.compound_masks[position].tobytes()
+            groups.setdefault(key, list()).append(row)
+        num_elements = self.element_cos.shape[0]
+        mask_groups = list()
+        for rows in groups.values():
+            if self.compound_masks is None or self.compound_masks.ndim == 1:
+                mask = self.compound_masks
+            else:
+                mask = self.compound_masks[positions[rows[0]]]
+            sizes = np.minimum(self.sample_sizes[[positions[row] for row in rows]], num_elements)
+            mask_groups.append((mask, np.array(rows), sizes, observed_overlaps[rows]))
+        return mask_groups
+
+    def probabilities(self, sample_ids, pathway_cos, observed_overlaps):
+        """Samples x pathways empirical p-values, the fraction of random sets, counting the sample itself, with an
+        overlap at least as large as the sample's"""
+        positions = [self.sample_positions[sample] for sample in sample_ids]
+        pathway_matrix = pathway_cos.transpose().reindex_rows(self.element_cos.column_ids).matrix.astype(np.int32)
+        element_matrix = self.element_cos.matrix.tocsc()
+        mask_groups = self._mask_groups(positions, observed_overlaps)
+        batch_sizes = [min(PERMUTATION_BATCH_SIZE, self.permutations - start)
+                       for start in range(0, self.permutations, PERMUTATION_BATCH_SIZE)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(batch_sizes))
+        initargs = (element_matrix, pathway_matrix, mask_groups)
+        if self.processes > 1 and len(batch_sizes) > 1:
+            with ProcessPoolExecutor(self.processes, initializer=_init_null_worker, initargs=initargs) as executor:
+                batch_exceedances = list(executor.map(_null_exceedances, batch_sizes, seeds))
+        else:
+            _init_null_worker(*initargs)
+            batch_exceedances = [_null_exceedances(num_sets, seed) for num_sets, seed in zip(batch_sizes, seeds)]
+        exceedances = np.zeros(observed_overlaps.shape, dtype=np.int64)
+        for group_exceedances in batch_exceedances:
+            exceedances += group_exceedances
+        return (exceedances + 1) / (self.permutations + 1)
+
+
+_null_worker = dict()
+
+
+def _init_null_worker(element_matrix, pathway_matrix, mask_groups):
+    _null_worker.update(element_matrix=element_matrix, pathway_matrix=pathway_matrix, mask_groups=mask_groups)
+
+
+def _null_exceedances(num_sets, seed):
+    """Number of num_sets random sets with an overlap at least as large as each sample's, as samples x pathways"""
+    element_matrix = _null_worker['element_matrix']
+    pathway_matrix = _null_worker['pathway_matrix']
+    num_elements, num_compounds = element_matrix.shape
+    num_pathways = pathway_matrix.shape[1]
+    rng = np.random.default_rng(seed)
+    # place of each element in a random order of the universe, and of the first element making each compound
+    places = np.argsort(rng.random((num_sets, num_elements)), axis=1)
+    first_places = np.full((num_sets, num_compounds), num_elements, dtype=np.int64)
+    made = np.diff(element_matrix.indptr) > 0
+    if np.any(made):
+        first_places[:, made] = np.minimum.reduceat(places[:, element_matrix.indices],
+                                                    element_matrix.indptr[:-1][made], axis=1)
+    num_samples = sum(len(rows) for _, rows, _, _ in _null_worker['mask_groups'])
+    exceedances = np.zeros((num_samples, num_pathways), dtype=np.int64)
+    for mask, rows, sizes, observed_overlaps in _null_worker['mask_groups']:
+        group_places = first_places if mask is None else np.where(mask[np.newaxis, :], first_places, num_elements)
+        group_sizes, size_positions = np.unique(sizes, return_inverse=True)
+        # a compound is in the random sets of every size after the number of sizes not above its first place
+        first_sizes = np.searchsorted(group_sizes, group_places, side='right')
+        kept = first_sizes < len(group_sizes)
+        set_rows, compounds = np.nonzero(kept)
+        first_cos = sparse.csr_matrix((np.ones(len(compounds), dtype=np.int32),
+                                       (set_rows * len(group_sizes) + first_sizes[kept], compounds)),
+                                      shape=(num_sets * len(group_sizes), num_compounds))
+        overlaps = (first_cos @ pathway_matrix).toarray().reshape(num_sets, len(group_sizes), num_pathways)
+        overlaps = np.cumsum(overlaps, axis=1)
+        exceedances[rows] = np.sum(overlaps[:, size_positions, :] >= observed_overlaps[np.newaxis, :, :], axis=0)
+    return exceedances
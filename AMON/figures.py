@@ -0,0 +1,173 @@
+"""Rendering the venn diagram and enrichment clustermap of a run from the tables it saved.
+
+PredictionResults.write_figure_inputs() saves what each figure shows next to the enrichment tables of a run, so the
+figures can be rendered by a pool of background processes while the run carries on, or skipped and rendered later
+from the output directory with render_figures.py in any format and resolution. Plotting libraries are only imported
+by the processes that render.
+"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import numpy as np
+import pandas as pd
+
+FIGURE_INPUTS = 'figure_inputs.json'
+FIGURE_FORMATS = ('png', 'svg', 'pdf')
+FIGURE_NAMES = {'venn': 'venn', 'clustermap': 'enrichment_heatmap'}
+FIGURE_DPI = {'venn': 300, 'clustermap': 500}
+FIGURE_STAGES = {'venn': 'venn diagram', 'clustermap': 'enrichment clustermap'}
+# log entry of the location of each figure
+FIGURE_LOG_NAMES = {'venn': 'Venn diagram location', 'clustermap': 'Enrichment clustermap location'}
+
+
+def set_plot_style():
+    """Import pyplot with the seaborn style applied"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set()
+    return plt
+
+
+def make_venn(sample_cos_produced, measured_cos=None, output_loc=None, name1='gene_set_1', name2='gene_set_2',
+              dpi=300):
+    plt = set_plot_style()
+    from matplotlib_venn import venn2, venn2_circles, venn3, venn3_circles
+    samples = list(sample_cos_produced.keys())
+    bac_cos = sample_cos_produced[samples[0]]
+    if len(samples) == 2:
+        host_cos = sample_cos_produced[samples[1]]
+    else:
+        host_cos = None
+    if host_cos is None and measured_cos is None:
+        raise ValueError("Must give host_cos or measured_cos to make venn diagram")
+    if host_cos is not None and measured_cos is None:
+        _ = venn2((set(bac_cos), set(host_cos)),
+                  ("Compounds predicted\nproduced by %s" % name1.replace('_', ' '),
+                   "Compounds predicted\nproduced by %s" % name2.replace('_', ' ')),
+                  set_colors=('white',)*2)
+        _ = venn2_circles((set(bac_cos), set(host_cos)), linestyle='solid')
+    elif host_cos is None and measured_cos is not None:
+        _ = venn2((set(bac_cos), set(measured_cos)),
+                  ("Compounds predicted\nproduced by %s" % name1.replace('_', ' '), "Compounds measured"),
+                  set_colors=('white',)*2)
+        _ = venn2_circles((set(bac_cos), set(measured_cos)), linestyle='solid')
+    else:
+        _ = venn3((set(measured_cos), set(bac_cos), set(host_cos)),
+                  ("Compounds measured", "Compounds predicted\nproduced by %s" % name1.replace('_', ' '),
+                   "Compounds predicted\nproduced by %s" % name2.replace('_', ' ')),
+                  set_colors=('white',)*3)
+        _ = venn3_circles((set(measured_cos), set(bac_cos), set(host_cos)), linestyle='solid')
+    if output_loc is not None:
+        plt.savefig(output_loc, bbox_inches='tight', dpi=dpi)
+        plt.close('all')
+    else:
+        plt.show()
+
+
+def make_enrichment_clustermap(pathway_enrichment_dfs: dict, key, output_loc, min_p=.1, log=False, dpi=500,
+                               max_pathways=None, pathway_order=None):
+    """Clustermap of the key column of each sample's enrichment table. With max_pathways only the pathways with the
+    lowest values in any sample are shown and with pathway_order pathways are shown in that order without clustering."""
+    enrichment_p_df = pd.DataFrame.from_dict({sample: pathway_enrichment_df[key] for sample, pathway_enrichment_df in
+                                              pathway_enrichment_dfs.items()})
+    enrichment_p_df = enrichment_p_df.loc[enrichment_p_df.index[(enrichment_p_df<min_p).sum(axis=1) > 0]]
+    enrichment_p_df = enrichment_p_df[enrichment_p_df.columns[(enrichment_p_df<min_p).sum(axis=0) > 0]]
+    if max_pathways is not None and enrichment_p_df.shape[0] > max_pathways:
+        enrichment_p_df = enrichment_p_df.loc[enrichment_p_df.min(axis=1).nsmallest(max_pathways).index]
+    if pathway_order is not None:
+        enrichment_p_df = enrichment_p_df.loc[[pathway for pathway in pathway_order
+                                               if pathway in enrichment_p_df.index]]
+    if enrichment_p_df.shape[0] == 0:
+        raise ValueError('No pathways have a %s below %s to plot' % (key, min_p))
+    if log:
+        enrichment_p_df = np.log(enrichment_p_df)
+    plt = set_plot_style()
+    import seaborn as sns
+    # a single pathway can not be clustered
+    row_cluster = pathway_order is None and enrichment_p_df.shape[0] > 1
+    g = sns.clustermap(enrichment_p_df, row_cluster=row_cluster, col_cluster=False, figsize=(2, 12),
+                       cmap="Blues_r", method="average")
+    _ = plt.setp(g.ax_heatmap.get_xticklabels(), rotation=340, fontsize=12, ha="left")
+    _ = plt.setp(g.ax_heatmap.get_yticklabels(), rotation=0, fontsize=12)
+    plt.savefig(output_loc, dpi=dpi, bbox_inches='tight')
+    plt.close('all')
+
+
+def read_pathway_order(file_loc):
+    """Pathways of a new line separated list in order"""
+    with open(file_loc) as f:
+        return [line.strip() for line in f if line.strip() != '']
+
+
+def read_figure_inputs(output_dir):
+    inputs_loc = path.join(output_dir, FIGURE_INPUTS)
+    if not path.isfile(inputs_loc):
+        raise ValueError('No figure inputs in %s, runs save them unless plots are turned off' % output_dir)
+    with open(inputs_loc) as f:
+        return json.load(f)
+
+
+def render_figure(output_dir, figure, figure_format='png', dpi=None, max_pathways=None, pathway_order=None):
+    """Render a figure of an output directory from its figure inputs, returns the figure's location"""
+    if figure_format not in FIGURE_FORMATS:
+        raise ValueError('Figure format must be one of %s' % ', '.join(FIGURE_FORMATS))
+    figure_inputs = read_figure_inputs(output_dir)[figure]
+    dpi = FIGURE_DPI[figure] if dpi is None else dpi
+    output_loc = path.join(output_dir, '%s.%s' % (FIGURE_NAMES[figure], figure_format))
+    if figure == 'venn':
+        make_venn(figure_inputs['sample_compounds'], figure_inputs['measured_compounds'], output_loc, dpi=dpi)
+    else:
+        pathway_enrichment_dfs = {sample: pd.read_csv(path.join(output_dir, table), sep='\t', index_col=0)
+                                  for sample, table in figure_inputs['enrichment_tables']}
+        make_enrichment_clustermap(pathway_enrichment_dfs, figure_inputs['key'], output_loc, dpi=dpi,
+                                   max_pathways=max_pathways, pathway_order=pathway_order)
+    return output_loc
+
+
+def render_figures(output_dir, logger=None, **options):
+    """Render every figure of an output directory in this process, timing each as a stage if a Logger is given"""
+    locations = dict()
+    for figure in read_figure_inputs(output_dir):
+        if logger is None:
+            locations[figure] = render_figure(output_dir, figure, **options)
+        else:
+            with logger.stage(FIGURE_STAGES[figure]):
+                locations[figure] = render_figure(output_dir, figure, **options)
+            logger[FIGURE_LOG_NAMES[figure]] = path.abspath(locations[figure])
+    return locations
+
+
+class FigureRenderer(object):
+    """Renders the figures of output directories in a pool of background processes, each figure in its own task"""
+    def __init__(self, processes=1, **options):
+        self.options = options
+        self.executor = ProcessPoolExecutor(processes)
+        self.pending = list()
+
+    def submit(self, output_dir):
+        for figure in read_figure_inputs(output_dir):
+            self.pending.append((output_dir, figure, self.executor.submit(render_figure, output_dir, figure,
+                                                                          **self.options)))
+
+    def wait(self):
+        """Locations of the figures submitted since the last wait, as a dict of output directory to a dict of figure
+        to location. Raises the error of the first figure that failed."""
+        pending, self.pending = self.pending, list()
+        locations = dict()
+        for output_dir, figure, future in pending:
+            locations.setdefault(output_dir, dict())[figure] = future.result()
+        return locations
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown()
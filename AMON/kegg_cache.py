@@ -0,0 +1,115 @@
+"""Persistent local cache of KEGG records fetched from the KEGG API.
+
+Records are stored as JSON in a SQLite database keyed by record kind, KEGG id and KEGG release so repeated runs only
+fetch records they have not seen before. Ids KEGG has no record for are stored as empty entries so they are not
+requested again either. SQLite's file locking makes the cache safe to share between many AMON
+processes on the same node. Records older than max_age seconds are refetched and the least recently used records are
+evicted when there are more than max_records.
+"""
+
+import json
+import sqlite3
+import time
+from collections import Counter
+
+from AMON.kegg_fetcher import KEGGFetcher, chunks
+
+# sqlite limits the number of parameters in a query
+QUERY_CHUNK_SIZE = 500
+
+
+class KEGGCache(object):
+    """SQLite backed cache of KEGG records, fetcher is called with missing ids and a kind and returns a record dict"""
+    def __init__(self, cache_loc, release='current', max_records=None, max_age=None, fetcher=None, timeout=600):
+        self.cache_loc = cache_loc
+        self.release = release
+        self.max_records = max_records
+        self.max_age = max_age
+        self.fetcher = KEGGFetcher().fetch_records if fetcher is None else fetcher
+        self.timeout = timeout
+        self.hits = Counter()
+        self.misses = Counter()
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS records (kind TEXT, id TEXT, release TEXT, record TEXT, '
+                               'created REAL, accessed REAL, PRIMARY KEY (kind, id, release))')
+            connection.execute('CREATE INDEX IF NOT EXISTS records_accessed ON records (accessed)')
+
+    def _connect(self, write=True):
+        connection = sqlite3.connect(self.cache_loc, timeout=self.timeout, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Transaction(connection, write)
+
+    def _read(self, connection, kind, ids):
+        """Cached records of ids, None for ids cached as not found"""
+        min_created = time.time() - self.max_age if self.max_age is not None else float('-inf')
+        records = dict()
+        for ids_chunk in chunks(list(ids), QUERY_CHUNK_SIZE):
+            query = 'SELECT id, record FROM records WHERE kind = ? AND release = ? AND created >= ? AND id IN (%s)' % \
+                    ', '.join('?' * len(ids_chunk))
+            for id_, record in connection.execute(query, [kind, self.release, min_created] + ids_chunk):
+                records[id_] = json.loads(record)
+        return records
+
+    def _write(self, connection, kind, records, now):
+        connection.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                               [(kind, id_, self.release, json.dumps(record), now, now)
+                                for id_, record in records.items()])
+
+    def _touch(self, connection, kind, ids, now):
+        connection.executemany('UPDATE records SET accessed = ? WHERE kind = ? AND id = ? AND release = ?',
+                               [(now, kind, id_, self.release) for id_ in ids])
+
+    def evict(self, connection=None):
+        if connection is None:
+            with self._connect() as connection:
+                return self.evict(connection)
+        if self.max_age is not None:
+            connection.execute('DELETE FROM records WHERE created < ?', (time.time() - self.max_age,))
+        if self.max_records is not None:
+            num_records = connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+            if num_records > self.max_records:
+                connection.execute('DELETE FROM records WHERE rowid IN (SELECT rowid FROM records ORDER BY accessed '
+                                   'LIMIT ?)', (num_records - self.max_records,))
+
+    def get_record_dict(self, kind, ids):
+        ids = set(ids)
+        with self._connect(write=False) as connection:
+            records = self._read(connection, kind, ids)
+        missing = ids - set(records)
+        self.hits[kind] += len(records)
+        self.misses[kind] += len(missing)
+        fetched = self.fetcher(missing, kind) if len(missing) > 0 else dict()
+        not_found = {id_: None for id_ in missing - set(fetched)}
+        now = time.time()
+        with self._connect() as connection:
+            self._touch(connection, kind, records.keys(), now)
+            self._write(connection, kind, fetched, now)
+            self._write(connection, kind, not_found, now)
+            self.evict(connection)
+        records = {id_: record for id_, record in records.items() if record is not None}
+        records.update(fetched)
+        return records
+
+    def log_stats(self, logger):
+        for kind in sorted(set(self.hits) | set(self.misses)):
+            logger['KEGG cache %s hits' % kind] = self.hits[kind]
+            logger['KEGG cache %s misses' % kind] = self.misses[kind]
+
+
+class _Transaction(object):
+    """Run the statements of a with block in one transaction and close the connection after, write transactions take
+    the database's write lock at the start"""
+    def __init__(self, connection, write=True):
+        self.connection = connection
+        self.write = write
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE' if self.write else 'BEGIN')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')
+        self.connection.close()
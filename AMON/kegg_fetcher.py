@@ -0,0 +1,155 @@
+"""Concurrent fetching of KEGG records from the KEGG REST API.
+
+IDs are batched into multi-entry GET requests, a bounded number of requests run at once and request starts are spaced
+to stay under a rate limit. Failed requests are retried with exponential backoff. fetch_all pipelines the four record
+kinds: reaction records for a batch of KOs are requested as soon as that batch arrives, compounds as soon as their
+reactions arrive and pathways as soon as their compounds arrive. The KOs of organisms come from one link request per
+organism with the same bounds on concurrency and rate.
+"""
+
+import asyncio
+
+from AMON.kegg_index import RECORD_PARSERS, KEGGRecords, normalize_pathway_id
+
+KEGG_REST_URL = 'http://rest.kegg.jp'
+# the KEGG REST API returns at most 10 entries per get request
+MAX_BATCH_SIZE = 10
+RETRY_STATUSES = (403, 429, 500, 502, 503, 504)
+# kinds of records fetched as the sorted list of ids of another kind linked to each id
+LINK_KINDS = {'organism': 'ko'}
+
+
+def chunks(list_, size):
+    for i in range(0, len(list_), size):
+        yield list_[i:i + size]
+
+
+class RateLimiter(object):
+    """Space the starts of requests at least 1/rate seconds apart"""
+    def __init__(self, rate=None):
+        self.interval = 1. / rate if rate else 0.
+        self.next_start = 0.
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+                now = self.next_start
+            self.next_start = now + self.interval
+
+
+class KEGGFetcher(object):
+    def __init__(self, base_url=KEGG_REST_URL, batch_size=MAX_BATCH_SIZE, max_requests=3, rate_limit=3,
+                 attempts=5, backoff=1.):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError('batch_size must be between 1 and %s' % MAX_BATCH_SIZE)
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = batch_size
+        self.max_requests = max_requests
+        self.rate_limit = rate_limit
+        self.attempts = attempts
+        self.backoff = backoff
+
+    async def _download(self, session, semaphore, rate_limiter, url):
+        import aiohttp
+        for attempt in range(self.attempts):
+            async with semaphore:
+                await rate_limiter.wait()
+                try:
+                    async with session.get(url) as response:
+                        if response.status == 200:
+                            return await response.text()
+                        elif response.status == 404:
+                            # KEGG returns not found when none of the ids exist
+                            return ''
+                        elif response.status not in RETRY_STATUSES:
+                            raise ValueError('Bad HTTP request status %s: %s\n%s' %
+                                             (response.status, response.reason, url))
+                        status = response.status
+                except aiohttp.ClientConnectionError as e:
+                    status = str(e)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise ValueError('KEGG request failed after %s attempts with %s for url %s' % (self.attempts, status, url))
+
+    async def _fetch_batch(self, session, semaphore, rate_limiter, kind, ids):
+        text = await self._download(session, semaphore, rate_limiter, '%s/get/%s' % (self.base_url, '+'.join(ids)))
+        parser = RECORD_PARSERS[kind]
+        records = [parser(raw_record) for raw_record in text.split('///')[:-1]]
+        return {record['ENTRY']: record for record in records}
+
+    async def _fetch(self, kind, ids):
+        import aiohttp
+        semaphore = asyncio.Semaphore(self.max_requests)
+        rate_limiter = RateLimiter(self.rate_limit)
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(*[self._fetch_batch(session, semaphore, rate_limiter, kind, batch)
+                                             for batch in chunks(sorted(ids), self.batch_size)])
+        return {id_: record for records in results for id_, record in records.items()}
+
+    async def _fetch_link(self, session, semaphore, rate_limiter, target, id_):
+        text = await self._download(session, semaphore, rate_limiter, '%s/link/%s/%s' % (self.base_url, target, id_))
+        # lines are the source id and the linked id, each with a database prefix
+        return sorted(set(line.split('\t')[1].split(':', 1)[-1] for line in text.splitlines() if '\t' in line))
+
+    async def _fetch_links(self, target, ids):
+        import aiohttp
+        semaphore = asyncio.Semaphore(self.max_requests)
+        rate_limiter = RateLimiter(self.rate_limit)
+        ids = sorted(ids)
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(*[self._fetch_link(session, semaphore, rate_limiter, target, id_)
+                                             for id_ in ids])
+        return {id_: linked for id_, linked in zip(ids, results) if len(linked) > 0}
+
+    def fetch_records(self, ids, kind):
+        """Fetch records of one kind, has the fetcher signature used by KEGGCache. Records of LINK_KINDS are the
+        sorted ids linked to each id and ids with nothing linked are left out like ids that are not found."""
+        if kind in LINK_KINDS:
+            return asyncio.run(self._fetch_links(LINK_KINDS[kind], set(ids)))
+        return asyncio.run(self._fetch(kind, set(ids)))
+
+    async def _fetch_all(self, kos, extra_cos):
+        import aiohttp
+        records = {kind: dict() for kind in RECORD_PARSERS}
+        requested = {kind: set() for kind in RECORD_PARSERS}
+        tasks = set()
+        semaphore = asyncio.Semaphore(self.max_requests)
+        rate_limiter = RateLimiter(self.rate_limit)
+        async with aiohttp.ClientSession() as session:
+            def request(kind, ids):
+                new_ids = sorted(set(ids) - requested[kind])
+                requested[kind].update(new_ids)
+                for batch in chunks(new_ids, self.batch_size):
+                    tasks.add(asyncio.ensure_future(fetch_and_follow(kind, batch)))
+
+            async def fetch_and_follow(kind, batch):
+                batch_records = await self._fetch_batch(session, semaphore, rate_limiter, kind, batch)
+                records[kind].update(batch_records)
+                if kind == 'ko':
+                    request('rn', [rn for record in batch_records.values()
+                                   for rn in record.get('DBLINKS', dict()).get('RN', ())])
+                elif kind == 'rn':
+                    request('co', [co for record in batch_records.values() for co in record['EQUATION'][1]])
+                elif kind == 'co':
+                    request('pathway', [normalize_pathway_id(pathway[0]) for record in batch_records.values()
+                                        for pathway in record.get('PATHWAY', ())])
+
+            request('ko', kos)
+            request('co', extra_cos)
+            try:
+                while len(tasks) > 0:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        tasks.discard(task)
+                        task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return records
+
+    def fetch_all(self, kos, extra_cos=()):
+        """Fetch KO records and follow them to their reactions, the products of those reactions and the pathways of
+        those products, plus extra_cos and their pathways"""
+        return KEGGRecords(asyncio.run(self._fetch_all(set(kos), set(extra_cos))))
@@ -0,0 +1,91 @@
+"""Streaming, filtered reading of KEGG flat files.
+
+Records in a KEGG flat file end with ``///``. The file is read in blocks and split on these terminators, and only
+records whose ENTRY id is in the requested set are passed to a record parser, so the fields of every other record
+are never parsed. A file can also be split into byte ranges that each start right after a terminator and are read in
+parallel worker processes. The records read are the same as from KEGG_parser's get_from_kegg_flat_file.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+RECORD_TERMINATOR = b'///'
+BLOCK_SIZE = 2 ** 22
+
+
+def find_record_ranges(file_loc, num_ranges, block_size=BLOCK_SIZE):
+    """Split a flat file into at most num_ranges (start, end) byte ranges of whole records"""
+    file_size = path.getsize(file_loc)
+    boundaries = [0]
+    with open(file_loc, 'rb') as f:
+        for i in range(1, num_ranges):
+            offset = max(file_size * i // num_ranges, boundaries[-1])
+            f.seek(offset)
+            # terminators can be split across blocks so each block is searched with the end of the last
+            tail = b''
+            while True:
+                block = f.read(block_size)
+                if len(block) == 0:
+                    offset = file_size
+                    break
+                found = (tail + block).find(RECORD_TERMINATOR)
+                if found != -1:
+                    offset = offset - len(tail) + found + len(RECORD_TERMINATOR)
+                    break
+                tail = block[-(len(RECORD_TERMINATOR) - 1):]
+                offset += len(block)
+            boundaries.append(offset)
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+
+def iter_raw_records(file_loc, start=0, end=None, block_size=BLOCK_SIZE):
+    """Raw bytes of each complete record between the start and end byte offsets, without its terminator"""
+    with open(file_loc, 'rb') as f:
+        f.seek(start)
+        remaining = (end - start) if end is not None else None
+        leftover = b''
+        while remaining is None or remaining > 0:
+            block = f.read(block_size if remaining is None else min(block_size, remaining))
+            if len(block) == 0:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            pieces = (leftover + block).split(RECORD_TERMINATOR)
+            # the last piece has not been terminated yet
+            leftover = pieces.pop()
+            yield from pieces
+
+
+def get_entry_id(raw_record):
+    """First word after ENTRY in a raw record, None if it does not start with an ENTRY line"""
+    fields = raw_record[:200].lstrip().split(None, 2)
+    if len(fields) < 2 or fields[0] != b'ENTRY':
+        return None
+    return fields[1].decode()
+
+
+def read_flat_file_range(file_loc, parser, ids=None, start=0, end=None):
+    """Parse the records of a byte range of a flat file, only those with ENTRY ids in ids if given"""
+    records = list()
+    for raw_record in iter_raw_records(file_loc, start, end):
+        if ids is not None and get_entry_id(raw_record) not in ids:
+            continue
+        record = parser(raw_record.decode())
+        # ids are checked on the parsed record as well in case a parser changes the ENTRY
+        if ids is None or record['ENTRY'] in ids:
+            records.append(record)
+    return records
+
+
+def read_flat_file(file_loc, parser, ids=None, processes=1):
+    """Parse the records of a KEGG flat file, only those with ENTRY ids in ids if given, with the file split into
+    byte ranges read by processes worker processes if more than one"""
+    if ids is not None:
+        ids = set(ids)
+    if processes == 1:
+        return read_flat_file_range(file_loc, parser, ids)
+    ranges = find_record_ranges(file_loc, processes)
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(read_flat_file_range, file_loc, parser, ids, start, end) for start, end in ranges]
+        return [record for future in futures for record in future.result()]
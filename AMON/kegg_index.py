@@ -0,0 +1,203 @@
+"""Precompiled on-disk index of the KEGG records used by AMON.
+
+The index stores every KO, reaction, compound and pathway identifier as an integer code and the links between them
+as CSR style adjacency arrays (an ``indptr`` and ``indices`` pair per relation). Every array is saved as a separate
+.npy file so a saved index can be memory mapped and queried without parsing any KEGG flat files.
+"""
+
+import hashlib
+import json
+from os import path, makedirs
+
+import numpy as np
+
+from KEGG_parser.parsers import parse_ko, parse_rn, parse_co, parse_pathway
+
+from AMON.kegg_flat_file import read_flat_file
+
+INDEX_VERSION = 1
+KINDS = ('ko', 'rn', 'co', 'pathway')
+RECORD_PARSERS = {'ko': parse_ko, 'rn': parse_rn, 'co': parse_co, 'pathway': parse_pathway}
+# relation name: (source kind, target kind)
+RELATIONS = {
+    'ko_rn': ('ko', 'rn'),
+    'rn_substrate': ('rn', 'co'),
+    'rn_product': ('rn', 'co'),
+    'co_rn': ('co', 'rn'),
+    'co_pathway': ('co', 'pathway'),
+    'pathway_co': ('pathway', 'co'),
+}
+METADATA_FILE = 'metadata.json'
+
+
+def normalize_pathway_id(pathway_id):
+    """Compound records link to map pathways while pathway records are ko pathways, store both as ko"""
+    return pathway_id.replace('map', 'ko')
+
+
+def make_csr(lists_of_codes):
+    indptr = np.zeros(len(lists_of_codes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(codes) for codes in lists_of_codes])
+    if indptr[-1] > 0:
+        indices = np.concatenate([np.asarray(codes, dtype=np.int32) for codes in lists_of_codes])
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+    return indptr, indices
+
+
+class KEGGIndex(object):
+    """Integer coded KEGG records with CSR adjacency arrays between KOs, reactions, compounds and pathways"""
+    def __init__(self, arrays, metadata=None):
+        self.arrays = arrays
+        self.metadata = dict() if metadata is None else metadata
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        with open(path.join(index_dir, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        if metadata.get('version') != INDEX_VERSION:
+            raise ValueError('KEGG index at %s has version %s, expected %s' %
+                             (index_dir, metadata.get('version'), INDEX_VERSION))
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(path.join(index_dir, '%s.npy' % name), mmap_mode=mmap_mode)
+                  for name in metadata['arrays']}
+        return cls(arrays, metadata)
+
+    def save(self, index_dir):
+        makedirs(index_dir, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(path.join(index_dir, '%s.npy' % name), np.asarray(array))
+        metadata = dict(self.metadata)
+        metadata['version'] = INDEX_VERSION
+        metadata['arrays'] = sorted(self.arrays.keys())
+        with open(path.join(index_dir, METADATA_FILE), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+    def ids(self, kind):
+        return self.arrays['%s_ids' % kind]
+
+    def has_record(self, kind):
+        return self.arrays['%s_has_record' % kind]
+
+    def lookup(self, kind, ids):
+        """Get integer codes for ids of a kind, ids not in the index get -1"""
+        vocab = self.ids(kind)
+        # ids keep their own width, cast to the vocabulary's fixed width longer ids would be cut to match shorter ones
+        ids = np.asarray(list(ids), dtype=str)
+        if len(vocab) == 0 or len(ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        codes = np.searchsorted(vocab, ids)
+        codes[codes == len(vocab)] = 0
+        codes[vocab[codes] != ids] = -1
+        return codes
+
+    def neighbors(self, relation, code):
+        indptr = self.arrays['%s_indptr' % relation]
+        return self.arrays['%s_indices' % relation][indptr[code]:indptr[code + 1]]
+
+    def neighbor_ids(self, relation, code):
+        target_ids = self.ids(RELATIONS[relation][1])
+        return [str(target_ids[i]) for i in self.neighbors(relation, code)]
+
+    def _make_record(self, kind, code):
+        id_ = str(self.ids(kind)[code])
+        record = {'ENTRY': id_}
+        if kind == 'ko':
+            rns = self.neighbor_ids('ko_rn', code)
+            if len(rns) > 0:
+                record['DBLINKS'] = {'RN': rns}
+        elif kind == 'rn':
+            record['EQUATION'] = [self.neighbor_ids('rn_substrate', code), self.neighbor_ids('rn_product', code)]
+        elif kind == 'co':
+            pathways = self.neighbor_ids('co_pathway', code)
+            if len(pathways) > 0:
+                record['PATHWAY'] = [(pathway, '') for pathway in pathways]
+            rns = self.neighbor_ids('co_rn', code)
+            if len(rns) > 0:
+                record['REACTION'] = rns
+        elif kind == 'pathway':
+            record['NAME'] = str(self.arrays['pathway_names'][code])
+            cos = self.neighbor_ids('pathway_co', code)
+            if len(cos) > 0:
+                record['COMPOUND'] = [(co, '') for co in cos]
+        return record
+
+    def get_record_dict(self, kind, ids):
+        """Build records shaped like KEGG_parser output, holding only the fields AMON uses"""
+        if kind == 'pathway':
+            ids = [normalize_pathway_id(id_) for id_ in ids]
+        has_record = self.has_record(kind)
+        return {record['ENTRY']: record for record in
+                (self._make_record(kind, code) for code in self.lookup(kind, set(ids))
+                 if code >= 0 and has_record[code])}
+
+
+class KEGGRecords(object):
+    """Already loaded KEGG records with the same get_record_dict interface as KEGGIndex"""
+    def __init__(self, record_dicts):
+        self.record_dicts = record_dicts
+
+    @property
+    def metadata(self):
+        """Hash of the records of each kind, standing in for the metadata of a KEGGIndex in stage cache keys"""
+        return {kind: hashlib.sha256(json.dumps(records, sort_keys=True, default=str).encode()).hexdigest()
+                for kind, records in sorted(self.record_dicts.items())}
+
+    def get_record_dict(self, kind, ids):
+        records = self.record_dicts[kind]
+        if kind == 'pathway':
+            ids = [normalize_pathway_id(id_) for id_ in ids]
+        return {id_: records[id_] for id_ in set(ids) if id_ in records}
+
+
+def build_index(ko_file_loc, rn_file_loc, co_file_loc, pathway_file_loc, processes=1):
+    """Parse the four KEGG flat files once and compile them into a KEGGIndex, each file is split between processes"""
+    ko_records = read_flat_file(ko_file_loc, parse_ko, processes=processes)
+    rn_records = read_flat_file(rn_file_loc, parse_rn, processes=processes)
+    co_records = read_flat_file(co_file_loc, parse_co, processes=processes)
+    pathway_records = read_flat_file(pathway_file_loc, parse_pathway, processes=processes)
+    for pathway_record in pathway_records:
+        pathway_record['ENTRY'] = normalize_pathway_id(pathway_record['ENTRY'])
+
+    links = {
+        'ko_rn': {record['ENTRY']: record.get('DBLINKS', dict()).get('RN', list()) for record in ko_records},
+        'rn_substrate': {record['ENTRY']: record.get('EQUATION', (list(), list()))[0] for record in rn_records},
+        'rn_product': {record['ENTRY']: record.get('EQUATION', (list(), list()))[1] for record in rn_records},
+        'co_rn': {record['ENTRY']: record.get('REACTION', list()) for record in co_records},
+        'co_pathway': {record['ENTRY']: [normalize_pathway_id(pathway[0]) for pathway in record.get('PATHWAY', ())]
+                       for record in co_records},
+        'pathway_co': {record['ENTRY']: [compound[0] for compound in record.get('COMPOUND', ())]
+                       for record in pathway_records},
+    }
+    entries = {'ko': {record['ENTRY'] for record in ko_records},
+               'rn': {record['ENTRY'] for record in rn_records},
+               'co': {record['ENTRY'] for record in co_records},
+               'pathway': {record['ENTRY'] for record in pathway_records}}
+
+    # vocabularies hold every id of a kind seen anywhere so links to ids without a record are kept
+    all_ids = {kind: set(kind_entries) for kind, kind_entries in entries.items()}
+    for relation, (source, target) in RELATIONS.items():
+        for source_id, target_ids in links[relation].items():
+            all_ids[source].add(source_id)
+            all_ids[target].update(target_ids)
+
+    arrays = dict()
+    codes = dict()
+    for kind in KINDS:
+        vocab = np.array(sorted(all_ids[kind]), dtype=str)
+        arrays['%s_ids' % kind] = vocab
+        arrays['%s_has_record' % kind] = np.array([id_ in entries[kind] for id_ in vocab], dtype=bool)
+        codes[kind] = {id_: i for i, id_ in enumerate(vocab)}
+    for relation, (source, target) in RELATIONS.items():
+        target_codes = codes[target]
+        relation_links = links[relation]
+        indptr, indices = make_csr([[target_codes[target_id] for target_id in relation_links.get(source_id, ())]
+                                    for source_id in arrays['%s_ids' % source]])
+        arrays['%s_indptr' % relation] = indptr
+        arrays['%s_indices' % relation] = indices
+    pathway_names = {record['ENTRY']: record.get('NAME', record['ENTRY']) for record in pathway_records}
+    arrays['pathway_names'] = np.array([pathway_names.get(id_, id_) for id_ in arrays['pathway_ids']], dtype=str)
+
+    metadata = {'sources': {kind: path.abspath(file_loc) for kind, file_loc in
+                            zip(KINDS, (ko_file_loc, rn_file_loc, co_file_loc, pathway_file_loc))}}
+    return KEGGIndex(arrays, metadata)
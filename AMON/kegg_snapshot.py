@@ -0,0 +1,59 @@
+"""Snapshots of the KEGG records used in a run.
+
+A snapshot is a gzip compressed stream with a header line followed by one line per record holding its kind, id and
+the record as JSON, the same record encoding used by the KEGG cache. Records are written one at a time as each kind
+is looked up so a whole record dict is never serialized at once, and a snapshot can be loaded back as the records
+of a later run.
+"""
+
+import gzip
+import json
+
+from AMON.kegg_index import KINDS, KEGGRecords
+
+SNAPSHOT_FORMAT = 'AMON KEGG snapshot'
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotWriter(object):
+    """Write records to a snapshot as they are looked up, each id of a kind is written once"""
+    def __init__(self, snapshot_loc):
+        self.snapshot_loc = snapshot_loc
+        self.file = gzip.open(snapshot_loc, 'wt')
+        self.file.write(json.dumps({'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION}) + '\n')
+        self.written = {kind: set() for kind in KINDS}
+
+    def write_records(self, kind, record_dict):
+        for id_, record in record_dict.items():
+            if id_ not in self.written[kind]:
+                self.file.write(json.dumps([kind, id_, record]) + '\n')
+                self.written[kind].add(id_)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_snapshot(snapshot_loc):
+    """Read a snapshot into KEGGRecords"""
+    record_dicts = {kind: dict() for kind in KINDS}
+    with gzip.open(snapshot_loc, 'rt') as f:
+        try:
+            header = json.loads(f.readline())
+        except (ValueError, OSError):
+            # not json or not gzip compressed
+            header = None
+        if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError('%s is not an AMON KEGG snapshot' % snapshot_loc)
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError('KEGG snapshot version %s is not supported, expected version %s' %
+                             (header['version'], SNAPSHOT_VERSION))
+        for line in f:
+            kind, id_, record = json.loads(line)
+            record_dicts[kind][id_] = record
+    return KEGGRecords(record_dicts)
@@ -0,0 +1,84 @@
+"""KOs of many organisms at once, for reference panels used as the other gene set.
+
+Organisms are KEGG organism codes, whose KOs are fetched from the KEGG API with one link request per organism and a
+bounded number of requests at once and kept in the local KEGG cache if one is given, or KEGG organism flat files,
+which are read in parallel processes. The KOs of all organisms are written as one sparse biom table with KOs as
+observations and organisms as samples, which read_in_ids reads like any other gene set.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.kegg_flat_file import iter_raw_records
+from AMON.sparse_engine import IncidenceMatrix
+
+ORGANISM_KIND = 'organism'
+
+
+def get_gene_ko(raw_record):
+    """KO of a gene's raw record, the first word of the last line of its ORTHOLOGY field as with parse_organism, None
+    if it has no ORTHOLOGY"""
+    ko = None
+    field = None
+    for line in raw_record.strip().split('\n'):
+        name = line[:12].strip()
+        if name != '':
+            field = name
+        if field == 'ORTHOLOGY' and len(line[12:].split()) > 0:
+            ko = line[12:].split()[0]
+    return ko
+
+
+def read_organism_flat_file(file_loc):
+    """KOs of the genes of a KEGG organism flat file"""
+    kos = set()
+    for raw_record in iter_raw_records(file_loc):
+        # only genes with an ORTHOLOGY field are looked at line by line
+        if b'ORTHOLOGY' in raw_record:
+            ko = get_gene_ko(raw_record.decode())
+            if ko is not None:
+                kos.add(ko)
+    return kos
+
+
+def get_organism_name(file_loc):
+    return path.splitext(path.basename(file_loc))[0]
+
+
+def get_organism_kos(organisms, from_flat_files=False, processes=1, kegg_cache=None, kegg_fetcher=None):
+    """Dict of organism to KOs for KEGG organism codes, or for KEGG organism flat files named after their file name
+    without extension if from_flat_files. Flat files are read in processes worker processes if more than one and KOs
+    of organism codes come from the KEGG cache if given, otherwise from the KEGG API."""
+    if from_flat_files:
+        names = [get_organism_name(file_loc) for file_loc in organisms]
+        if len(set(names)) < len(names):
+            raise ValueError('Organism flat files must have different file names')
+        if processes > 1 and len(organisms) > 1:
+            with ProcessPoolExecutor(processes) as executor:
+                organism_kos = list(executor.map(read_organism_flat_file, organisms))
+        else:
+            organism_kos = [read_organism_flat_file(file_loc) for file_loc in organisms]
+        return dict(zip(names, organism_kos))
+    if kegg_cache is not None:
+        organism_kos = kegg_cache.get_record_dict(ORGANISM_KIND, organisms)
+    else:
+        if kegg_fetcher is None:
+            kegg_fetcher = KEGGFetcher()
+        organism_kos = kegg_fetcher.fetch_records(organisms, ORGANISM_KIND)
+    missing = [organism for organism in organisms if organism not in organism_kos]
+    if len(missing) > 0:
+        raise ValueError('No KOs found in KEGG for organisms %s' % ', '.join(missing))
+    return {organism: set(organism_kos[organism]) for organism in organisms}
+
+
+def write_organism_table(organism_kos, output_loc):
+    """Write a dict of organism to KOs as a sparse HDF5 biom table with KOs as observations and organisms as
+    samples"""
+    import h5py
+    from biom import Table
+    ko_organisms = IncidenceMatrix.from_dict_of_lists(organism_kos).transpose()
+    table = Table(ko_organisms.matrix.astype(float), [str(ko) for ko in ko_organisms.row_ids],
+                  [str(organism) for organism in ko_organisms.column_ids])
+    with h5py.File(output_loc, 'w') as f:
+        table.to_hdf5(f, 'AMON')
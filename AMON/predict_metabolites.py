@@ -1,44 +1,216 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib_venn import venn2, venn2_circles, venn3, venn3_circles
-from scipy.stats import hypergeom
-from os import path, makedirs
-from statsmodels.sandbox.stats.multicomp import multipletests
+from os import path, makedirs, getpid
+from tempfile import TemporaryDirectory
 import numpy as np
-from biom import load_table
-import seaborn as sns
 import json
-from collections import defaultdict, OrderedDict
+import csv
+import sys
+import time
+import cProfile
+from scipy import sparse
+from collections import defaultdict, OrderedDict, Counter
+from contextlib import contextmanager
 from datetime import datetime
 
-from KEGG_parser.parsers import parse_ko, parse_rn, parse_co, parse_pathway
-from KEGG_parser.downloader import get_kegg_record_dict
+from AMON.kegg_index import KEGGIndex, RECORD_PARSERS
+from AMON.kegg_cache import KEGGCache
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.kegg_flat_file import read_flat_file
+from AMON.kegg_snapshot import SnapshotWriter, load_snapshot
+from AMON.stage_cache import StageCache, matrix_to_arrays, arrays_to_matrix
+from AMON.vocabulary import Vocabulary, is_encoded, follow
+from AMON.sparse_engine import IncidenceMatrix, get_sample_rns, get_sample_cos, make_ko_rn_matrix, make_rn_co_matrix
+from AMON.chunked import iter_biom_chunks, iter_table_chunks, save_chunk, load_chunk, iter_origin_blocks, \
+    write_origin_table_chunks
+from AMON.enrichment import calculate_enrichment_batch, make_pathway_co_matrix, split_enrichment_table, \
+    make_unique_masks, PermutationNull, NULL_MODELS
+from AMON.robustness import ROBUSTNESS_METHODS, estimate_robustness, read_in_count_matrix
+# plotting functions live in AMON.figures and are still importable from here
+from AMON.figures import FIGURE_INPUTS, FIGURE_LOG_NAMES, FigureRenderer, make_venn, make_enrichment_clustermap, \
+    render_figures
 
-sns.set()
+# plotting, statistics, biom and KEGG download libraries are slow to import so they are imported where they are used
 
-# TODO: take multiple files
+
+def get_peak_rss():
+    """Peak resident set size of this process in MB since it started or since the last reset_peak_rss(), None where
+    it can not be read"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on linux
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size to the current one, False where the kernel does not allow it (only linux
+    does)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
 
 
 class Logger(OrderedDict):
-    """"""
-    def __init__(self, output):
+    """Log of a run, with the wall time, CPU time, peak memory and item counts of each named stage.
+
+    The peak memory of a stage is its own where the peak resident set size can be reset when it starts and None
+    otherwise, the process peak is the peak of the whole run up to the end of the stage. Stages running at the same
+    time in threads share one peak.
+    """
+    def __init__(self, output, stage_output=None, stage_format='json', profile_output=None):
         super(Logger, self).__init__()
+        if stage_format not in ('json', 'chrome'):
+            raise ValueError('stage_format must be json or chrome')
         self.output_file = output
+        self.stage_output = stage_output
+        self.stage_format = stage_format
+        self.profile_output = profile_output
+        self.stages = list()
+        self.profiles = dict()
+        # peaks of the stages open now, outer stages keep the peaks of the stages inside them
+        self.open_peaks = list()
+        self.process_peak_rss = None
         self['start time'] = datetime.now()
+        self.start_counter = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with block as a stage, item counts can be added to the yielded dict"""
+        counts = OrderedDict()
+        profiler = cProfile.Profile() if self.profile_output is not None else None
+        self.update_peaks()
+        own_peak = reset_peak_rss()
+        self.open_peaks.append(get_peak_rss())
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield counts
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profiles[name] = profiler
+            self.update_peaks()
+            peak_rss = self.open_peaks.pop()
+            self.stages.append(OrderedDict([('name', name), ('start', start_wall - self.start_counter),
+                                            ('wall time', time.perf_counter() - start_wall),
+                                            ('cpu time', time.process_time() - start_cpu),
+                                            ('peak rss', peak_rss if own_peak else None),
+                                            ('process peak rss', self.process_peak_rss), ('counts', counts)]))
+
+    def update_peaks(self):
+        """Fold the peak since the last reset into the peaks of the open stages and of the process"""
+        peak_rss = get_peak_rss()
+        if peak_rss is None:
+            return
+        self.open_peaks = [peak_rss if open_peak is None else max(open_peak, peak_rss)
+                           for open_peak in self.open_peaks]
+        self.process_peak_rss = peak_rss if self.process_peak_rss is None else max(self.process_peak_rss, peak_rss)
+
+    def output_stages(self):
+        if self.stage_format == 'chrome':
+            events = [{'name': stage['name'], 'ph': 'X', 'pid': getpid(), 'tid': 0,
+                       'ts': stage['start'] * 1e6, 'dur': stage['wall time'] * 1e6,
+                       'args': {'cpu time': stage['cpu time'], 'peak rss': stage['peak rss'],
+                                'process peak rss': stage['process peak rss'], **stage['counts']}}
+                      for stage in self.stages]
+            stage_json = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        else:
+            stage_json = {'stages': self.stages}
+        with open(self.stage_output, 'w') as f:
+            json.dump(stage_json, f, indent=2)
+
+    def output_profile(self):
+        slowest_stage = max(self.stages, key=lambda stage: stage['wall time'])['name']
+        self['Profiled stage'] = slowest_stage
+        self.profiles[slowest_stage].dump_stats(self.profile_output)
 
     def output_log(self):
+        if self.stage_output is not None:
+            self.output_stages()
+        if self.profile_output is not None and len(self.profiles) > 0:
+            self.output_profile()
         with open(self.output_file, 'w') as f:
             self['finish time'] = datetime.now()
             self['elapsed time'] = self['finish time'] - self['start time']
             for key, value in self.items():
                 f.write(key + ': ' + str(value) + '\n')
+            for stage in self.stages:
+                peak_rss, process_peak_rss = ['NA' if stage[key] is None else '%.1fMB' % stage[key]
+                                              for key in ('peak rss', 'process peak rss')]
+                fields = ['wall time %.3fs' % stage['wall time'], 'cpu time %.3fs' % stage['cpu time'],
+                          'peak rss %s' % peak_rss, 'process peak rss %s' % process_peak_rss] + \
+                    ['%s %s' % item for item in stage['counts'].items()]
+                f.write('stage ' + stage['name'] + ': ' + ', '.join(fields) + '\n')
 
 
 def p_adjust(pvalues, method='fdr_bh'):
+    from statsmodels.sandbox.stats.multicomp import multipletests
     res = multipletests(pvalues, method=method)
     return np.array(res[1], dtype=float)
 
 
+def sniff_delimiter(file_loc):
+    """Find the delimiter of a tsv or csv from its header line only"""
+    with open(file_loc) as f:
+        header = f.readline()
+    try:
+        return csv.Sniffer().sniff(header, delimiters=',\t').delimiter
+    except csv.Error:
+        return '\t' if '\t' in header else ','
+
+
+def read_in_id_matrix(file_loc, samples_are_columns=False, chunksize=10000):
+    """
+    Read a tsv/csv or biom table into a samples x ids IncidenceMatrix without making a dense copy of the table. Tables
+    are read in chunks of rows with the C parser and biom tables from the column structure of their sparse matrix.
+    """
+    if file_loc.endswith('.tsv') or file_loc.endswith('.csv'):
+        row_ids = list()
+        rows = list()
+        columns = list()
+        column_ids = None
+        for chunk in pd.read_csv(file_loc, sep=sniff_delimiter(file_loc), index_col=0, chunksize=chunksize):
+            chunk_rows, chunk_columns = np.nonzero(chunk.to_numpy().astype(bool))
+            rows.append(chunk_rows + len(row_ids))
+            columns.append(chunk_columns)
+            # ids are strings whatever pandas infers, as they are in biom tables and the stage cache
+            row_ids += [str(row_id) for row_id in chunk.index]
+            column_ids = list(chunk.columns)
+        if column_ids is None:
+            column_ids = list(pd.read_csv(file_loc, sep=sniff_delimiter(file_loc), index_col=0, nrows=0).columns)
+        rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=int)
+        columns = np.concatenate(columns) if len(columns) > 0 else np.zeros(0, dtype=int)
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)),
+                                   shape=(len(row_ids), len(column_ids)))
+        id_matrix = IncidenceMatrix(matrix, row_ids, column_ids)
+        if samples_are_columns:
+            id_matrix = id_matrix.transpose()
+        return id_matrix
+    elif file_loc.endswith('.biom'):
+        from biom import load_table
+        id_table = load_table(file_loc)
+        # biom matrices are observations x samples
+        matrix = id_table.matrix_data.transpose().tocsr()
+        matrix.eliminate_zeros()
+        return IncidenceMatrix(matrix, id_table.ids(axis='sample'), id_table.ids(axis='observation'))
+    else:
+        raise ValueError('Input file %s can not be read as a table.' % file_loc)
+
+
 def read_in_ids(file_loc, keep_separated=False, samples_are_columns=False, name=None):
     """
     Read in kos from whitespace separated list (.txt), tsv with KOs as row headers (.tsv/.csv) or biom table (.biom).
@@ -48,36 +220,96 @@ def read_in_ids(file_loc, keep_separated=False, samples_are_columns=False, name=
             raise ValueError('Name must be given if giving .txt list')
         return {name: set([i.strip() for i in open(file_loc).read().split()])}
     elif (file_loc.endswith('.tsv') or file_loc.endswith('.csv')) and keep_separated:
-        genome_table = pd.read_table(file_loc, sep=None, index_col=0, engine='python')
-        samples_dict = dict()
-        if samples_are_columns:
-            genome_table = genome_table.transpose()
-        for sample in genome_table.index:
-            samples_dict[sample] = set(genome_table.columns[genome_table.loc[sample].astype(bool)])
-        return samples_dict
+        return read_in_id_matrix(file_loc, samples_are_columns=samples_are_columns).to_dict_of_sets()
     elif file_loc.endswith('.tsv') or file_loc.endswith('.csv'):
         if name is None:
             raise ValueError('Name must be given if giving .tsv or .csv and not separating')
-        return {name: set(pd.read_table(file_loc, sep=None, index_col=0, engine='python').columns)}
+        # only the header is needed for the ids
+        return {name: set(pd.read_csv(file_loc, sep=sniff_delimiter(file_loc), index_col=0, nrows=0).columns)}
     elif file_loc.endswith('.biom') and keep_separated:
-        id_table = load_table(file_loc)
-        samples_dict = dict()
-        for data, sample, _ in id_table.iter(axis='sample'):
-            samples_dict[sample] = set(id_table.ids(axis='observation')[data.astype(bool)])
-        return samples_dict
+        return read_in_id_matrix(file_loc).to_dict_of_sets()
     elif file_loc.endswith('.biom'):
         if name is None:
             raise ValueError('Name must be given if giving .biom and not separating')
+        from biom import load_table
         id_table = load_table(file_loc)
-        # first remove KO's which aren't present in any samples
-        ids_to_keep = id_table.ids(axis='observation')[id_table.sum(axis='observation') > 0]
-        id_table.filter(ids_to_keep, axis='observation', inplace=True)
-        return {name: set(id_table.ids(axis='observation'))}
+        # remove KO's which aren't present in any samples
+        present = np.asarray(id_table.matrix_data.sum(axis=1)).ravel() > 0
+        return {name: set(id_table.ids(axis='observation')[present])}
+    else:
+        raise ValueError('Input file %s does not have a parsable file ending.' % file_loc)
+
+
+def read_sample_groups(file_loc, group_by):
+    """Dict of sample to its value of the group_by column of a tsv or csv of sample metadata with samples as rows,
+    samples without a value are left out"""
+    metadata = pd.read_csv(file_loc, sep=sniff_delimiter(file_loc), index_col=0, dtype=str)
+    if group_by not in metadata.columns:
+        raise ValueError('Sample metadata %s has no column %s' % (file_loc, group_by))
+    groups = metadata[group_by].dropna()
+    return dict(zip(groups.index.astype(str), groups))
+
+
+def group_samples(sample_ids, sample_groups, group_rule='any'):
+    """Dict of group to ids of a samples x ids IncidenceMatrix aggregated with IncidenceMatrix.group_rows and the
+    number of samples left out because they have no group"""
+    grouped = np.array([sample in sample_groups for sample in sample_ids.row_ids], dtype=bool)
+    grouped_ids = sample_ids.select_rows(grouped).group_rows(sample_groups, group_rule).to_dict_of_sets()
+    return grouped_ids, int(np.sum(~grouped))
+
+
+def read_in_grouped_ids(file_loc, sample_groups, group_rule='any', samples_are_columns=False, name=None):
+    """Dict of group to ids from the samples of a file with group_samples and the number of samples without a group,
+    tables are read into a single sparse matrix so samples are never held as separate sets"""
+    if file_loc.endswith('.txt'):
+        sample_ids = IncidenceMatrix.from_dict_of_lists(read_in_ids(file_loc, name=name))
     else:
-        raise ValueError('Input file %s does not have a parsable file ending.')
+        sample_ids = read_in_id_matrix(file_loc, samples_are_columns=samples_are_columns)
+    return group_samples(sample_ids, sample_groups, group_rule)
 
 
-def get_rns_from_kos(dict_of_kos: dict, ko_dict: dict):
+def iter_sample_chunks(file_loc, chunksize, keep_separated=False, samples_are_columns=False, name=None):
+    """Samples x KOs IncidenceMatrix for each chunk of at most chunksize samples, inputs that can not be read a chunk
+    of samples at a time are read whole as a single chunk"""
+    if keep_separated and file_loc.endswith('.biom'):
+        import h5py
+        if h5py.is_hdf5(file_loc):
+            return iter_biom_chunks(file_loc, chunksize)
+    elif keep_separated and (file_loc.endswith('.tsv') or file_loc.endswith('.csv')) and not samples_are_columns:
+        return iter_table_chunks(file_loc, chunksize, sniff_delimiter(file_loc))
+    return iter([IncidenceMatrix.from_dict_of_lists(read_in_ids(file_loc, keep_separated, samples_are_columns, name))])
+
+
+def get_records(ids, kind, file_loc=None, kegg_index=None, kegg_cache=None, kegg_fetcher=None,
+                flat_file_processes=1, kegg_records=None):
+    """Get KEGG records of a kind ('ko', 'rn', 'co' or 'pathway') from a KEGG index if given, otherwise from a KEGG
+    flat file, the local KEGG cache or the KEGG API. If records already loaded are given only ids missing from them
+    are looked up."""
+    if kegg_records is not None:
+        records = kegg_records.get_record_dict(kind, ids)
+        missing = set(ids) - set(records)
+        if len(missing) > 0:
+            records.update(get_records(missing, kind, file_loc, kegg_index, kegg_cache, kegg_fetcher,
+                                       flat_file_processes))
+        return records
+    if kegg_index is not None:
+        return kegg_index.get_record_dict(kind, ids)
+    if file_loc is not None:
+        records = read_flat_file(file_loc, RECORD_PARSERS[kind], ids, processes=flat_file_processes)
+        return {record['ENTRY']: record for record in records}
+    if kegg_cache is not None:
+        return kegg_cache.get_record_dict(kind, ids)
+    if kegg_fetcher is None:
+        kegg_fetcher = KEGGFetcher()
+    return kegg_fetcher.fetch_records(ids, kind)
+
+
+def get_rns_from_kos(dict_of_kos: dict, ko_dict: dict, vocabulary=None):
+    """Reactions of each sample's KOs, as arrays of codes if a Vocabulary is given and the KOs are encoded in it"""
+    if vocabulary is not None:
+        ko_rns = vocabulary.encode_relation({ko: ko_record['DBLINKS'].get('RN', ()) for ko, ko_record in ko_dict.items()
+                                             if 'DBLINKS' in ko_record})
+        return {sample: follow(ko_rns, kos) for sample, kos in dict_of_kos.items()}
     sample_rns = dict()
     for sample, list_of_kos in dict_of_kos.items():
         reaction_set = list()
@@ -92,12 +324,26 @@ def get_rns_from_kos(dict_of_kos: dict, ko_dict: dict):
     return sample_rns
 
 
-def get_products_from_rns(dict_of_rns: dict, rn_dict: dict):
+def get_products_from_rns(dict_of_rns: dict, rn_dict: dict, vocabulary=None):
+    """Products of each sample's reactions, as arrays of codes if a Vocabulary is given and the reactions are encoded
+    in it"""
+    if vocabulary is not None:
+        rn_products = vocabulary.encode_relation({rn: rn_record['EQUATION'][1] for rn, rn_record in rn_dict.items()})
+        return {sample: follow(rn_products, rns) for sample, rns in dict_of_rns.items()}
     return {sample: set([co for rn in list_of_rns for co in rn_dict[rn]['EQUATION'][1]])
             for sample, list_of_rns in dict_of_rns.items()}
 
 
 def reverse_dict_of_lists(dict_of_lists):
+    if is_encoded(dict_of_lists):
+        # group keys by code with one stable sort of every code
+        keys = list(dict_of_lists.keys())
+        codes = np.concatenate([np.asarray(values, dtype=np.int32) for values in dict_of_lists.values()])
+        key_positions = np.repeat(np.arange(len(keys)), [len(values) for values in dict_of_lists.values()])
+        order = np.argsort(codes, kind='stable')
+        unique_codes, starts = np.unique(codes[order], return_index=True)
+        groups = np.split(key_positions[order], starts[1:])
+        return {int(code): [keys[i] for i in group] for code, group in zip(unique_codes, groups)}
     reversed_dict = defaultdict(list)
     for key, list_ in dict_of_lists.items():
         for item in list_:
@@ -105,16 +351,44 @@ def reverse_dict_of_lists(dict_of_lists):
     return reversed_dict
 
 
-def make_compound_origin_table(sample_cos_produced: dict, cos_measured=None):
-    columns = list(sample_cos_produced.keys())
-    rows = list()
-    cos_to_samples_dict = reverse_dict_of_lists(sample_cos_produced)
-    for co, samples in cos_to_samples_dict.items():
-        rows.append([sample in samples for sample in columns])
-    table = pd.DataFrame(rows, index=cos_to_samples_dict.keys(), columns=columns)
+def make_compound_origin_matrix(sample_cos_produced, cos_measured=None):
+    """Compounds x samples IncidenceMatrix of the compounds produced by any sample, with a detected column if
+    cos_measured is given. sample_cos_produced can be a dict of lists or a samples x compounds IncidenceMatrix."""
+    if not isinstance(sample_cos_produced, IncidenceMatrix):
+        sample_cos_produced = IncidenceMatrix.from_dict_of_lists(sample_cos_produced)
+    origin_matrix = sample_cos_produced.transpose()
+    origin_matrix = origin_matrix.select_rows(origin_matrix.row_counts() > 0)
     if cos_measured is not None:
-        table['detected'] = [co in cos_measured for co in table.index]
-    return table
+        cos_measured = set(cos_measured)
+        detected = sparse.csr_matrix(np.array([[co in cos_measured] for co in origin_matrix.row_ids], dtype=bool))
+        origin_matrix = IncidenceMatrix(sparse.hstack([origin_matrix.matrix, detected]), origin_matrix.row_ids,
+                                        origin_matrix.column_ids + ['detected'])
+    return origin_matrix
+
+
+def make_compound_origin_table(sample_cos_produced, cos_measured=None):
+    origin_matrix = make_compound_origin_matrix(sample_cos_produced, cos_measured)
+    return pd.DataFrame(origin_matrix.matrix.toarray(), index=origin_matrix.row_ids, columns=origin_matrix.column_ids)
+
+
+def write_origin_table(origin_matrix, output_loc, chunksize=10000):
+    """Write an origin IncidenceMatrix as a tsv of True/False values, densifying only chunksize rows at a time"""
+    with open(output_loc, 'w') as f:
+        f.write('\t'.join([''] + [str(column_id) for column_id in origin_matrix.column_ids]) + '\n')
+        for start in range(0, origin_matrix.shape[0], chunksize):
+            chunk = np.where(origin_matrix.matrix[start:start + chunksize].toarray(), 'True', 'False')
+            f.writelines('%s\t%s\n' % (row_id, '\t'.join(row))
+                         for row_id, row in zip(origin_matrix.row_ids[start:start + chunksize], chunk))
+
+
+def write_origin_table_biom(origin_matrix, output_loc):
+    """Write an origin IncidenceMatrix as a sparse HDF5 biom table with compounds as observations"""
+    import h5py
+    from biom import Table
+    table = Table(origin_matrix.matrix.astype(float), [str(row_id) for row_id in origin_matrix.row_ids],
+                  [str(column_id) for column_id in origin_matrix.column_ids])
+    with h5py.File(output_loc, 'w') as f:
+        table.to_hdf5(f, 'AMON')
 
 
 def merge_dicts_of_lists(*dicts):
@@ -125,77 +399,58 @@ def merge_dicts_of_lists(*dicts):
     return merged_dicts
 
 
+# fill colors of ids only found in one of more than two samples or groups, ids found in several are shaded from the
+# first to the second of SHARED_COLOR_RANGE by the fraction of them they are found in
+GROUP_COLORS = ('#1f78b4', '#e31a1c', '#6a3d9a', '#b15928', '#a6cee3', '#fb9a99', '#cab2d6', '#ffff99', '#17becf',
+                '#7f7f7f')
+SHARED_COLOR_RANGE = ('#c7e9c0', '#00441b')
+
+
+def shade_colors(fractions, color_range=SHARED_COLOR_RANGE):
+    """Hex colors between the two hex colors of color_range at each fraction"""
+    start, end = (np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)]) for color in color_range)
+    rgb = np.rint(start + np.asarray(fractions, dtype=float)[:, np.newaxis] * (end - start)).astype(int)
+    return np.array(['#%02x%02x%02x' % tuple(channels) for channels in rgb], dtype=object)
+
+
 def make_kegg_mapper_input(sample_ids, detected_ids=None, origin_colors=('blue', 'green', 'yellow'),
-                           detected_color='orange'):
-    samples = list(sample_ids.keys())
-    microbe_ids = sample_ids[samples[0]]
-    if len(samples) == 2:
-        host_ids = sample_ids[samples[1]]
-    else:
-        host_ids = ()
-    if detected_ids is None:
-        detected_ids = ()
-    ids = list()
-    colors = list()
-    for id_ in set(microbe_ids) | set(host_ids) | set(detected_ids):
-        # save id
-        ids.append(id_)
-        # check where id is present
-        microbe_present = id_ in microbe_ids
-        host_present = id_ in host_ids
-        detected_present = id_ in detected_ids
-        origin_color = None
-        detect_color = None
-        if microbe_present and host_present:
-            origin_color = origin_colors[1]
-        elif microbe_present:
-            origin_color = origin_colors[0]
-        elif host_present:
-            origin_color = origin_colors[2]
-        else:
-            pass
-        if detected_present:
-            detect_color = detected_color
-        color = ''
-        if origin_color is not None:
-            color += origin_color
-        if detect_color is not None:
-            color += ',%s' % detect_color
-        colors.append(color)
-    df = pd.Series(colors, index=ids)
-    return df
-
-
-def make_venn(sample_cos_produced, measured_cos=None, output_loc=None, name1='gene_set_1', name2='gene_set_2'):
-    samples = list(sample_cos_produced.keys())
-    bac_cos = sample_cos_produced[samples[0]]
-    if len(samples) == 2:
-        host_cos = sample_cos_produced[samples[1]]
-    else:
-        host_cos = None
-    if host_cos is None and measured_cos is None:
-        raise ValueError("Must give host_cos or measured_cos to make venn diagram")
-    if host_cos is not None and measured_cos is None:
-        _ = venn2((set(bac_cos), set(host_cos)),
-                  ("Compounds predicted\nproduced by %s" % name1.replace('_', ' '),
-                   "Compounds predicted\nproduced by %s" % name2.replace('_', ' ')),
-                  set_colors=('white',)*2)
-        _ = venn2_circles((set(bac_cos), set(host_cos)), linestyle='solid')
-    elif host_cos is None and measured_cos is not None:
-        _ = venn2((set(bac_cos), set(measured_cos)),
-                  ("Compounds predicted\nproduced by %s" % name1.replace('_', ' '), "Compounds measured"),
-                  set_colors=('white',)*2)
-        _ = venn2_circles((set(bac_cos), set(measured_cos)), linestyle='solid')
-    else:
-        _ = venn3((set(measured_cos), set(bac_cos), set(host_cos)),
-                  ("Compounds measured", "Compounds predicted\nproduced by %s" % name1.replace('_', ' '),
-                   "Compounds predicted\nproduced by %s" % name2.replace('_', ' ')),
-                  set_colors=('white',)*3)
-        _ = venn3_circles((set(measured_cos), set(bac_cos), set(host_cos)), linestyle='solid')
-    if output_loc is not None:
-        plt.savefig(output_loc, bbox_inches='tight', dpi=300)
+                           detected_color='orange', sample_groups=None, group_colors=GROUP_COLORS):
+    """KEGG mapper colors of the ids of any number of samples, given as a dict of sample to ids or an IncidenceMatrix
+    of samples x ids, or of groups of them if sample_groups maps samples to groups. With one or two samples or groups
+    ids are colored with origin_colors as only in the first, in both or only in the second."""
+    if not isinstance(sample_ids, IncidenceMatrix):
+        sample_ids = IncidenceMatrix.from_dict_of_lists(sample_ids)
+    if sample_groups is not None:
+        sample_ids = sample_ids.group_rows(sample_groups)
+    present = sample_ids.column_counts() > 0
+    ids = np.asarray(sample_ids.column_ids, dtype=object)[present]
+    membership = sample_ids.matrix[:, np.flatnonzero(present)].transpose()
+    if detected_ids is not None:
+        detected_only = np.array(sorted(set(detected_ids) - set(ids)), dtype=object)
+        ids = np.concatenate([ids, detected_only])
+        membership = sparse.vstack([membership, sparse.csr_matrix((len(detected_only), membership.shape[1]),
+                                                                  dtype=bool)])
+    num_groups = membership.shape[1]
+
+    # color each distinct pattern of samples an id is found in once and give every id the color of its pattern
+    patterns, id_patterns = np.unique(np.packbits(membership.toarray(), axis=1), axis=0, return_inverse=True)
+    pattern_membership = np.unpackbits(patterns, axis=1, count=num_groups).astype(bool)
+    pattern_counts = pattern_membership.sum(axis=1)
+    if num_groups <= 2:
+        group_colors = [origin_colors[0], origin_colors[2]]
+        shared_colors = np.full(len(patterns), origin_colors[1], dtype=object)
     else:
-        plt.show()
+        shared_colors = shade_colors((pattern_counts - 1) / (num_groups - 1))
+    pattern_colors = np.where(pattern_counts > 1, shared_colors, '').astype(object)
+    unique_patterns = pattern_counts == 1
+    group_colors = np.array(group_colors, dtype=object)
+    pattern_colors[unique_patterns] = group_colors[np.argmax(pattern_membership[unique_patterns], axis=1) %
+                                                   len(group_colors)]
+
+    colors = pattern_colors[np.ravel(id_patterns)]
+    if detected_ids is not None:
+        colors = colors + np.where(np.isin(ids, list(set(detected_ids))), ',%s' % detected_color, '').astype(object)
+    return pd.Series(colors, index=ids)
 
 
 def get_pathways_from_cos(co_dict):
@@ -206,13 +461,14 @@ def get_pathways_from_cos(co_dict):
     return set(pathway_list)
 
 
-def get_unique_from_dict_of_lists(dict_of_lists):
-    unique_dict_of_lists = dict()
-    for key, list_ in dict_of_lists.items():
-        all_other_values = set([value for other_key, other_list in dict_of_lists.items() for value in other_list
-                                if other_key != key])
-        unique_dict_of_lists[key] = set(list_) - all_other_values
-    return unique_dict_of_lists
+def get_unique_from_dict_of_lists(dict_of_lists, max_keys=1):
+    """Values of each key that are found in at most max_keys keys, by default the values unique to each key"""
+    if is_encoded(dict_of_lists):
+        value_counts = np.bincount(np.concatenate([np.unique(codes) for codes in dict_of_lists.values()]))
+        return {key: np.unique(codes[value_counts[codes] <= max_keys]) for key, codes in dict_of_lists.items()}
+    value_counts = Counter(value for list_ in dict_of_lists.values() for value in set(list_))
+    return {key: set(value for value in list_ if value_counts[value] <= max_keys)
+            for key, list_ in dict_of_lists.items()}
 
 
 def get_pathway_to_co_dict(pathway_dict, no_drug=True, no_glycan=True):
@@ -228,6 +484,7 @@ def get_pathway_to_co_dict(pathway_dict, no_drug=True, no_glycan=True):
 
 
 def calculate_enrichment(cos, co_pathway_dict, min_pathway_size=10):
+    from scipy.stats import hypergeom
     all_cos = set([co for co_list in co_pathway_dict.values() for co in co_list])
     pathway_names = list()
     pathway_data = list()
@@ -247,130 +504,694 @@ def calculate_enrichment(cos, co_pathway_dict, min_pathway_size=10):
         return enrichment_table.sort_values('adjusted probability')
 
 
-def make_enrichment_clustermap(pathway_enrichment_dfs: dict, key, output_loc, min_p=.1, log=False):
-    enrichment_p_df = pd.DataFrame.from_dict({sample: pathway_enrichment_df[key] for sample, pathway_enrichment_df in
-                                              pathway_enrichment_dfs.items()})
-    enrichment_p_df = enrichment_p_df.loc[enrichment_p_df.index[(enrichment_p_df<min_p).sum(axis=1) > 0]]
-    enrichment_p_df = enrichment_p_df[enrichment_p_df.columns[(enrichment_p_df<min_p).sum(axis=0) > 0]]
-    if log:
-        enrichment_p_df = np.log(enrichment_p_df)
-    g = sns.clustermap(enrichment_p_df, col_cluster=False, figsize=(2, 12), cmap="Blues_r", method="average")
-    _ = plt.setp(g.ax_heatmap.get_xticklabels(), rotation=340, fontsize=12, ha="left")
-    _ = plt.setp(g.ax_heatmap.get_yticklabels(), rotation=0, fontsize=12)
-    plt.savefig(output_loc, dpi=500, bbox_inches='tight')
+def load_kegg_sources(kegg_index=None, kegg_cache=None, load_entries=None, logger=None):
+    """KEGG index, KEGG cache and KEGG records of an earlier run's snapshot, loading any given as locations"""
+    if isinstance(kegg_index, str):
+        logger['KEGG index location'] = path.abspath(kegg_index)
+        with logger.stage('load KEGG index'):
+            kegg_index = KEGGIndex.load(kegg_index)
+    if isinstance(kegg_cache, str):
+        kegg_cache = KEGGCache(kegg_cache)
+    if kegg_cache is not None:
+        logger['KEGG cache location'] = path.abspath(kegg_cache.cache_loc)
+    # records from an earlier run's snapshot are used first and only missing ids are looked up
+    if isinstance(load_entries, str):
+        logger['KEGG entries loaded from'] = path.abspath(load_entries)
+        with logger.stage('load KEGG entries'):
+            load_entries = load_snapshot(load_entries)
+    return kegg_index, kegg_cache, load_entries
 
 
-def main(kos_loc, output_dir, other_kos_loc=None, compounds_loc=None, name1='gene_set_1', name2='gene_set_2',
-         keep_separated=False, samples_are_columns=False, detected_only=False, rxn_compounds_only=False,
-         unique_only=True, ko_file_loc=None, rn_file_loc=None, co_file_loc=None, pathway_file_loc=None,
-         write_json=False):
-    # create output dir to throw error quick
-    makedirs(output_dir)
-    logger = Logger(path.join(output_dir, "AMON_log.txt"))
+def make_record_lookup(kegg_index=None, kegg_cache=None, kegg_fetcher=None, flat_file_processes=1,
+                       kegg_records=None, snapshot_writer=None):
+    """lookup_records(ids, kind, file_loc) getting records with get_records from the given sources, records found are
+    also written to a snapshot if a SnapshotWriter is given"""
+    def lookup_records(ids, kind, file_loc):
+        records = get_records(ids, kind, file_loc, kegg_index, kegg_cache, kegg_fetcher, flat_file_processes,
+                              kegg_records)
+        if snapshot_writer is not None:
+            snapshot_writer.write_records(kind, records)
+        return records
+    return lookup_records
+
+
+def lookup_ko_matrices(kos, lookup_records, ko_file_loc=None, rn_file_loc=None, ko_dict=None, rn_dict=None,
+                       looked_up_kos=()):
+    """KOs x reactions and reactions x compounds produced IncidenceMatrix of kos, with a row for every KO in sorted
+    order. Records already looked up can be given as ko_dict, for the KOs looked_up_kos, and rn_dict and only the
+    missing ones are looked up."""
+    kos = set(kos)
+    if ko_dict is None:
+        ko_dict = lookup_records(kos, 'ko', ko_file_loc)
+    else:
+        missing = kos - set(ko_dict) - set(looked_up_kos)
+        if len(missing) > 0:
+            ko_dict = dict(ko_dict, **lookup_records(missing, 'ko', ko_file_loc))
+    ko_rns = make_ko_rn_matrix(ko_dict).reindex_rows(sorted(kos))
+    rns = ko_rns.present_column_ids()
+    if rn_dict is None:
+        rn_dict = lookup_records(rns, 'rn', rn_file_loc)
+    else:
+        missing = set(rns) - set(rn_dict)
+        if len(missing) > 0:
+            rn_dict = dict(rn_dict, **lookup_records(missing, 'rn', rn_file_loc))
+    return ko_rns, make_rn_co_matrix(rn_dict).reindex_rows(rns)
+
+
+def make_permutation_null(sample_kos, lookup_records, null_model='ko', null_background=None, kept_cos=None,
+                          unique_cos=None, unique_max_samples=1, permutations=1000, seed=0, processes=1,
+                          ko_file_loc=None, rn_file_loc=None, ko_dict=None, rn_dict=None):
+    """PermutationNull drawing random sets of KOs, or of their reactions if null_model is 'reaction', the size of each
+    sample's from the KOs of all samples and of null_background, a file read with read_in_ids or a collection of KOs.
+    Random compounds are kept if they are in kept_cos, when given, and if they would be unique among the samples x
+    compounds IncidenceMatrix unique_cos, when given. Records already looked up can be given as ko_dict and rn_dict."""
+    null_kos = set(ko for kos in sample_kos.values() for ko in kos)
+    if isinstance(null_background, str):
+        null_kos.update(ko for kos in read_in_ids(null_background, name='background').values() for ko in kos)
+    elif null_background is not None:
+        null_kos.update(null_background)
+    ko_rns, rn_cos = lookup_ko_matrices(null_kos, lookup_records, ko_file_loc, rn_file_loc, ko_dict, rn_dict,
+                                        looked_up_kos=[ko for kos in sample_kos.values() for ko in kos])
+    sample_ko_matrix = IncidenceMatrix.from_dict_of_lists(sample_kos, column_ids=ko_rns.row_ids)
+    if null_model == 'ko':
+        element_cos = ko_rns.dot(rn_cos)
+        sample_sizes = sample_ko_matrix.row_counts()
+    else:
+        element_cos = rn_cos
+        sample_sizes = sample_ko_matrix.dot(ko_rns).row_counts()
+    compound_masks = None
+    if kept_cos is not None:
+        compound_masks = np.isin(np.asarray(element_cos.column_ids, dtype=object), list(kept_cos))
+    if unique_cos is not None:
+        unique_masks = make_unique_masks(unique_cos.reindex_rows(sample_ko_matrix.row_ids), element_cos.column_ids,
+                                         unique_max_samples)
+        compound_masks = unique_masks if compound_masks is None else unique_masks & compound_masks[np.newaxis, :]
+    return PermutationNull(element_cos, sample_ko_matrix.row_ids, sample_sizes, compound_masks, permutations, seed,
+                           processes)
+
+
+class PredictionResults(object):
+    """Outputs of predict() held in memory, write() saves them as the files main() makes"""
+    def __init__(self, origin_matrix, kegg_mapper_input, pathway_enrichment_dfs, sample_compounds, cos_measured,
+                 logger, records=None, compound_stability=None, pathway_stability=None):
+        # compounds x samples, with a detected column if compounds measured were given
+        self.origin_matrix = origin_matrix
+        # KEGG mapper color of each KO and compound
+        self.kegg_mapper_input = kegg_mapper_input
+        self.pathway_enrichment_dfs = pathway_enrichment_dfs
+        # samples x compounds produced before any filters
+        self.sample_compounds = sample_compounds
+        # compounds measured, without those with no reactions if only compounds with reactions were kept
+        self.cos_measured = cos_measured
+        self.logger = logger
+        self.records = dict() if records is None else records
+        # compounds x samples and pathways x samples fractions of robustness replicates, if estimated
+        self.compound_stability = compound_stability
+        self.pathway_stability = pathway_stability
+
+    @property
+    def origin_table(self):
+        return pd.DataFrame(self.origin_matrix.matrix.toarray(), index=self.origin_matrix.row_ids,
+                            columns=self.origin_matrix.column_ids)
+
+    @property
+    def stages(self):
+        return self.logger.stages
+
+    def write(self, output_dir, origin_table_format='tsv', make_plots=True, write_json=False, figure_options=None):
+        """Write the origin table, KEGG mapper input, enrichment tables and plots to output_dir and the KEGG records
+        kept by predict() as json if write_json, adding their locations to the log. Plots are rendered in this process
+        with render_figure() options figure_options."""
+        makedirs(output_dir, exist_ok=True)
+        logger = self.logger
+        with logger.stage('write origin table'):
+            if origin_table_format == 'biom':
+                write_origin_table_biom(self.origin_matrix, path.join(output_dir, 'origin_table.biom'))
+                logger['Origin table location'] = path.abspath(path.join(output_dir, 'origin_table.biom'))
+            else:
+                write_origin_table(self.origin_matrix, path.join(output_dir, 'origin_table.tsv'))
+                logger['Origin table location'] = path.abspath(path.join(output_dir, 'origin_table.tsv'))
+        if self.kegg_mapper_input is not None:
+            self.kegg_mapper_input.to_csv(path.join(output_dir, 'kegg_mapper.tsv'), sep='\t')
+            logger['KEGG mapper location'] = path.abspath(path.join(output_dir, 'kegg_mapper.tsv'))
+        if write_json:
+            for kind, json_name, log_name in (('ko', 'ko_dict.json', 'KO'), ('rn', 'rn_dict.json', 'RN'),
+                                              ('co', 'co_dict.json', 'CO')):
+                with open(path.join(output_dir, json_name), 'w') as f:
+                    json.dump(self.records[kind], f)
+                logger['%s json location' % log_name] = path.abspath(path.join(output_dir, json_name))
+
+        with logger.stage('write enrichment tables'):
+            for sample, pathway_enrichment_df in self.pathway_enrichment_dfs.items():
+                enrichment_loc = path.join(output_dir, '%s_compound_pathway_enrichment.tsv' % sample)
+                pathway_enrichment_df.to_csv(enrichment_loc, sep='\t')
+                logger['%s pathway enrichment' % sample] = path.abspath(enrichment_loc)
+        if self.compound_stability is not None:
+            for table, file_name, log_name in ((self.compound_stability, 'compound_stability.tsv', 'Compound'),
+                                               (self.pathway_stability, 'pathway_stability.tsv', 'Pathway')):
+                table.to_csv(path.join(output_dir, file_name), sep='\t')
+                logger['%s stability location' % log_name] = path.abspath(path.join(output_dir, file_name))
+
+        if make_plots:
+            self.write_figure_inputs(output_dir)
+            render_figures(output_dir, logger, **({} if figure_options is None else figure_options))
+
+    def write_figure_inputs(self, output_dir):
+        """Save what the venn diagram and enrichment clustermap show for render_figures(), after the enrichment tables
+        are written"""
+        figure_inputs = dict()
+        num_samples = self.sample_compounds.shape[0]
+        if (self.cos_measured is not None or num_samples > 1) and num_samples <= 2:
+            figure_inputs['venn'] = {
+                'sample_compounds': {sample: sorted(cos) for sample, cos in
+                                     self.sample_compounds.to_dict_of_sets().items()},
+                'measured_compounds': None if self.cos_measured is None else sorted(self.cos_measured)}
+        if len(self.pathway_enrichment_dfs) > 0:
+            figure_inputs['clustermap'] = {
+                'key': 'adjusted probability',
+                'enrichment_tables': [[sample, '%s_compound_pathway_enrichment.tsv' % sample]
+                                      for sample in self.pathway_enrichment_dfs]}
+        with open(path.join(output_dir, FIGURE_INPUTS), 'w') as f:
+            json.dump(figure_inputs, f)
+
+
+def predict(kos, other_kos=None, compounds=None, name1='gene_set_1', name2='gene_set_2', keep_separated=False,
+            samples_are_columns=False, detected_only=False, rxn_compounds_only=False, unique_only=True,
+            unique_max_samples=1, ko_file_loc=None, rn_file_loc=None, co_file_loc=None, pathway_file_loc=None,
+            kegg_index=None, kegg_cache=None, kegg_fetcher=None, flat_file_processes=1, load_entries=None,
+            stage_cache=None, snapshot_writer=None, keep_records=False, permutations=0, null_model='ko',
+            null_background=None, permutation_seed=0, permutation_processes=1, sample_groups=None, group_rule='any',
+            robustness_replicates=0, robustness_method='subsample', subsample_fraction=.8, rarefaction_depth=None,
+            robustness_seed=0, robustness_processes=1, logger=None):
+    """Predict the compounds each sample can produce and their pathway enrichment without writing any outputs.
+
+    kos and other_kos are files read with read_in_ids or dicts of sample to KOs and compounds is a file or a list of
+    compounds measured. KEGG records come from the same sources as in main() and are kept in the results if
+    keep_records. If permutations is more than 0 enrichment is also tested against that many random KO or reaction
+    sets, see make_permutation_null(). If sample_groups maps the samples of kos to groups they are analyzed as one
+    sample per group, with the KOs combined by group_rule as in IncidenceMatrix.group_rows(), and samples without a
+    group are left out. If robustness_replicates
+    is more than 0 the stability of each sample's compounds and enrichment is estimated from that many replicates
+    keeping subsample_fraction of its KOs, or rarefying the counts of the kos table to rarefaction_depth if
+    robustness_method is 'rarefy', see estimate_robustness(). Returns PredictionResults with the run's stages logged
+    to logger, a new Logger if not given.
+    """
+    if null_model not in NULL_MODELS:
+        raise ValueError('Null model must be one of %s' % ', '.join(NULL_MODELS))
+    if robustness_method not in ROBUSTNESS_METHODS:
+        raise ValueError('Robustness method must be one of %s' % ', '.join(ROBUSTNESS_METHODS))
+    if robustness_replicates > 0 and robustness_method == 'rarefy':
+        if not isinstance(kos, str) or not keep_separated or sample_groups is not None:
+            raise ValueError('Rarefaction needs a table of KO counts read with samples kept separated and not grouped')
+        if rarefaction_depth is None:
+            raise ValueError('Rarefaction needs a rarefaction depth')
+    if sample_groups is not None:
+        # sample ids are read as strings, numeric ids of metadata or dicts given directly are matched to them
+        sample_groups = {str(sample): group for sample, group in sample_groups.items()}
+    if logger is None:
+        logger = Logger(None)
+    kegg_index_loc = kegg_index if isinstance(kegg_index, str) else None
+    load_entries_loc = load_entries if isinstance(load_entries, str) else None
+    kegg_index, kegg_cache, load_entries = load_kegg_sources(kegg_index, kegg_cache, load_entries, logger)
+    # results of earlier stages are reused from the stage cache when everything they were made from is unchanged
+    if isinstance(stage_cache, str):
+        stage_cache = StageCache(stage_cache)
+    kegg_stage_cache = stage_cache
+    if stage_cache is not None:
+        # the KEGG key covers every source records can come from, records from the KEGG API are keyed by the KEGG
+        # cache release if there is a cache
+        kegg_sources = [stage_cache.hash_file(loc) if loc is not None else None for loc in
+                        (kegg_index_loc, load_entries_loc, ko_file_loc, rn_file_loc, co_file_loc, pathway_file_loc)]
+        if kegg_index is not None and kegg_index_loc is None:
+            kegg_sources.append(kegg_index.metadata)
+        kegg_sources.append(kegg_cache.release if kegg_cache is not None else None)
+        kos_key = stage_cache.key('sample KOs', [stage_cache.hash_input(input_) for input_ in (kos, other_kos)],
+                                  name1, name2, keep_separated, samples_are_columns,
+                                  None if sample_groups is None else sorted(sample_groups.items()), group_rule)
+        rns_key = stage_cache.key('sample reactions', kos_key, kegg_sources)
+        cos_key = stage_cache.key('sample compounds', rns_key)
+        pathways_key = stage_cache.key('compound pathways', cos_key, detected_only, stage_cache.hash_input(compounds))
+        # records from the KEGG API without a KEGG cache have no release to key stages made from them by, so those
+        # stages are not cached and can not be reused after KEGG changes
+        if all(source is None for source in kegg_sources):
+            kegg_stage_cache = None
+    # records are only all looked up when they are also kept
+    reuse = stage_cache is not None and not keep_records and snapshot_writer is None
+    reuse_kegg = reuse and kegg_stage_cache is not None
+    records = dict()
+    ko_dict = None
+    rn_dict = None
 
     # read in all kos and get records
-    sample_kos = read_in_ids(kos_loc, keep_separated=keep_separated,
-                             samples_are_columns=samples_are_columns, name=name1)
-    logger['kos_loc'] = path.abspath(kos_loc)
-    if other_kos_loc is not None:
-        sample_kos.update(read_in_ids(other_kos_loc, keep_separated=keep_separated,
-                                      samples_are_columns=samples_are_columns, name=name2))
-        logger['other_kos_loc'] = path.abspath(other_kos_loc)
-    all_kos = set([value for values in sample_kos.values() for value in values])
-    logger['Number of samples'] = len(sample_kos)
-    logger['Total number of KOs'] = len(all_kos)
-
-    ko_dict = get_kegg_record_dict(set(all_kos), parse_ko, ko_file_loc)
-    if write_json:
-        open(path.join(output_dir, 'ko_dict.json'), 'w').write(json.dumps(ko_dict))
-        logger['KO json location'] = path.abspath(path.join(output_dir, 'ko_dict.json'))
+    sample_kos = stage_cache.load_dict_of_lists('sample KOs', kos_key) if reuse else None
+    with logger.stage('read inputs') as counts:
+        if sample_kos is None:
+            sample_kos = dict()
+            for input_, name, input_groups in ((kos, name1, sample_groups), (other_kos, name2, None)):
+                if input_groups is not None:
+                    if isinstance(input_, str):
+                        grouped_kos, ungrouped = read_in_grouped_ids(input_, input_groups, group_rule,
+                                                                     samples_are_columns, name)
+                    else:
+                        input_ = {str(sample): sample_input for sample, sample_input in input_.items()}
+                        grouped_kos, ungrouped = group_samples(IncidenceMatrix.from_dict_of_lists(input_),
+                                                               input_groups, group_rule)
+                    sample_kos.update(grouped_kos)
+                    logger['Samples without a group left out'] = ungrouped
+                elif isinstance(input_, str):
+                    sample_kos.update(read_in_ids(input_, keep_separated=keep_separated,
+                                                  samples_are_columns=samples_are_columns, name=name))
+                elif input_ is not None:
+                    sample_kos.update({str(sample): set(sample_input) for sample, sample_input in input_.items()})
+            if stage_cache is not None:
+                stage_cache.save_dict_of_lists(kos_key, sample_kos)
+        if isinstance(kos, str):
+            logger['kos_loc'] = path.abspath(kos)
+        if isinstance(other_kos, str):
+            logger['other_kos_loc'] = path.abspath(other_kos)
+        all_kos = set([value for values in sample_kos.values() for value in values])
+        logger['Number of samples'] = len(sample_kos)
+        logger['Total number of KOs'] = len(all_kos)
 
-    # get all reactions from kos
-    sample_rns = get_rns_from_kos(sample_kos, ko_dict)
-    all_rns = set([value for values in sample_rns.values() for value in values])
-    logger['Total number of reactions'] = len(all_rns)
+        # read in compounds that were measured if available
+        if isinstance(compounds, str):
+            cos_measured = list(read_in_ids(compounds, name='Compounds', keep_separated=False).values())[0]
+            logger['compounds_loc'] = path.abspath(compounds)
+        elif compounds is not None:
+            cos_measured = set(compounds)
+        else:
+            cos_measured = None
+        if cos_measured is not None:
+            counts['compounds measured'] = len(cos_measured)
+        counts['samples'] = len(sample_kos)
+        counts['kos'] = len(all_kos)
 
-    # get reactions from kegg
-    rn_dict = get_kegg_record_dict(set(all_rns), parse_rn, rn_file_loc)
-    if write_json:
-        open(path.join(output_dir, 'rn_dict.json'), 'w').write(json.dumps(rn_dict))
-        logger['RN json location'] = path.abspath(path.join(output_dir, 'rn_dict.json'))
+    sample_cos_matrix = stage_cache.load_matrix('sample compounds', cos_key) if reuse_kegg else None
+    compound_pathways = stage_cache.load('compound pathways', pathways_key) if reuse_kegg else None
 
-    # Get reactions from KEGG and pull cos produced
-    sample_cos_produced = get_products_from_rns(sample_rns, rn_dict)
+    # when all records come from the KEGG API fetch them together, following KOs to reactions, compounds and
+    # pathways as each batch of records arrives. Records of ids they do not reach, such as the KOs of a null
+    # background, are fetched when they are looked up.
+    if (sample_cos_matrix is None or compound_pathways is None) and kegg_index is None and kegg_cache is None and \
+            load_entries is None and \
+            all(file_loc is None for file_loc in (ko_file_loc, rn_file_loc, co_file_loc, pathway_file_loc)):
+        if kegg_fetcher is None:
+            kegg_fetcher = KEGGFetcher()
+        with logger.stage('fetch KEGG records') as counts:
+            load_entries = kegg_fetcher.fetch_all(all_kos, cos_measured if detected_only else ())
+            for kind, kind_records in load_entries.record_dicts.items():
+                counts['%s records' % kind] = len(kind_records)
+    lookup_records = make_record_lookup(kegg_index, kegg_cache, kegg_fetcher, flat_file_processes, load_entries,
+                                        snapshot_writer)
 
-    # read in compounds that were measured if available
-    if compounds_loc is not None:
-        cos_measured = list(read_in_ids(compounds_loc, name='Compounds', keep_separated=False).values())[0]
-        logger['compounds_loc'] = path.abspath(compounds_loc)
-    else:
-        cos_measured = None
+    if sample_cos_matrix is None:
+        sample_rns = stage_cache.load_matrix('sample reactions', rns_key) if reuse_kegg else None
+        if sample_rns is None:
+            with logger.stage('KO records') as counts:
+                ko_dict = lookup_records(all_kos, 'ko', ko_file_loc)
+                counts['records'] = len(ko_dict)
+            if keep_records:
+                records['ko'] = ko_dict
+
+            # get all reactions from kos
+            with logger.stage('reactions from KOs') as counts:
+                sample_rns = get_sample_rns(sample_kos, ko_dict)
+                counts['reactions'] = int(np.sum(sample_rns.column_counts() > 0))
+            if kegg_stage_cache is not None:
+                kegg_stage_cache.save_matrix(rns_key, sample_rns)
+        all_rns = set(sample_rns.present_column_ids())
+        logger['Total number of reactions'] = len(all_rns)
 
-    # make compound origin table
-    origin_table = make_compound_origin_table(sample_cos_produced, cos_measured)
+        # get reactions from kegg
+        with logger.stage('reaction records') as counts:
+            rn_dict = lookup_records(all_rns, 'rn', rn_file_loc)
+            counts['records'] = len(rn_dict)
+        if keep_records:
+            records['rn'] = rn_dict
 
-    # get rid of any all false columns
-    origin_table = origin_table[origin_table.columns[origin_table.sum().astype(bool)]]
-    origin_table.to_csv(path.join(output_dir, 'origin_table.tsv'), sep='\t')
-    logger['Origin table location'] = path.abspath(path.join(output_dir, 'origin_table.tsv'))
+        # Get reactions from KEGG and pull cos produced
+        with logger.stage('compounds from reactions'):
+            sample_cos_matrix = get_sample_cos(sample_rns, rn_dict)
+        if kegg_stage_cache is not None:
+            kegg_stage_cache.save_matrix(cos_key, sample_cos_matrix)
 
-    # make kegg mapper input if 2 or fewer samples
-    if len(sample_cos_produced) <= 2:
-        kegg_mapper_input = make_kegg_mapper_input(merge_dicts_of_lists(sample_kos, sample_cos_produced), cos_measured)
-        kegg_mapper_input.to_csv(path.join(output_dir, 'kegg_mapper.tsv'), sep='\t')
-        logger['KEGG mapper location'] = path.abspath(path.join(output_dir, 'kegg_mapper.tsv'))
+    with logger.stage('origin table') as counts:
+        # compounds produced are held as codes of co_vocabulary through the enrichment stages
+        co_vocabulary = Vocabulary(sample_cos_matrix.column_ids)
+        sample_cos_produced = sample_cos_matrix.to_dict_of_arrays()
+
+        # make compound origin table
+        origin_matrix = make_compound_origin_matrix(sample_cos_matrix, cos_measured)
+
+        # get rid of any all false columns
+        origin_matrix = origin_matrix.select_columns(origin_matrix.column_counts() > 0)
+        counts['compounds'] = origin_matrix.shape[0]
+        counts['nonzero entries'] = origin_matrix.matrix.nnz
+
+    with logger.stage('KEGG mapper input') as counts:
+        sample_ko_matrix = IncidenceMatrix.from_dict_of_lists(sample_kos)
+        sample_cos_aligned = sample_cos_matrix.reindex_rows(sample_ko_matrix.row_ids)
+        kegg_mapper_input = make_kegg_mapper_input(
+            IncidenceMatrix(sparse.hstack([sample_ko_matrix.matrix, sample_cos_aligned.matrix]),
+                            sample_ko_matrix.row_ids, sample_ko_matrix.column_ids + sample_cos_aligned.column_ids),
+            cos_measured)
+        counts['ids'] = len(kegg_mapper_input)
 
     # Get full set of compounds
-    all_cos_produced = set([value for values in sample_cos_produced.values() for value in values])
+    all_cos_produced = set(sample_cos_matrix.present_column_ids())
     logger['Number of cos produced across samples'] = len(all_cos_produced)
     if detected_only:
         all_cos_produced = set(all_cos_produced) | set(cos_measured)
         logger['Number of cos produced and detected'] = len(all_cos_produced)
 
-    # Get compound data from kegg
-    co_dict = get_kegg_record_dict(all_cos_produced, parse_co, co_file_loc)
-    if write_json:
-        open(path.join(output_dir, 'co_dict.json'), 'w').write(json.dumps(co_dict))
+    if compound_pathways is None:
+        # Get compound data from kegg
+        with logger.stage('compound records') as counts:
+            co_dict = lookup_records(all_cos_produced, 'co', co_file_loc)
+            counts['records'] = len(co_dict)
+        if keep_records:
+            records['co'] = co_dict
+        cos_with_rxn = [compound for compound, record in co_dict.items() if 'REACTION' in record]
+
+        # Get pathway info from pathways in compounds
+        with logger.stage('pathway records') as counts:
+            all_pathways = [pathway.replace('map', 'ko') for pathway in get_pathways_from_cos(co_dict)]
+            pathway_dict = lookup_records(all_pathways, 'pathway', pathway_file_loc)
+            pathway_to_compound_dict = get_pathway_to_co_dict(pathway_dict, no_glycan=False)
+            counts['records'] = len(pathway_dict)
+        if keep_records:
+            records['pathway'] = pathway_dict
+        if kegg_stage_cache is not None:
+            kegg_stage_cache.save(pathways_key, cos_with_rxn=np.array(cos_with_rxn, dtype=str),
+                             **matrix_to_arrays(make_pathway_co_matrix(pathway_to_compound_dict)))
+    else:
+        cos_with_rxn = compound_pathways['cos_with_rxn'].tolist()
+        pathway_to_compound_dict = arrays_to_matrix(compound_pathways).to_dict_of_sets()
 
     # remove compounds without reactions if required
     if rxn_compounds_only:
-        cos_with_rxn = list()
-        for compound, record in co_dict.items():
-            if 'REACTION' in record:
-                cos_with_rxn.append(compound)
         cos_measured = set(cos_measured) & set(cos_with_rxn)
 
-    # Make venn diagram
-    if (compounds_loc is not None or len(sample_cos_produced) > 1) and len(sample_cos_produced) <= 2:
-        make_venn(sample_cos_produced, cos_measured, path.join(output_dir, 'venn.png'))
-
     # Filter compounds down to only cos measured for cos produced and other cos produced
     if detected_only:
-        sample_cos_produced = {sample: set(cos_produced) & set(cos_measured) for sample, cos_produced
+        measured_codes = co_vocabulary.encode(cos_measured, add=False)
+        sample_cos_produced = {sample: np.intersect1d(cos_produced, measured_codes) for sample, cos_produced
                                in sample_cos_produced.items()}
 
+    # random sets of the null model and robustness replicates go through the same filters as the samples' compounds
+    unique_cos = IncidenceMatrix.from_dict_of_arrays(sample_cos_produced, co_vocabulary.ids) \
+        if unique_only and (permutations > 0 or robustness_replicates > 0) else None
+    null = None
+    if permutations > 0:
+        with logger.stage('permutation null model') as counts:
+            null = make_permutation_null(sample_kos, lookup_records, null_model, null_background,
+                                         cos_measured if detected_only else None, unique_cos, unique_max_samples,
+                                         permutations, permutation_seed, permutation_processes, ko_file_loc,
+                                         rn_file_loc, ko_dict, rn_dict)
+            counts['elements'] = null.element_cos.shape[0]
+        logger['Permutation null model'] = '%s random %s sets, seed %s' % (permutations, null_model, permutation_seed)
+
     # find compounds unique to microbes and to host if host included
     if unique_only:
-        sample_cos_produced = get_unique_from_dict_of_lists(sample_cos_produced)
-
-    # Get pathway info from pathways in compounds
-    all_pathways = [pathway.replace('map', 'ko') for pathway in get_pathways_from_cos(co_dict)]
-    pathway_dict = get_kegg_record_dict(all_pathways, parse_pathway, pathway_file_loc)
-    pathway_to_compound_dict = get_pathway_to_co_dict(pathway_dict, no_glycan=False)
+        sample_cos_produced = get_unique_from_dict_of_lists(sample_cos_produced, max_keys=unique_max_samples)
 
     # calculate enrichment
-    pathway_enrichment_dfs = dict()
-    for sample, cos_produced in sample_cos_produced.items():
-        pathway_enrichment_df = calculate_enrichment(cos_produced, pathway_to_compound_dict)
-        if pathway_enrichment_df is not None:
-            pathway_enrichment_df.to_csv(path.join(output_dir, '%s_compound_pathway_enrichment.tsv' % sample), sep='\t')
-            logger['%s pathway enrichment'] = path.abspath(path.join(output_dir,
-                                                                     '%s_compound_pathway_enrichment.tsv' % sample))
-            pathway_enrichment_dfs[sample] = pathway_enrichment_df
-
-    if len(pathway_enrichment_dfs) > 0:
-        make_enrichment_clustermap(pathway_enrichment_dfs, 'adjusted probability',
-                                   path.join(output_dir, 'enrichment_heatmap.png'))
-        logger['Enrichment clustermap location'] = path.abspath(path.join(output_dir, 'enrichment_heatmap.png'))
-
-    logger.output_log()
+    with logger.stage('enrichment') as counts:
+        sample_cos = IncidenceMatrix.from_dict_of_arrays(sample_cos_produced, co_vocabulary.ids)
+        enrichment_table = calculate_enrichment_batch(sample_cos, make_pathway_co_matrix(pathway_to_compound_dict),
+                                                      null=null)
+        pathway_enrichment_dfs = split_enrichment_table(enrichment_table)
+        counts['tests'] = len(enrichment_table)
+        counts['samples enriched'] = len(pathway_enrichment_dfs)
+
+    compound_stability = None
+    pathway_stability = None
+    if robustness_replicates > 0:
+        with logger.stage('robustness') as counts:
+            ko_rns, rn_cos = lookup_ko_matrices(all_kos, lookup_records, ko_file_loc, rn_file_loc, ko_dict, rn_dict,
+                                                looked_up_kos=all_kos)
+            ko_cos = ko_rns.dot(rn_cos)
+            sample_ko_matrix = IncidenceMatrix.from_dict_of_lists(sample_kos, column_ids=ko_rns.row_ids)
+            compound_masks = None
+            if detected_only:
+                compound_masks = np.isin(np.asarray(ko_cos.column_ids, dtype=object), list(cos_measured))
+            if unique_only:
+                unique_masks = make_unique_masks(unique_cos.reindex_rows(sample_ko_matrix.row_ids),
+                                                 ko_cos.column_ids, unique_max_samples)
+                compound_masks = unique_masks if compound_masks is None else \
+                    unique_masks & compound_masks[np.newaxis, :]
+            ko_counts = read_in_count_matrix(kos, samples_are_columns) if robustness_method == 'rarefy' else None
+            compound_stability, pathway_stability = estimate_robustness(
+                sample_ko_matrix, ko_cos, make_pathway_co_matrix(pathway_to_compound_dict), robustness_replicates,
+                robustness_method, subsample_fraction, rarefaction_depth, ko_counts, compound_masks,
+                seed=robustness_seed, processes=robustness_processes)
+            counts['replicates'] = robustness_replicates * sample_ko_matrix.shape[0]
+        if robustness_method == 'rarefy':
+            logger['Robustness'] = '%s replicates rarefied to %s KOs, seed %s' % \
+                (robustness_replicates, rarefaction_depth, robustness_seed)
+        else:
+            logger['Robustness'] = '%s replicates keeping %s of KOs, seed %s' % \
+                (robustness_replicates, subsample_fraction, robustness_seed)
+
+    if kegg_cache is not None:
+        kegg_cache.log_stats(logger)
+    if stage_cache is not None:
+        stage_cache.log_stats(logger)
+    return PredictionResults(origin_matrix, kegg_mapper_input, pathway_enrichment_dfs, sample_cos_matrix,
+                             cos_measured, logger, records, compound_stability, pathway_stability)
+
+
+def predict_chunked(iter_chunks, output_dir, logger, lookup_records, cos_measured=None, detected_only=False,
+                    rxn_compounds_only=False, unique_only=True, unique_max_samples=1, ko_file_loc=None,
+                    rn_file_loc=None, co_file_loc=None, pathway_file_loc=None, write_json=False,
+                    origin_table_format='tsv'):
+    """Predict compounds and their pathway enrichment a chunk of samples at a time, with the same outputs as main()
+    apart from plots and the KEGG mapper input. iter_chunks returns a new iterator over samples x KOs chunks each time
+    it is called and lookup_records(ids, kind, file_loc) returns KEGG records. Only counts of KOs and compounds over
+    all samples are kept in memory, the compounds of each chunk are kept on disk until the outputs are written."""
+    with logger.stage('KOs present') as counts:
+        all_kos = set()
+        num_samples = 0
+        for chunk in iter_chunks():
+            all_kos.update(chunk.present_column_ids())
+            num_samples += chunk.shape[0]
+        logger['Number of samples'] = num_samples
+        logger['Total number of KOs'] = len(all_kos)
+        counts['samples'] = num_samples
+        counts['kos'] = len(all_kos)
+
+    with logger.stage('KO records') as counts:
+        ko_dict = lookup_records(all_kos, 'ko', ko_file_loc)
+        counts['records'] = len(ko_dict)
+    if write_json:
+        with open(path.join(output_dir, 'ko_dict.json'), 'w') as f:
+            json.dump(ko_dict, f)
+        logger['KO json location'] = path.abspath(path.join(output_dir, 'ko_dict.json'))
+    ko_rn_matrix = make_ko_rn_matrix(ko_dict)
+    all_rns = set(ko_rn_matrix.present_column_ids())
+    logger['Total number of reactions'] = len(all_rns)
+
+    with logger.stage('reaction records') as counts:
+        rn_dict = lookup_records(all_rns, 'rn', rn_file_loc)
+        counts['records'] = len(rn_dict)
+    if write_json:
+        with open(path.join(output_dir, 'rn_dict.json'), 'w') as f:
+            json.dump(rn_dict, f)
+        logger['RN json location'] = path.abspath(path.join(output_dir, 'rn_dict.json'))
+    rn_co_matrix = make_rn_co_matrix(rn_dict)
+    compound_ids = rn_co_matrix.column_ids
+
+    with TemporaryDirectory(dir=output_dir) as chunk_dir:
+        with logger.stage('compounds from chunks') as counts:
+            chunk_samples = list()
+            chunk_keep = list()
+            compound_counts = np.zeros(len(compound_ids), dtype=np.int64)
+            for chunk_number, chunk in enumerate(iter_chunks()):
+                sample_cos = chunk.dot(ko_rn_matrix).dot(rn_co_matrix)
+                save_chunk(chunk_dir, chunk_number, sample_cos)
+                chunk_samples.append(sample_cos.row_ids)
+                # samples that produce no compounds are left out of the origin table
+                chunk_keep.append(sample_cos.row_counts() > 0)
+                compound_counts += sample_cos.column_counts()
+            counts['chunks'] = len(chunk_samples)
+
+        with logger.stage('origin table') as counts:
+            compound_rows = np.flatnonzero(compound_counts > 0)
+            column_ids = [sample for samples, keep in zip(chunk_samples, chunk_keep)
+                          for sample, is_kept in zip(samples, keep) if is_kept]
+            detected = None
+            if cos_measured is not None:
+                measured = set(cos_measured)
+                detected = np.array([compound_ids[row] in measured for row in compound_rows], dtype=bool)
+                if np.any(detected):
+                    column_ids.append('detected')
+                else:
+                    detected = None
+            blocks = iter_origin_blocks(chunk_dir, chunk_samples, chunk_keep, compound_rows, detected)
+            if origin_table_format == 'biom':
+                origin_matrix = sparse.vstack([sparse.csr_matrix(block) for _, block in blocks]) \
+                    if len(compound_rows) > 0 else sparse.csr_matrix((0, len(column_ids)), dtype=bool)
+                write_origin_table_biom(IncidenceMatrix(origin_matrix, [compound_ids[row] for row in compound_rows],
+                                                        column_ids), path.join(output_dir, 'origin_table.biom'))
+                logger['Origin table location'] = path.abspath(path.join(output_dir, 'origin_table.biom'))
+            else:
+                write_origin_table_chunks(path.join(output_dir, 'origin_table.tsv'), column_ids, compound_ids, blocks)
+                logger['Origin table location'] = path.abspath(path.join(output_dir, 'origin_table.tsv'))
+            counts['compounds'] = len(compound_rows)
+
+        # Get full set of compounds
+        all_cos_produced = set(compound_ids[row] for row in compound_rows)
+        logger['Number of cos produced across samples'] = len(all_cos_produced)
+        if detected_only:
+            all_cos_produced = all_cos_produced | set(cos_measured)
+            logger['Number of cos produced and detected'] = len(all_cos_produced)
+
+        with logger.stage('compound records') as counts:
+            co_dict = lookup_records(all_cos_produced, 'co', co_file_loc)
+            counts['records'] = len(co_dict)
+        if write_json:
+            with open(path.join(output_dir, 'co_dict.json'), 'w') as f:
+                json.dump(co_dict, f)
+
+        # remove compounds without reactions if required
+        if rxn_compounds_only:
+            cos_with_rxn = [compound for compound, record in co_dict.items() if 'REACTION' in record]
+            cos_measured = set(cos_measured) & set(cos_with_rxn)
+
+        with logger.stage('pathway records') as counts:
+            all_pathways = [pathway.replace('map', 'ko') for pathway in get_pathways_from_cos(co_dict)]
+            pathway_dict = lookup_records(all_pathways, 'pathway', pathway_file_loc)
+            pathway_cos = make_pathway_co_matrix(get_pathway_to_co_dict(pathway_dict, no_glycan=False))
+            counts['records'] = len(pathway_dict)
+
+        # filters are masks over compounds, unique compounds are found from the counts over all samples
+        keep_compounds = np.ones(len(compound_ids), dtype=bool)
+        if detected_only:
+            measured = set(cos_measured)
+            keep_compounds &= np.array([compound in measured for compound in compound_ids], dtype=bool)
+        if unique_only:
+            keep_compounds &= compound_counts <= unique_max_samples
+
+        with logger.stage('enrichment') as counts:
+            num_tables = 0
+            for chunk_number, samples in enumerate(chunk_samples):
+                matrix = load_chunk(chunk_dir, chunk_number, len(compound_ids), len(samples), mmap=False)
+                sample_cos = IncidenceMatrix(matrix.transpose().multiply(keep_compounds[np.newaxis, :]), samples,
+                                             compound_ids)
+                enrichment_table = calculate_enrichment_batch(sample_cos, pathway_cos)
+                for sample, pathway_enrichment_df in split_enrichment_table(enrichment_table).items():
+                    pathway_enrichment_df.to_csv(path.join(output_dir, '%s_compound_pathway_enrichment.tsv' % sample),
+                                                 sep='\t')
+                    num_tables += 1
+            logger['Pathway enrichment tables'] = num_tables
+            counts['samples enriched'] = num_tables
+
+
+def main(kos_loc, output_dir, other_kos_loc=None, compounds_loc=None, name1='gene_set_1', name2='gene_set_2',
+         keep_separated=False, samples_are_columns=False, detected_only=False, rxn_compounds_only=False,
+         unique_only=True, ko_file_loc=None, rn_file_loc=None, co_file_loc=None, pathway_file_loc=None,
+         write_json=False, kegg_index=None, unique_max_samples=1,
+         origin_table_format='tsv', kegg_cache=None, kegg_fetcher=None, make_plots=True, stage_format='json',
+         profile=False, flat_file_processes=1, save_entries=False, load_entries=None, resume=False,
+         stage_cache=None, sample_chunksize=None, figure_format='png', figure_dpi=None, max_pathways=None,
+         pathway_order=None, defer_plots=False, plot_processes=1, figure_renderer=None, permutations=0,
+         null_model='ko', null_background=None, permutation_seed=0, permutation_processes=1, sample_metadata=None,
+         group_by=None, group_rule='any', robustness_replicates=0, robustness_method='subsample',
+         subsample_fraction=.8, rarefaction_depth=None, robustness_seed=0, robustness_processes=1):
+    if permutations > 0 and sample_chunksize is not None:
+        raise ValueError('Permutation null models are not available when samples are processed in chunks')
+    if robustness_replicates > 0 and sample_chunksize is not None:
+        raise ValueError('Robustness can not be estimated when samples are processed in chunks')
+    if (sample_metadata is None) != (group_by is None):
+        raise ValueError('Sample metadata and a column to group by must be given together')
+    if sample_metadata is not None and sample_chunksize is not None:
+        raise ValueError('Samples can not be grouped when they are processed in chunks')
+    # create output dir to throw error quick, unless resuming a run in it
+    makedirs(output_dir, exist_ok=resume)
+    stage_output = path.join(output_dir, 'AMON_stages.json' if stage_format == 'json' else 'AMON_trace.json')
+    profile_output = path.join(output_dir, 'AMON_profile.prof') if profile else None
+    logger = Logger(path.join(output_dir, "AMON_log.txt"), stage_output, stage_format, profile_output)
+    logger['Stage log location'] = path.abspath(stage_output)
+    if profile:
+        logger['Profile location'] = path.abspath(profile_output)
+    if save_entries:
+        snapshot_writer = SnapshotWriter(path.join(output_dir, 'kegg_entries.jsonl.gz'))
+        logger['KEGG entries location'] = path.abspath(snapshot_writer.snapshot_loc)
+    else:
+        snapshot_writer = None
+    own_renderer = None
+
+    # samples are read and processed a chunk at a time so memory does not grow with the number of samples, chunked
+    # runs keep no intermediate results in memory to cache
+    if sample_chunksize is not None:
+        kegg_index, kegg_cache, load_entries = load_kegg_sources(kegg_index, kegg_cache, load_entries, logger)
+        lookup_records = make_record_lookup(kegg_index, kegg_cache, kegg_fetcher, flat_file_processes, load_entries,
+                                            snapshot_writer)
+        logger['kos_loc'] = path.abspath(kos_loc)
+        if other_kos_loc is not None:
+            logger['other_kos_loc'] = path.abspath(other_kos_loc)
+        if compounds_loc is not None:
+            cos_measured = list(read_in_ids(compounds_loc, name='Compounds', keep_separated=False).values())[0]
+            logger['compounds_loc'] = path.abspath(compounds_loc)
+        else:
+            cos_measured = None
+        logger['Samples per chunk'] = sample_chunksize
+
+        def iter_chunks():
+            for file_loc, name in ((kos_loc, name1), (other_kos_loc, name2)):
+                if file_loc is not None:
+                    yield from iter_sample_chunks(file_loc, sample_chunksize, keep_separated, samples_are_columns,
+                                                  name)
+        predict_chunked(iter_chunks, output_dir, logger, lookup_records, cos_measured, detected_only,
+                        rxn_compounds_only, unique_only, unique_max_samples, ko_file_loc, rn_file_loc, co_file_loc,
+                        pathway_file_loc, write_json, origin_table_format)
+        if kegg_cache is not None:
+            kegg_cache.log_stats(logger)
+    else:
+        # a resumed run keeps its stage cache in the output directory unless another is given
+        if resume and stage_cache is None:
+            stage_cache = path.join(output_dir, 'stage_cache')
+        if sample_metadata is not None:
+            sample_groups = read_sample_groups(sample_metadata, group_by)
+            logger['Sample metadata location'] = path.abspath(sample_metadata)
+            logger['Samples grouped by'] = '%s, %s' % (group_by, group_rule)
+        else:
+            sample_groups = None
+        results = predict(kos_loc, other_kos_loc, compounds_loc, name1, name2, keep_separated, samples_are_columns,
+                          detected_only, rxn_compounds_only, unique_only, unique_max_samples, ko_file_loc,
+                          rn_file_loc, co_file_loc, pathway_file_loc, kegg_index, kegg_cache, kegg_fetcher,
+                          flat_file_processes, load_entries, stage_cache, snapshot_writer, keep_records=write_json,
+                          permutations=permutations, null_model=null_model, null_background=null_background,
+                          permutation_seed=permutation_seed, permutation_processes=permutation_processes,
+                          sample_groups=sample_groups, group_rule=group_rule,
+                          robustness_replicates=robustness_replicates, robustness_method=robustness_method,
+                          subsample_fraction=subsample_fraction, rarefaction_depth=rarefaction_depth,
+                          robustness_seed=robustness_seed, robustness_processes=robustness_processes, logger=logger)
+        results.write(output_dir, origin_table_format, make_plots=False, write_json=write_json)
+        # figures are rendered in background processes while the run finishes, or while the next runs go on if a
+        # FigureRenderer shared between runs is given, and are only waited for by the run that made the renderer
+        if make_plots:
+            results.write_figure_inputs(output_dir)
+            if defer_plots:
+                logger['Figure inputs location'] = path.abspath(path.join(output_dir, FIGURE_INPUTS))
+            elif figure_renderer is not None:
+                figure_renderer.submit(output_dir)
+            else:
+                own_renderer = FigureRenderer(plot_processes, figure_format=figure_format, dpi=figure_dpi,
+                                              max_pathways=max_pathways, pathway_order=pathway_order)
+                own_renderer.submit(output_dir)
+
+    if snapshot_writer is not None:
+        snapshot_writer.close()
+    # the log of a finished run is written even if one of its figures fails
+    try:
+        if own_renderer is not None:
+            with logger.stage('render figures'):
+                try:
+                    figure_locations = own_renderer.wait().get(output_dir, dict())
+                finally:
+                    own_renderer.close()
+            for figure, figure_loc in figure_locations.items():
+                logger[FIGURE_LOG_NAMES[figure]] = path.abspath(figure_loc)
+    finally:
+        logger.output_log()
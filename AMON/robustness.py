@@ -0,0 +1,148 @@
+"""Robustness of predicted compounds and pathway enrichment to the KOs detected in each sample.
+
+KO calls from metagenomes are noisy and depend on sequencing depth. Each replicate keeps a random fraction of a
+sample's KOs, or rarefies the sample's KO counts to a fixed depth, and the compounds of a whole batch of replicates
+come from one sparse product of the replicates x KOs and KOs x compounds matrices. Enrichment of every replicate is
+tested with the same vectorized hypergeometric test as the samples. The fraction of replicates predicting each
+compound and finding each pathway enriched is reported for each sample. Samples are spread over worker processes,
+each with its own seed spawned from one seed so results do not depend on the number of processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from AMON.enrichment import fdr_bh_rows, hypergeometric_probabilities, select_tested_pathways
+
+ROBUSTNESS_METHODS = ('subsample', 'rarefy')
+# replicates of a sample drawn together in one sparse product
+REPLICATE_BATCH_SIZE = 250
+
+
+def read_in_count_matrix(file_loc, samples_are_columns=False):
+    """Samples x ids integer count CSR matrix of a tsv/csv or biom table with its sample and id labels"""
+    if file_loc.endswith('.biom'):
+        from biom import load_table
+        table = load_table(file_loc)
+        counts = table.matrix_data.transpose().tocsr()
+        sample_ids, ids = list(table.ids(axis='sample')), list(table.ids(axis='observation'))
+    elif file_loc.endswith('.tsv') or file_loc.endswith('.csv'):
+        from AMON.predict_metabolites import sniff_delimiter
+        table = pd.read_csv(file_loc, sep=sniff_delimiter(file_loc), index_col=0)
+        if samples_are_columns:
+            table = table.transpose()
+        counts = sparse.csr_matrix(table.to_numpy())
+        sample_ids, ids = [str(sample) for sample in table.index], [str(id_) for id_ in table.columns]
+    else:
+        raise ValueError('Input file %s can not be read as a table of counts.' % file_loc)
+    if np.any(counts.data < 0) or np.any(counts.data != np.round(counts.data)):
+        raise ValueError('Rarefaction needs whole number counts in %s' % file_loc)
+    return counts.astype(np.int64), sample_ids, ids
+
+
+def estimate_robustness(sample_kos, ko_cos, pathway_cos, replicates=1000, method='subsample', fraction=.8,
+                        depth=None, ko_counts=None, compound_masks=None, min_pathway_size=10, significance=.05,
+                        seed=0, processes=1):
+    """Compounds x samples and pathways x samples DataFrames of the fraction of replicates of each sample predicting
+    each compound and finding each pathway enriched, with an adjusted probability below significance.
+
+    sample_kos is a samples x KOs IncidenceMatrix, ko_cos a KOs x compounds produced IncidenceMatrix covering all the
+    samples' KOs and pathway_cos a pathways x compounds IncidenceMatrix. With method 'subsample' replicates keep each
+    KO with probability fraction. With 'rarefy' replicates are depth KOs drawn without replacement from the samples'
+    counts ko_counts, a (counts, sample ids, KO ids) tuple like read_in_count_matrix returns. Samples without counts
+    are kept whole and samples with fewer counts than depth have no estimates. compound_masks is a compounds or
+    samples x compounds boolean array over the columns of ko_cos of the compounds kept in enrichment, as in
+    PermutationNull.
+    """
+    if method not in ROBUSTNESS_METHODS:
+        raise ValueError('Robustness method must be one of %s' % ', '.join(ROBUSTNESS_METHODS))
+    if method == 'subsample' and not 0 < fraction <= 1:
+        raise ValueError('Fraction of KOs kept must be above 0 and at most 1')
+    if method == 'rarefy' and (depth is None or ko_counts is None):
+        raise ValueError('Rarefaction needs a depth and KO counts')
+    all_cos_size = len(pathway_cos.present_column_ids())
+    pathway_cos = select_tested_pathways(pathway_cos, min_pathway_size)
+    pathway_matrix = pathway_cos.transpose().reindex_rows(ko_cos.column_ids).matrix.astype(np.int32)
+    ko_matrix = ko_cos.reindex_rows(sample_kos.column_ids).matrix.astype(np.int32)
+    if ko_counts is not None:
+        counts, count_samples, count_kos = ko_counts
+        count_samples = {sample: i for i, sample in enumerate(count_samples)}
+        count_kos = {ko: i for i, ko in enumerate(count_kos)}
+    tasks = list()
+    for i, (sample, seed_sequence) in enumerate(zip(sample_kos.row_ids,
+                                                    np.random.SeedSequence(seed).spawn(sample_kos.shape[0]))):
+        kos = sample_kos.matrix.indices[sample_kos.matrix.indptr[i]:sample_kos.matrix.indptr[i + 1]]
+        sample_counts = None
+        if method == 'rarefy' and sample in count_samples:
+            ko_positions = [count_kos.get(sample_kos.column_ids[ko], -1) for ko in kos]
+            row = counts[count_samples[sample]].toarray().ravel()
+            sample_counts = np.array([row[position] if position >= 0 else 0 for position in ko_positions],
+                                     dtype=np.int64)
+        if compound_masks is None or compound_masks.ndim == 1:
+            mask = compound_masks
+        else:
+            mask = compound_masks[i]
+        tasks.append((kos, sample_counts, mask, seed_sequence))
+    initargs = (ko_matrix, pathway_matrix, all_cos_size, replicates, method, fraction, depth, significance)
+    if processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(processes, initializer=_init_robustness_worker, initargs=initargs) as executor:
+            frequencies = list(executor.map(_replicate_frequencies, *zip(*tasks)))
+    else:
+        _init_robustness_worker(*initargs)
+        frequencies = [_replicate_frequencies(*task) for task in tasks]
+    compound_frequencies = pd.DataFrame(np.stack([compound for compound, _ in frequencies], axis=1),
+                                        index=ko_cos.column_ids, columns=sample_kos.row_ids)
+    # only compounds predicted for a sample can be predicted for its replicates
+    compound_frequencies = compound_frequencies.loc[ko_cos.present_column_ids()]
+    pathway_frequencies = pd.DataFrame(np.stack([pathway for _, pathway in frequencies], axis=1),
+                                       index=pathway_cos.row_ids, columns=sample_kos.row_ids)
+    return compound_frequencies, pathway_frequencies
+
+
+_robustness_worker = dict()
+
+
+def _init_robustness_worker(ko_matrix, pathway_matrix, all_cos_size, replicates, method, fraction, depth,
+                            significance):
+    _robustness_worker.update(ko_matrix=ko_matrix, pathway_matrix=pathway_matrix, all_cos_size=all_cos_size,
+                              replicates=replicates, method=method, fraction=fraction, depth=depth,
+                              significance=significance)
+
+
+def _replicate_frequencies(kos, counts, mask, seed):
+    """Fractions of a sample's replicates predicting each compound and finding each pathway enriched, NaN if the
+    sample has fewer counts than the rarefaction depth"""
+    worker = _robustness_worker
+    sample_cos = worker['ko_matrix'][kos]
+    pathway_matrix = worker['pathway_matrix']
+    pathway_sizes = np.asarray(pathway_matrix.sum(axis=0)).ravel()
+    replicates = worker['replicates']
+    if counts is not None and counts.sum() < worker['depth']:
+        return np.full(sample_cos.shape[1], np.nan), np.full(pathway_matrix.shape[1], np.nan)
+    rng = np.random.default_rng(seed)
+    compound_counts = np.zeros(sample_cos.shape[1], dtype=np.int64)
+    enriched_counts = np.zeros(pathway_matrix.shape[1], dtype=np.int64)
+    for start in range(0, replicates, REPLICATE_BATCH_SIZE):
+        num_replicates = min(REPLICATE_BATCH_SIZE, replicates - start)
+        if counts is not None:
+            kept = rng.multivariate_hypergeometric(counts, worker['depth'], size=num_replicates) > 0
+        elif worker['method'] == 'subsample':
+            kept = rng.random((num_replicates, len(kos))) < worker['fraction']
+        else:
+            kept = np.ones((num_replicates, len(kos)), dtype=bool)
+        replicate_cos = sparse.csr_matrix(kept, dtype=np.int32) @ sample_cos
+        replicate_cos.data[:] = 1
+        replicate_cos.eliminate_zeros()
+        compound_counts += np.asarray(replicate_cos.sum(axis=0)).ravel()
+        if mask is not None:
+            replicate_cos = replicate_cos.multiply(mask[np.newaxis, :]).tocsr()
+        overlaps = (replicate_cos @ pathway_matrix).toarray()
+        probabilities = hypergeometric_probabilities(overlaps, np.asarray(replicate_cos.sum(axis=1)).ravel(),
+                                                     pathway_sizes, worker['all_cos_size'])
+        enriched = fdr_bh_rows(probabilities) < worker['significance']
+        # replicates split_enrichment_table would leave out, with pathways enriched without any overlap, find nothing
+        enriched &= ~np.any(enriched & (overlaps == 0), axis=1)[:, np.newaxis]
+        enriched_counts += np.sum(enriched, axis=0)
+    return compound_counts / replicates, enriched_counts / replicates
@@ -0,0 +1,193 @@
+"""Long running AMON prediction server.
+
+The server loads a KEGG index, or builds one from the KEGG flat files, once at startup and answers JSON requests over
+local HTTP so each prediction only pays for predict() itself and not for starting python, importing AMON and loading
+KEGG. Requests are run by a pool of worker threads, or of worker processes that each memory map the saved index when
+they start. An index built from the flat files is saved to a temporary directory for them.
+
+POST /predict takes the KOs of one or more samples and answers with the origin table, KEGG mapper input, per sample
+enrichment tables and stages of predict(). POST /enrichment takes compounds of one or more samples and answers with
+their pathway enrichment. GET /health answers with the KEGG sources the server was started with. Requests are sent
+and /predict responses written out with AMON.client.
+"""
+
+import json
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from AMON.client import DEFAULT_PORT
+from AMON.enrichment import calculate_enrichment_batch, make_pathway_co_matrix, split_enrichment_table
+from AMON.kegg_index import KEGGIndex, build_index, normalize_pathway_id
+from AMON.predict_metabolites import predict, make_record_lookup, get_pathways_from_cos, get_pathway_to_co_dict
+from AMON.sparse_engine import IncidenceMatrix
+
+# request keys: predict() arguments
+PREDICT_OPTIONS = {'gene_set_name': 'name1', 'other_gene_set_name': 'name2', 'detected_only': 'detected_only',
+                   'rn_compound_only': 'rxn_compounds_only', 'unique_only': 'unique_only',
+                   'unique_max_samples': 'unique_max_samples', 'permutations': 'permutations',
+                   'null_model': 'null_model', 'permutation_seed': 'permutation_seed'}
+DEFAULT_MAX_PERMUTATIONS = 10000
+
+
+def to_sample_dict(ids, name):
+    """Ids of a request as a dict of sample to ids, a plain list of ids is a single sample called name"""
+    if ids is None:
+        return None
+    if isinstance(ids, dict):
+        return ids
+    if isinstance(ids, list):
+        return {name: ids}
+    raise ValueError('Ids must be a list or an object of sample to list of ids')
+
+
+def to_id_list(ids, key):
+    """Ids of a request given as a list, anything else such as a string predict() would read as a path on the
+    server is rejected"""
+    if ids is None:
+        return None
+    if not isinstance(ids, list) or not all(isinstance(id_, str) for id_ in ids):
+        raise ValueError('%s must be a list of ids' % key)
+    return ids
+
+
+def check_permutations(request, max_permutations):
+    """Reject requests for more permutations than the server allows so one request can not hold a worker for long"""
+    permutations = request.get('permutations', 0)
+    if isinstance(permutations, bool) or not isinstance(permutations, int) or \
+            not 0 <= permutations <= max_permutations:
+        raise ValueError('permutations must be a whole number from 0 to %s' % max_permutations)
+
+
+def frame_to_json(frame):
+    # to_dict keeps full float precision where to_json rounds
+    return frame.to_dict(orient='split')
+
+
+_worker_index = None
+
+
+def _init_worker(kegg_index):
+    global _worker_index
+    _worker_index = KEGGIndex.load(kegg_index) if isinstance(kegg_index, str) else kegg_index
+
+
+def _predict(request):
+    if request.get('gene_set') is None:
+        raise ValueError('Prediction requests need a gene_set')
+    options = {argument: request[key] for key, argument in PREDICT_OPTIONS.items() if key in request}
+    name1 = options.get('name1', 'gene_set_1')
+    name2 = options.get('name2', 'gene_set_2')
+    results = predict(to_sample_dict(request.get('gene_set'), name1),
+                      to_sample_dict(request.get('other_gene_set'), name2),
+                      to_id_list(request.get('detected_compounds'), 'detected_compounds'),
+                      kegg_index=_worker_index, **options)
+    kegg_mapper_input = results.kegg_mapper_input
+    return {'origin_table': frame_to_json(results.origin_table),
+            'kegg_mapper': None if kegg_mapper_input is None else kegg_mapper_input.to_dict(),
+            'enrichment': {sample: frame_to_json(enrichment_df)
+                           for sample, enrichment_df in results.pathway_enrichment_dfs.items()},
+            'stages': json.loads(json.dumps(results.stages, default=str))}
+
+
+def _enrichment(request):
+    sample_cos = to_sample_dict(request.get('compounds'), request.get('name', 'compounds'))
+    if sample_cos is None:
+        raise ValueError('Enrichment requests need compounds')
+    lookup_records = make_record_lookup(_worker_index)
+    co_dict = lookup_records(set(co for cos in sample_cos.values() for co in cos), 'co', None)
+    pathway_dict = lookup_records([normalize_pathway_id(pathway) for pathway in get_pathways_from_cos(co_dict)],
+                                  'pathway', None)
+    pathway_cos = make_pathway_co_matrix(get_pathway_to_co_dict(pathway_dict, no_glycan=False))
+    enrichment_table = calculate_enrichment_batch(IncidenceMatrix.from_dict_of_lists(sample_cos), pathway_cos)
+    return {'enrichment': {sample: frame_to_json(enrichment_df)
+                           for sample, enrichment_df in split_enrichment_table(enrichment_table).items()}}
+
+
+REQUEST_HANDLERS = {'/predict': _predict, '/enrichment': _enrichment}
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """Runs JSON requests on the server's worker pool"""
+    def send_json(self, status, response):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'kegg': self.server.kegg_metadata})
+        else:
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path not in REQUEST_HANDLERS:
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object')
+            check_permutations(request, self.server.max_permutations)
+            response = self.server.executor.submit(REQUEST_HANDLERS[self.path], request).result()
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+        else:
+            self.send_json(200, response)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super(PredictionHandler, self).log_message(*args)
+
+
+class PredictionServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering prediction requests from a KEGG index, or the location of a saved one, held for the life
+    of the server. Requests for more than max_permutations permutations are rejected."""
+    daemon_threads = True
+
+    def __init__(self, kegg_index, host='127.0.0.1', port=DEFAULT_PORT, workers=1, processes=1, verbose=False,
+                 max_permutations=DEFAULT_MAX_PERMUTATIONS):
+        super(PredictionServer, self).__init__((host, port), PredictionHandler)
+        # worker processes load the index from its location so its arrays stay memory mapped and are not copied
+        self.temp_dir = None
+        if isinstance(kegg_index, str):
+            kegg_index_loc = kegg_index
+            kegg_index = KEGGIndex.load(kegg_index_loc)
+        elif processes > 1:
+            self.temp_dir = tempfile.mkdtemp(prefix='amon_kegg_index_')
+            kegg_index_loc = self.temp_dir
+            kegg_index.save(kegg_index_loc)
+        self.kegg_metadata = kegg_index.metadata
+        self.verbose = verbose
+        self.max_permutations = max_permutations
+        if processes > 1:
+            self.executor = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(kegg_index_loc,))
+        else:
+            self.executor = ThreadPoolExecutor(workers, initializer=_init_worker, initargs=(kegg_index,))
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def server_close(self):
+        super(PredictionServer, self).server_close()
+        self.executor.shutdown()
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def make_server(kegg_index=None, ko_file_loc=None, rn_file_loc=None, co_file_loc=None, pathway_file_loc=None,
+                flat_file_processes=1, **options):
+    """PredictionServer from a KEGG index or its location, or an index built from the KEGG flat files"""
+    if kegg_index is None:
+        if any(file_loc is None for file_loc in (ko_file_loc, rn_file_loc, co_file_loc, pathway_file_loc)):
+            raise ValueError('A KEGG index or all four KEGG flat files are needed to start a server')
+        kegg_index = build_index(ko_file_loc, rn_file_loc, co_file_loc, pathway_file_loc, flat_file_processes)
+    return PredictionServer(kegg_index, **options)
@@ -0,0 +1,175 @@
+"""Sparse boolean incidence matrices for propagating KOs to reactions to compounds.
+
+Samples x KOs, KOs x reactions and reactions x compounds are held as labelled scipy CSR matrices so the compounds
+produced by every sample are found with two sparse matrix products instead of looping over samples and KOs.
+"""
+
+import numpy as np
+from scipy import sparse
+
+# rules for combining the rows of a group besides a fraction of rows
+GROUP_RULES = ('any', 'all')
+
+
+def parse_group_rule(value):
+    """Group rule of IncidenceMatrix.group_rows from its name or a fraction given as text"""
+    if value in GROUP_RULES:
+        return value
+    fraction = float(value)
+    if not 0 < fraction <= 1:
+        raise ValueError('Group rule fraction must be above 0 and at most 1')
+    return fraction
+
+
+class IncidenceMatrix(object):
+    """Boolean CSR matrix with labelled rows and columns"""
+    def __init__(self, matrix, row_ids, column_ids):
+        self.matrix = sparse.csr_matrix(matrix, dtype=bool)
+        self.matrix.eliminate_zeros()
+        self.row_ids = list(row_ids)
+        self.column_ids = list(column_ids)
+        if self.matrix.shape != (len(self.row_ids), len(self.column_ids)):
+            raise ValueError('Matrix shape %s does not match %s row ids and %s column ids' %
+                             (self.matrix.shape, len(self.row_ids), len(self.column_ids)))
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @classmethod
+    def from_dict_of_lists(cls, dict_of_lists, column_ids=None):
+        """Rows are keys and columns are values, values not in column_ids are dropped if column_ids is given"""
+        row_ids = list(dict_of_lists.keys())
+        if column_ids is None:
+            column_ids = sorted(set(value for values in dict_of_lists.values() for value in values))
+        column_positions = {column_id: i for i, column_id in enumerate(column_ids)}
+        rows = list()
+        columns = list()
+        for row, values in enumerate(dict_of_lists.values()):
+            row_columns = set(column_positions[value] for value in values if value in column_positions)
+            rows += [row] * len(row_columns)
+            columns += row_columns
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)),
+                                   shape=(len(row_ids), len(column_ids)))
+        return cls(matrix, row_ids, column_ids)
+
+    @classmethod
+    def from_dict_of_arrays(cls, dict_of_arrays, column_ids):
+        """Rows are keys and columns are column_ids, values are arrays of codes that are positions in column_ids"""
+        indices = [np.asarray(codes, dtype=np.int32) for codes in dict_of_arrays.values()]
+        indptr = np.concatenate([[0], np.cumsum([len(codes) for codes in indices])]).astype(np.int32)
+        indices = np.concatenate(indices) if len(indices) > 0 else np.zeros(0, dtype=np.int32)
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=bool), indices, indptr),
+                                   shape=(len(dict_of_arrays), len(column_ids)))
+        matrix.sum_duplicates()
+        return cls(matrix, dict_of_arrays.keys(), column_ids)
+
+    def to_dict_of_arrays(self):
+        """Positions in column_ids of the true columns of each row, which are their codes in Vocabulary(column_ids)"""
+        indptr, indices = self.matrix.indptr, self.matrix.indices
+        return {row_id: np.sort(indices[indptr[i]:indptr[i + 1]]).astype(np.int32)
+                for i, row_id in enumerate(self.row_ids)}
+
+    def to_dict_of_sets(self):
+        column_ids = np.asarray(self.column_ids, dtype=object)
+        indptr, indices = self.matrix.indptr, self.matrix.indices
+        return {row_id: set(column_ids[indices[indptr[i]:indptr[i + 1]]]) for i, row_id in enumerate(self.row_ids)}
+
+    def present_column_ids(self):
+        """Column ids that are true in at least one row"""
+        present = self.column_counts() > 0
+        return [column_id for column_id, is_present in zip(self.column_ids, present) if is_present]
+
+    def reindex_rows(self, row_ids):
+        """Reorder rows to row_ids, rows for ids not in this matrix are all false"""
+        row_positions = {row_id: i for i, row_id in enumerate(self.row_ids)}
+        selected = [(i, row_positions[row_id]) for i, row_id in enumerate(row_ids) if row_id in row_positions]
+        new_rows = [i for i, _ in selected]
+        old_rows = [j for _, j in selected]
+        selector = sparse.csr_matrix((np.ones(len(selected), dtype=np.int32), (new_rows, old_rows)),
+                                     shape=(len(row_ids), len(self.row_ids)))
+        return IncidenceMatrix(selector @ self.matrix.astype(np.int32), row_ids, self.column_ids)
+
+    def select_rows(self, mask):
+        return IncidenceMatrix(self.matrix[np.flatnonzero(mask)], np.asarray(self.row_ids, dtype=object)[mask],
+                               self.column_ids)
+
+    def select_columns(self, mask):
+        return IncidenceMatrix(self.matrix[:, np.flatnonzero(mask)], self.row_ids,
+                               np.asarray(self.column_ids, dtype=object)[mask])
+
+    def row_counts(self):
+        """Number of columns each row is true in"""
+        return np.asarray(self.matrix.getnnz(axis=1))
+
+    def column_counts(self):
+        """Number of rows each column is true in"""
+        return np.asarray(self.matrix.getnnz(axis=0))
+
+    def keep_rare_columns(self, max_rows=1):
+        """Keep only entries in columns true in at most max_rows rows, by default the entries unique to each row"""
+        keep = self.column_counts() <= max_rows
+        return IncidenceMatrix(self.matrix.multiply(keep[np.newaxis, :]), self.row_ids, self.column_ids)
+
+    def group_rows(self, row_groups, rule='any'):
+        """One row per group, true where any of the rows in the group is true, where all of them are if rule is 'all' or
+        where at least a fraction of them are if rule is a number. row_groups maps each row id to its group and groups
+        are kept in order of first appearance."""
+        if rule not in GROUP_RULES and not (isinstance(rule, (int, float)) and 0 < rule <= 1):
+            raise ValueError('Group rule must be one of %s or a fraction above 0 and at most 1' %
+                             ', '.join(GROUP_RULES))
+        missing = [row_id for row_id in self.row_ids if row_id not in row_groups]
+        if len(missing) > 0:
+            raise ValueError('No group given for rows: %s' % ', '.join(str(row_id) for row_id in missing[:10]))
+        groups = list(dict.fromkeys(row_groups[row_id] for row_id in self.row_ids))
+        group_positions = {group: i for i, group in enumerate(groups)}
+        indicator = sparse.csr_matrix((np.ones(len(self.row_ids), dtype=np.int32),
+                                       ([group_positions[row_groups[row_id]] for row_id in self.row_ids],
+                                        np.arange(len(self.row_ids)))), shape=(len(groups), len(self.row_ids)))
+        counts = (indicator @ self.matrix.astype(np.int32)).tocsr()
+        if rule != 'any':
+            group_sizes = np.asarray(indicator.sum(axis=1)).ravel()
+            # rows a column must be true in for each group, compared to the stored counts of every group's row
+            thresholds = group_sizes if rule == 'all' else np.maximum(np.ceil(rule * group_sizes - 1e-9), 1)
+            counts.data = counts.data * (counts.data >= np.repeat(thresholds, np.diff(counts.indptr)))
+            counts.eliminate_zeros()
+        return IncidenceMatrix(counts, groups, self.column_ids)
+
+    def transpose(self):
+        return IncidenceMatrix(self.matrix.transpose(), self.column_ids, self.row_ids)
+
+    def count_dot(self, other):
+        """Integer product counting the columns true in row i of self that link to column j of other. Rows of other
+        are aligned to the columns of self by id."""
+        other = other.reindex_rows(self.column_ids)
+        return self.matrix.astype(np.int32) @ other.matrix.astype(np.int32)
+
+    def dot(self, other):
+        """Boolean product, row i of the result is true where any column true in row i of self links to it in other"""
+        return IncidenceMatrix(self.count_dot(other) > 0, self.row_ids, other.column_ids)
+
+
+def make_ko_rn_matrix(ko_dict):
+    """KOs x reactions from the reactions in the DBLINKS of KO records"""
+    return IncidenceMatrix.from_dict_of_lists({ko: record['DBLINKS']['RN'] if 'RN' in record.get('DBLINKS', ()) else ()
+                                               for ko, record in ko_dict.items()})
+
+
+def make_rn_co_matrix(rn_dict):
+    """Reactions x compounds from the products in the EQUATION of reaction records"""
+    return IncidenceMatrix.from_dict_of_lists({rn: record['EQUATION'][1] for rn, record in rn_dict.items()})
+
+
+def get_sample_rns(sample_kos, ko_dict):
+    """Samples x reactions, sparse version of get_rns_from_kos"""
+    return IncidenceMatrix.from_dict_of_lists(sample_kos).dot(make_ko_rn_matrix(ko_dict))
+
+
+def get_sample_cos(sample_rns, rn_dict):
+    """Samples x compounds produced, sparse version of get_products_from_rns"""
+    return sample_rns.dot(make_rn_co_matrix(rn_dict))
+
+
+def predict_compounds(sample_kos, ko_dict, rn_dict):
+    """Compounds produced by each sample as a dict of sets"""
+    return get_sample_cos(get_sample_rns(sample_kos, ko_dict), rn_dict).to_dict_of_sets()
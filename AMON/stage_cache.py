@@ -0,0 +1,131 @@
+"""Content addressed cache of the intermediate results of main().
+
+Each cached stage is stored under a key hashing the contents of its input files, the KEGG records it was made from and
+the options it depends on, chained from the key of the stage before it. A re-run with only downstream options changed
+finds the sample KOs, sample reactions, sample compounds and pathway to compound map of the earlier run under the same
+keys and only recomputes the stages after them. Results are saved as .npz files of string and integer arrays so no
+pickles are ever loaded.
+"""
+
+import hashlib
+import json
+from os import path, makedirs, listdir, replace, stat, getpid
+
+import numpy as np
+from scipy import sparse
+
+from AMON import __version__
+from AMON.sparse_engine import IncidenceMatrix
+
+STAGE_CACHE_VERSION = 1
+FILE_HASHES = 'file_hashes.json'
+HASH_BLOCK_SIZE = 2 ** 22
+
+
+class StageCache(object):
+    """Directory of stage results keyed by hashes of everything they were made from"""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        makedirs(cache_dir, exist_ok=True)
+        self.file_hashes_loc = path.join(cache_dir, FILE_HASHES)
+        if path.isfile(self.file_hashes_loc):
+            with open(self.file_hashes_loc) as f:
+                self.file_hashes = json.load(f)
+        else:
+            self.file_hashes = dict()
+        self.hits = list()
+        self.misses = list()
+
+    def hash_file(self, file_loc):
+        """sha256 of a file or of every file in a directory, only rehashed when a file's size or mtime changes"""
+        if path.isdir(file_loc):
+            return hash_parts([[name, self.hash_file(path.join(file_loc, name))]
+                               for name in sorted(listdir(file_loc))])
+        file_loc = path.abspath(file_loc)
+        file_stat = stat(file_loc)
+        signature = [file_stat.st_size, file_stat.st_mtime_ns]
+        if file_loc in self.file_hashes and self.file_hashes[file_loc][0] == signature:
+            return self.file_hashes[file_loc][1]
+        file_hash = hashlib.sha256()
+        with open(file_loc, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                file_hash.update(block)
+        self.file_hashes[file_loc] = [signature, file_hash.hexdigest()]
+        write_json_atomic(self.file_hashes, self.file_hashes_loc)
+        return file_hash.hexdigest()
+
+    def hash_input(self, input_):
+        """Hash of an input given as a file, a dict of sample to ids or a collection of ids, None if not given"""
+        if input_ is None:
+            return None
+        if isinstance(input_, str):
+            return self.hash_file(input_)
+        if isinstance(input_, dict):
+            return hash_parts([[str(key), sorted(values)] for key, values in input_.items()])
+        return hash_parts(sorted(input_))
+
+    def key(self, stage, *parts):
+        """Key of a stage from json serializable parts, such as file hashes, options and the keys of earlier stages"""
+        return hash_parts([STAGE_CACHE_VERSION, __version__, stage, parts])
+
+    def _loc(self, key):
+        return path.join(self.cache_dir, '%s.npz' % key)
+
+    def load(self, stage, key):
+        """Arrays saved under a key, None if there are none"""
+        if not path.isfile(self._loc(key)):
+            self.misses.append(stage)
+            return None
+        with np.load(self._loc(key), allow_pickle=False) as arrays:
+            arrays = dict(arrays)
+        self.hits.append(stage)
+        return arrays
+
+    def save(self, key, **arrays):
+        # written to a temporary file first so a run killed part way never leaves a truncated result
+        temp_loc = '%s.%s.tmp' % (self._loc(key), getpid())
+        with open(temp_loc, 'wb') as f:
+            np.savez(f, **arrays)
+        replace(temp_loc, self._loc(key))
+
+    def load_matrix(self, stage, key):
+        arrays = self.load(stage, key)
+        return None if arrays is None else arrays_to_matrix(arrays)
+
+    def save_matrix(self, key, incidence_matrix):
+        self.save(key, **matrix_to_arrays(incidence_matrix))
+
+    def load_dict_of_lists(self, stage, key):
+        matrix = self.load_matrix(stage, key)
+        return None if matrix is None else matrix.to_dict_of_sets()
+
+    def save_dict_of_lists(self, key, dict_of_lists):
+        self.save_matrix(key, IncidenceMatrix.from_dict_of_lists(dict_of_lists))
+
+    def log_stats(self, logger):
+        logger['Stage cache location'] = path.abspath(self.cache_dir)
+        logger['Stages reused from stage cache'] = ', '.join(self.hits) if len(self.hits) > 0 else 'none'
+
+
+def hash_parts(parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def write_json_atomic(json_object, output_loc):
+    temp_loc = '%s.%s.tmp' % (output_loc, getpid())
+    with open(temp_loc, 'w') as f:
+        json.dump(json_object, f)
+    replace(temp_loc, output_loc)
+
+
+def matrix_to_arrays(incidence_matrix):
+    matrix = incidence_matrix.matrix
+    return {'indptr': matrix.indptr, 'indices': matrix.indices, 'shape': np.array(matrix.shape),
+            'row_ids': np.array(incidence_matrix.row_ids, dtype=str),
+            'column_ids': np.array(incidence_matrix.column_ids, dtype=str)}
+
+
+def arrays_to_matrix(arrays):
+    matrix = sparse.csr_matrix((np.ones(len(arrays['indices']), dtype=bool), arrays['indices'], arrays['indptr']),
+                               shape=tuple(arrays['shape']))
+    return IncidenceMatrix(matrix, arrays['row_ids'].tolist(), arrays['column_ids'].tolist())
@@ -0,0 +1,68 @@
+"""Integer codes for KEGG identifiers.
+
+A Vocabulary gives each KO, reaction, compound or pathway id an int32 code the first time it is seen, so sets of ids
+can be held as sorted arrays of codes instead of sets of strings and turned back into ids only when written out.
+Links between ids, such as KOs to reactions, are held as sparse boolean matrices from codes to codes.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+def is_encoded(dict_of_lists):
+    """True if the values of a dict are arrays of codes rather than collections of ids"""
+    return any(isinstance(values, np.ndarray) for values in dict_of_lists.values())
+
+
+class Vocabulary(object):
+    """Int32 code for each id, in the order ids were added"""
+    def __init__(self, ids=()):
+        self.ids = list()
+        self.codes = dict()
+        self.add(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return id_ in self.codes
+
+    def add(self, ids):
+        for id_ in ids:
+            if id_ not in self.codes:
+                self.codes[id_] = len(self.ids)
+                self.ids.append(id_)
+
+    def encode(self, ids, add=True):
+        """Sorted unique codes of ids, ids not yet in the vocabulary are added or dropped if add is False"""
+        if add:
+            self.add(ids)
+        codes = [self.codes[id_] for id_ in ids if id_ in self.codes]
+        return np.unique(np.array(codes, dtype=np.int32))
+
+    def decode(self, codes):
+        return [self.ids[code] for code in codes]
+
+    def encode_dict(self, dict_of_lists, add=True):
+        return {key: self.encode(values, add) for key, values in dict_of_lists.items()}
+
+    def decode_dict(self, dict_of_codes):
+        return {key: set(self.decode(codes)) for key, codes in dict_of_codes.items()}
+
+    def encode_relation(self, dict_of_lists):
+        """Sparse boolean matrix with a row and a column per code, true where a key links to a value"""
+        rows = list()
+        columns = list()
+        for key, values in dict_of_lists.items():
+            value_codes = self.encode(values)
+            rows.append(np.full(len(value_codes), self.encode([key])[0], dtype=np.int32))
+            columns.append(value_codes)
+        rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int32)
+        columns = np.concatenate(columns) if len(columns) > 0 else np.zeros(0, dtype=np.int32)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)), shape=(len(self), len(self)))
+
+
+def follow(relation, codes):
+    """Sorted unique codes linked to by any of codes in a relation from Vocabulary.encode_relation"""
+    codes = codes[codes < relation.shape[0]]
+    return np.unique(relation[codes].indices).astype(np.int32)
@@ -2,6 +2,12 @@
 
 import argparse
 
+from AMON.kegg_cache import KEGGCache
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.enrichment import NULL_MODELS
+from AMON.figures import FIGURE_FORMATS, read_pathway_order
+from AMON.robustness import ROBUSTNESS_METHODS
+from AMON.sparse_engine import parse_group_rule
 from AMON.predict_metabolites import main
 
 if __name__ == '__main__':
@@ -26,6 +32,9 @@ if __name__ == '__main__':
     parser.add_argument('--samples_are_columns', help='If data is in tabular format, by default genes are columns and '
                                                       'samples rows, to indicate that samples are columns and genes '
                                                       'are rows use this flag', action='store_true', default=False)
+    parser.add_argument('--sample_chunksize', help='with --keep_separated read and process samples this many at a '
+                                                   'time so memory does not grow with the number of samples, plots '
+                                                   'and the KEGG mapper input are not made', type=int)
     # Filters
     parser.add_argument('--detected_only', help="only use detected compounds in enrichment analysis",
                         action='store_true', default=False)
@@ -33,13 +42,97 @@ if __name__ == '__main__':
                         default=False)
     parser.add_argument('--unique_only', help='only use compounds that are unique to a sample in enrichment',
                         action='store_true', default=False)
+    parser.add_argument('--unique_max_samples', help='with --unique_only use compounds found in at most this many '
+                                                     'samples', type=int, default=1)
+    # Sample groups
+    parser.add_argument('--sample_metadata', help='tsv or csv of sample metadata with samples as rows, samples of the '
+                                                  'gene set are analyzed in groups of a column of it given with '
+                                                  '--group_by')
+    parser.add_argument('--group_by', help='column of the sample metadata samples are grouped by')
+    parser.add_argument('--group_rule', help='a group has a KO if any of its samples have it, all of them do or at '
+                                             'least this fraction of them do', type=parse_group_rule, default='any')
+    # Permutation null model
+    parser.add_argument('--permutations', help='also test enrichment against this many random sets of KOs or '
+                                               'reactions the size of each sample\'s', type=int, default=0)
+    parser.add_argument('--null_model', help='draw random sets of KOs or of the reactions of KOs',
+                        choices=NULL_MODELS, default='ko')
+    parser.add_argument('--null_background', help='KOs random sets are drawn from along with the KOs of all samples, '
+                                                  'in any of the forms of the gene set')
+    parser.add_argument('--permutation_seed', help='seed of the random sets', type=int, default=0)
+    parser.add_argument('--permutation_processes', help='number of processes random sets are drawn in', type=int,
+                        default=1)
+    # Robustness
+    parser.add_argument('--robustness_replicates', help='estimate how often each compound is predicted and each '
+                                                        'pathway enriched in this many replicates of each sample',
+                        type=int, default=0)
+    parser.add_argument('--robustness_method', help='replicates keep a random fraction of a sample\'s KOs or rarefy '
+                                                    'its KO counts, which needs a tsv, csv or biom of counts with '
+                                                    '--keep_separated', choices=ROBUSTNESS_METHODS, default='subsample')
+    parser.add_argument('--subsample_fraction', help='fraction of KOs subsampled replicates keep', type=float,
+                        default=.8)
+    parser.add_argument('--rarefaction_depth', help='number of KO counts rarefied replicates draw, samples with fewer '
+                                                    'are left without estimates', type=int)
+    parser.add_argument('--robustness_seed', help='seed of the replicates', type=int, default=0)
+    parser.add_argument('--robustness_processes', help='number of processes replicates are drawn in', type=int,
+                        default=1)
+    # Outputs
+    parser.add_argument('--origin_table_format', help='format of origin table, tsv or sparse hdf5 biom',
+                        choices=('tsv', 'biom'), default='tsv')
+    parser.add_argument('--no_plots', help='skip the venn diagram and enrichment heatmap, plotting libraries are '
+                                           'then never imported', action='store_true', default=False)
+    parser.add_argument('--figure_format', help='format of the venn diagram and enrichment heatmap, svg and pdf are '
+                                                'faster to make than high resolution png', choices=FIGURE_FORMATS,
+                        default='png')
+    parser.add_argument('--figure_dpi', help='resolution of figures, by default 300 for the venn diagram and 500 for '
+                                             'the enrichment heatmap', type=int)
+    parser.add_argument('--max_pathways', help='only show this many pathways, those with the lowest adjusted '
+                                               'probabilities in any sample, in the enrichment heatmap', type=int)
+    parser.add_argument('--pathway_order', help='new line separated list of pathways to show in the enrichment '
+                                                'heatmap in this order instead of clustering them')
+    parser.add_argument('--defer_plots', help='only save the inputs of the figures, which are made later with '
+                                              'render_figures.py', action='store_true', default=False)
+    parser.add_argument('--plot_processes', help='number of background processes figures are made in while the run '
+                                                 'finishes, more than one makes the figures at the same time',
+                        type=int, default=1)
+    parser.add_argument('--stage_format', help='format of the per stage timing, memory and count log, json or a '
+                                               'chrome trace', choices=('json', 'chrome'), default='json')
+    parser.add_argument('--profile', help='profile every stage and save the cProfile stats of the slowest stage',
+                        action='store_true', default=False)
     # Local KEGG files
     parser.add_argument('--ko_file_loc', help='Location of ko file from KEGG FTP download')
     parser.add_argument('--rn_file_loc', help='Location of reaction file from KEGG FTP download')
     parser.add_argument('--co_file_loc', help='Location of compound file from KEGG FTP download')
     parser.add_argument('--pathway_file_loc', help='Location of pathway file from KEGG FTP download')
-    parser.add_argument('--save_entries', help='Save json file of KEGG entries at all levels used in analysis for '
-                                               'deeper analysis', action='store_true', default=False)
+    parser.add_argument('--flat_file_processes', help='number of processes each KEGG file is split between when '
+                                                      'reading records from it', type=int, default=1)
+    parser.add_argument('--kegg_index', help='Location of KEGG index made with build_kegg_index.py, used in place of '
+                                             'the KEGG files and the KEGG API')
+    parser.add_argument('--kegg_cache', help='Location of a local cache of KEGG records from the KEGG API, shared '
+                                             'between runs')
+    parser.add_argument('--kegg_release', help='KEGG release label records in the KEGG cache are stored under',
+                        default='current')
+    parser.add_argument('--kegg_cache_max_records', help='maximum number of records kept in the KEGG cache',
+                        type=int)
+    parser.add_argument('--kegg_cache_max_age', help='days before records in the KEGG cache are fetched again',
+                        type=float)
+    parser.add_argument('--kegg_max_requests', help='maximum number of requests to the KEGG API running at once',
+                        type=int, default=3)
+    parser.add_argument('--kegg_rate_limit', help='maximum number of requests to the KEGG API started per second',
+                        type=float, default=3)
+    parser.add_argument('--save_entries', help='Save a compressed snapshot of the KEGG entries at all levels used in '
+                                               'analysis, which can be given to later runs with --load_entries',
+                        action='store_true', default=False)
+    parser.add_argument('--load_entries', help='Snapshot of KEGG entries saved with --save_entries, only entries '
+                                               'missing from it are looked up')
+    parser.add_argument('--save_json', help='Save json files of the KEGG KO, reaction and compound entries used in '
+                                            'analysis for deeper analysis', action='store_true', default=False)
+    # Re-runs
+    parser.add_argument('--resume', help='reuse an existing output directory and the results of every stage whose '
+                                         'inputs, KEGG records and options are unchanged since an earlier run in it, '
+                                         'stages made from KEGG API records are only reused with a KEGG cache',
+                        action='store_true', default=False)
+    parser.add_argument('--stage_cache', help='directory of stage results shared between runs, by default a resumed '
+                                              'run keeps them in the output directory')
 
     args = parser.parse_args()
     kos_loc = args.gene_set
@@ -61,16 +154,42 @@ if __name__ == '__main__':
     detected_compounds_only = args.detected_only
     rn_compounds_only = args.rn_compound_only
     unique_only = args.unique_only
+    unique_max_samples = args.unique_max_samples
 
     ko_file_loc = args.ko_file_loc
     rn_file_loc = args.rn_file_loc
     co_file_loc = args.co_file_loc
     pathway_file_loc = args.pathway_file_loc
-    write_json = args.save_entries
+    write_json = args.save_json
+    kegg_index = args.kegg_index
+    origin_table_format = args.origin_table_format
+    make_plots = not args.no_plots
+
+    kegg_fetcher = KEGGFetcher(max_requests=args.kegg_max_requests, rate_limit=args.kegg_rate_limit)
+    if args.kegg_cache is not None:
+        max_age = args.kegg_cache_max_age * 86400 if args.kegg_cache_max_age is not None else None
+        kegg_cache = KEGGCache(args.kegg_cache, release=args.kegg_release, max_records=args.kegg_cache_max_records,
+                               max_age=max_age, fetcher=kegg_fetcher.fetch_records)
+    else:
+        kegg_cache = None
 
     if detected_compounds_only and detected_compounds is None:
         raise ValueError('Cannot have detected compounds only and not provide detected compounds')
 
     main(kos_loc, output_dir, other_kos_loc, detected_compounds, name1, name2, keep_separated, samples_are_columns,
          detected_compounds_only, rn_compounds_only, unique_only, ko_file_loc=ko_file_loc, rn_file_loc=rn_file_loc,
-         co_file_loc=co_file_loc, pathway_file_loc=pathway_file_loc, write_json=write_json)
+         co_file_loc=co_file_loc, pathway_file_loc=pathway_file_loc, write_json=write_json,
+         kegg_index=kegg_index, unique_max_samples=unique_max_samples, origin_table_format=origin_table_format,
+         kegg_cache=kegg_cache, kegg_fetcher=kegg_fetcher, make_plots=make_plots, stage_format=args.stage_format,
+         profile=args.profile, flat_file_processes=args.flat_file_processes,
+         save_entries=args.save_entries, load_entries=args.load_entries, resume=args.resume,
+         stage_cache=args.stage_cache, sample_chunksize=args.sample_chunksize, figure_format=args.figure_format,
+         figure_dpi=args.figure_dpi, max_pathways=args.max_pathways,
+         pathway_order=read_pathway_order(args.pathway_order) if args.pathway_order is not None else None,
+         defer_plots=args.defer_plots, plot_processes=args.plot_processes, permutations=args.permutations,
+         null_model=args.null_model, null_background=args.null_background, permutation_seed=args.permutation_seed,
+         permutation_processes=args.permutation_processes, sample_metadata=args.sample_metadata,
+         group_by=args.group_by, group_rule=args.group_rule, robustness_replicates=args.robustness_replicates,
+         robustness_method=args.robustness_method, subsample_fraction=args.subsample_fraction,
+         rarefaction_depth=args.rarefaction_depth, robustness_seed=args.robustness_seed,
+         robustness_processes=args.robustness_processes)
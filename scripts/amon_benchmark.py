@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import tempfile
+
+import pandas as pd
+
+from AMON.benchmark import DEFAULT_KO_COUNT, STAGES, run_benchmarks, compare_benchmarks
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output', help="tsv to write benchmark results to", required=True)
+    parser.add_argument('--samples', help='numbers of samples to benchmark', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--kos', help='number of KOs in the synthetic KEGG database and gene sets', type=int,
+                        default=DEFAULT_KO_COUNT)
+    parser.add_argument('--ko_fraction', help='fraction of KOs present in each synthetic sample', type=float,
+                        default=.5)
+    parser.add_argument('--input_format', help='format of the synthetic gene sets', choices=('biom', 'tsv'),
+                        default='biom')
+    parser.add_argument('--stages', help='stages to benchmark', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--seed', help='seed for the synthetic KEGG database and gene sets', type=int, default=0)
+    parser.add_argument('--repeats', help='times each stage is run, the fastest is reported', type=int, default=1)
+    parser.add_argument('--no_memory', help='do not measure peak memory, which runs each stage once more',
+                        action='store_true', default=False)
+    parser.add_argument('--work_dir', help='directory for synthetic inputs and outputs, a temporary directory if '
+                                           'not given')
+    parser.add_argument('--baseline', help='benchmark results to compare to, exits with an error if any stage is '
+                                           'slower or uses more memory than the baseline by more than the tolerance')
+    parser.add_argument('--tolerance', help='ratio to the baseline above which a stage is a regression', type=float,
+                        default=1.5)
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir if args.work_dir is not None else temp_dir
+        results = run_benchmarks(args.samples, work_dir, num_kos=args.kos, ko_fraction=args.ko_fraction,
+                                 input_format=args.input_format, seed=args.seed, repeats=args.repeats,
+                                 memory=not args.no_memory, stages=args.stages)
+    results.to_csv(args.output, sep='\t', index=False)
+    print(results.to_string(index=False))
+
+    if args.baseline is not None:
+        regressions = compare_benchmarks(results, pd.read_csv(args.baseline, sep='\t'), args.tolerance)
+        if len(regressions) > 0:
+            print('Regressions compared to %s:' % args.baseline)
+            print(regressions.to_string(index=False))
+            sys.exit(1)
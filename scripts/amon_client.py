@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import argparse
+
+from AMON.enrichment import NULL_MODELS
+from AMON.predict_metabolites import read_in_ids
+from AMON.client import send_request, write_response, DEFAULT_PORT
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--gene_set', help="KEGG KO's from bacterial community or organism of interest in the "
+                                                 "form of a white space separated list, a tsv or csv with KO ids as "
+                                                 "column names or a biom file with KO ids as observations",
+                        required=True)
+    parser.add_argument('-o', '--output_dir', help="directory to store output", required=True)
+    parser.add_argument('--url', help='URL of a server started with amon_server.py',
+                        default='http://127.0.0.1:%s' % DEFAULT_PORT)
+    parser.add_argument('--detected_compounds', help="list of compounds detected via metabolomics")
+    parser.add_argument('--other_gene_set', help="white space separated list of KEGG KO's from the host, another "
+                                                 "organism or other environment")
+    parser.add_argument('--gene_set_name', help="Name to use for first gene set (should have no spaces, underscore "
+                                                "separated)", default='gene_set_1')
+    parser.add_argument('--other_gene_set_name', help="Name to use for second gene set (should have no spaces, "
+                                                      "underscore separated)", default='gene_set_2')
+    parser.add_argument('--keep_separated', help='If input in biom or tabular format keep samples separate for '
+                                                 'analysis', action='store_true', default=False)
+    parser.add_argument('--samples_are_columns', help='If data is in tabular format, by default genes are columns and '
+                                                      'samples rows, to indicate that samples are columns and genes '
+                                                      'are rows use this flag', action='store_true', default=False)
+    parser.add_argument('--detected_only', help="only use detected compounds in enrichment analysis",
+                        action='store_true', default=False)
+    parser.add_argument('--rn_compound_only', help="only use compounds with associated reactions", action='store_true',
+                        default=False)
+    parser.add_argument('--unique_only', help='only use compounds that are unique to a sample in enrichment',
+                        action='store_true', default=False)
+    parser.add_argument('--unique_max_samples', help='with --unique_only use compounds found in at most this many '
+                                                     'samples', type=int, default=1)
+    # Permutation null model
+    parser.add_argument('--permutations', help='also test enrichment against this many random sets of KOs or '
+                                               'reactions the size of each sample\'s', type=int, default=0)
+    parser.add_argument('--null_model', help='draw random sets of KOs or of the reactions of KOs',
+                        choices=NULL_MODELS, default='ko')
+    parser.add_argument('--permutation_seed', help='seed of the random sets', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.detected_only and args.detected_compounds is None:
+        raise ValueError('Cannot have detected compounds only and not provide detected compounds')
+
+    def read_sample_kos(file_loc, name):
+        sample_kos = read_in_ids(file_loc, keep_separated=args.keep_separated,
+                                 samples_are_columns=args.samples_are_columns, name=name)
+        return {sample: sorted(kos) for sample, kos in sample_kos.items()}
+
+    request = {'gene_set': read_sample_kos(args.gene_set, args.gene_set_name), 'gene_set_name': args.gene_set_name,
+               'other_gene_set_name': args.other_gene_set_name, 'detected_only': args.detected_only,
+               'rn_compound_only': args.rn_compound_only, 'unique_only': args.unique_only,
+               'unique_max_samples': args.unique_max_samples, 'permutations': args.permutations,
+               'null_model': args.null_model, 'permutation_seed': args.permutation_seed}
+    if args.other_gene_set is not None:
+        request['other_gene_set'] = read_sample_kos(args.other_gene_set, args.other_gene_set_name)
+    if args.detected_compounds is not None:
+        request['detected_compounds'] = sorted(list(read_in_ids(args.detected_compounds, name='Compounds').values())[0])
+    write_response(send_request(args.url, '/predict', request), args.output_dir)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+import argparse
+
+from AMON.client import DEFAULT_PORT
+from AMON.server import DEFAULT_MAX_PERMUTATIONS, make_server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--kegg_index', help='Location of KEGG index made with build_kegg_index.py')
+    parser.add_argument('--ko_file_loc', help='Location of ko file from KEGG FTP download, used with the other KEGG '
+                                              'files to build an index at startup if no index is given')
+    parser.add_argument('--rn_file_loc', help='Location of reaction file from KEGG FTP download')
+    parser.add_argument('--co_file_loc', help='Location of compound file from KEGG FTP download')
+    parser.add_argument('--pathway_file_loc', help='Location of pathway file from KEGG FTP download')
+    parser.add_argument('--flat_file_processes', help='number of processes each KEGG file is split between when '
+                                                      'building an index at startup', type=int, default=1)
+    parser.add_argument('--host', help='address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='port to listen on', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', help='number of requests run at once by worker threads', type=int, default=4)
+    parser.add_argument('--processes', help='run requests in this many worker processes instead of threads',
+                        type=int, default=1)
+    parser.add_argument('--max_permutations', help='most permutations a request can ask for', type=int,
+                        default=DEFAULT_MAX_PERMUTATIONS)
+    parser.add_argument('--verbose', help='log every request', action='store_true', default=False)
+
+    args = parser.parse_args()
+
+    server = make_server(args.kegg_index, args.ko_file_loc, args.rn_file_loc, args.co_file_loc, args.pathway_file_loc,
+                         args.flat_file_processes, host=args.host, port=args.port, workers=args.workers,
+                         processes=args.processes, verbose=args.verbose, max_permutations=args.max_permutations)
+    print('AMON server listening on %s' % server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+
+import argparse
+
+from AMON.kegg_index import build_index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o', '--output_dir', help="directory to store KEGG index", required=True)
+    parser.add_argument('--ko_file_loc', help='Location of ko file from KEGG FTP download', required=True)
+    parser.add_argument('--rn_file_loc', help='Location of reaction file from KEGG FTP download', required=True)
+    parser.add_argument('--co_file_loc', help='Location of compound file from KEGG FTP download', required=True)
+    parser.add_argument('--pathway_file_loc', help='Location of pathway file from KEGG FTP download', required=True)
+    parser.add_argument('--processes', help='number of processes each KEGG file is split between when parsing',
+                        type=int, default=1)
+
+    args = parser.parse_args()
+
+    kegg_index = build_index(args.ko_file_loc, args.rn_file_loc, args.co_file_loc, args.pathway_file_loc,
+                             processes=args.processes)
+    kegg_index.save(args.output_dir)
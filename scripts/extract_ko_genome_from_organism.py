@@ -2,30 +2,51 @@
 
 import argparse
 
-from KEGG_parser.parsers import parse_organism
-from KEGG_parser.downloader import get_from_kegg_flat_file, get_kegg_link_from_api
+from AMON.kegg_cache import KEGGCache
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.organisms import get_organism_kos, write_organism_table
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-i', '--input', help="KEGG organism identifier or KEGG organism flat file",
-                        required=True)
-    parser.add_argument('-o', '--output', help="Output file of new line separated list of KOs from genome",
+    parser.add_argument('-i', '--input', help="KEGG organism identifiers or KEGG organism flat files", nargs='+')
+    parser.add_argument('--input_list', help="new line separated list of KEGG organism identifiers or KEGG organism "
+                                             "flat files, used with or in place of --input")
+    parser.add_argument('-o', '--output', help="Output file of new line separated list of KOs from genome, or a biom "
+                                               "table of the KOs of every organism if it ends with .biom",
                         required=True)
     parser.add_argument('--from_flat_file', help="Indicates that input is a flat flile to be parsered directly",
                         action='store_true', default=False)
+    parser.add_argument('--processes', help='number of processes flat files are read in', type=int, default=1)
+    parser.add_argument('--kegg_cache', help='Location of a local cache of KEGG records from the KEGG API, shared '
+                                             'between runs, the KOs of organisms are kept in it')
+    parser.add_argument('--kegg_release', help='KEGG release label records in the KEGG cache are stored under',
+                        default='current')
+    parser.add_argument('--kegg_max_requests', help='maximum number of requests to the KEGG API running at once',
+                        type=int, default=3)
+    parser.add_argument('--kegg_rate_limit', help='maximum number of requests to the KEGG API started per second',
+                        type=float, default=3)
 
     args = parser.parse_args()
 
-    kegg_org_file_loc = args.input
+    organisms = list(args.input) if args.input is not None else list()
+    if args.input_list is not None:
+        with open(args.input_list) as f:
+            organisms += [line.strip() for line in f if line.strip() != '']
+    if len(organisms) == 0:
+        raise ValueError('Must give organisms with --input or --input_list')
     output_file = args.output
+    if len(organisms) > 1 and not output_file.endswith('.biom'):
+        raise ValueError('The KOs of more than one organism must be written to a .biom file')
 
-    if args.from_flat_file:
-        org_records = get_from_kegg_flat_file(kegg_org_file_loc, parser=parse_organism)
-        # for org_record in org_records:
-        kos = [org_record['ORTHOLOGY'][0] for org_record in org_records if 'ORTHOLOGY' in org_record]
+    kegg_fetcher = KEGGFetcher(max_requests=args.kegg_max_requests, rate_limit=args.kegg_rate_limit)
+    if args.kegg_cache is not None:
+        kegg_cache = KEGGCache(args.kegg_cache, release=args.kegg_release, fetcher=kegg_fetcher.fetch_records)
     else:
-        link_dict = get_kegg_link_from_api('ko', args.input)
-        kos = link_dict.keys()
+        kegg_cache = None
+    organism_kos = get_organism_kos(organisms, args.from_flat_file, args.processes, kegg_cache, kegg_fetcher)
 
-    with open(output_file, 'w') as f:
-        f.write('%s\n' % '\n'.join(kos))
+    if output_file.endswith('.biom'):
+        write_organism_table(organism_kos, output_file)
+    else:
+        with open(output_file, 'w') as f:
+            f.write('%s\n' % '\n'.join(sorted(list(organism_kos.values())[0])))
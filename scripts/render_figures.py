@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+import argparse
+
+from AMON.figures import FIGURE_FORMATS, FigureRenderer, read_pathway_order, render_figures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--output_dirs', help='output directories of amon.py runs to make the figures of',
+                        nargs='+', required=True)
+    parser.add_argument('--figure_format', help='format of the venn diagram and enrichment heatmap',
+                        choices=FIGURE_FORMATS, default='png')
+    parser.add_argument('--figure_dpi', help='resolution of figures, by default 300 for the venn diagram and 500 for '
+                                             'the enrichment heatmap', type=int)
+    parser.add_argument('--max_pathways', help='only show this many pathways, those with the lowest adjusted '
+                                               'probabilities in any sample, in the enrichment heatmap', type=int)
+    parser.add_argument('--pathway_order', help='new line separated list of pathways to show in the enrichment '
+                                                'heatmap in this order instead of clustering them')
+    parser.add_argument('--processes', help='number of processes figures are made in', type=int, default=1)
+
+    args = parser.parse_args()
+
+    options = dict(figure_format=args.figure_format, dpi=args.figure_dpi, max_pathways=args.max_pathways,
+                   pathway_order=read_pathway_order(args.pathway_order) if args.pathway_order is not None else None)
+    if args.processes > 1:
+        renderer = FigureRenderer(args.processes, **options)
+        for output_dir in args.output_dirs:
+            renderer.submit(output_dir)
+        locations = renderer.wait()
+        renderer.close()
+    else:
+        locations = {output_dir: render_figures(output_dir, **options) for output_dir in args.output_dirs}
+    for output_dir_locations in locations.values():
+        for figure_loc in output_dir_locations.values():
+            print(figure_loc)
@@ -9,9 +9,12 @@ setup(
       version=__version__,
       setup_requires=['pytest-runner'],
       tests_require=['pytest'],
-      install_requires=['scipy', 'biom-format', 'pandas', 'matplotlib', 'statsmodels', 'numpy', 'aiohttp', 'seaborn',
-                        'matplotlib-venn', 'KEGG-parser'],
-      scripts=['scripts/amon.py', 'scripts/extract_ko_genome_from_organism.py'],
+      python_requires='>=3.7',
+      install_requires=['scipy', 'biom-format', 'pandas', 'matplotlib', 'statsmodels', 'numpy>=1.18', 'aiohttp',
+                        'seaborn', 'matplotlib-venn', 'KEGG-parser'],
+      scripts=['scripts/amon.py', 'scripts/extract_ko_genome_from_organism.py', 'scripts/build_kegg_index.py',
+               'scripts/amon_batch.py', 'scripts/amon_benchmark.py', 'scripts/amon_server.py',
+               'scripts/amon_client.py', 'scripts/render_figures.py'],
       packages=find_packages(),
       description="Annotation of Metabolite Origin via Networks: A tool for predicting putative metabolite origins for"
                   "microbes or between microbes and host with or without metabolomics data",
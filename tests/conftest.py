@@ -0,0 +1,102 @@
+import pytest
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from AMON.benchmark import format_field
+
+# a small self consistent KEGG release: ten reactions each making two compounds, five KOs linked to two reactions
+# each plus one KO without reactions, twenty compounds and two pathways large enough to be tested for enrichment
+KEGG_COS = ['C%05d' % i for i in range(1, 21)]
+KEGG_RNS = {'R%05d' % i: (['C%05d' % i, 'C00020'], ['C%05d' % (i + 1), 'C%05d' % (i + 10)]) for i in range(1, 11)}
+KEGG_KOS = {'K%05d' % k: ['R%05d' % (2 * k - 1), 'R%05d' % (2 * k)] for k in range(1, 6)}
+KEGG_KOS['K00006'] = []
+# KOs of the genes of two organisms
+KEGG_ORGANISMS = {'eco': {'b0001': 'K00001', 'b0002': 'K00002', 'b0003': 'K00001'},
+                  'hsa': {'10': 'K00004', '11': 'K00005'}}
+KEGG_PATHWAYS = {'ko00010': ('Fake glycolysis', KEGG_COS[:12] + ['G00001', 'D00001']),
+                 'ko00020': ('Fake citrate cycle', KEGG_COS[7:])}
+
+
+def make_kegg_flat_files(directory):
+    ko_entries = list()
+    for ko, rns in KEGG_KOS.items():
+        dblinks = ['COG: COG0001'] if len(rns) == 0 else ['RN: %s' % ' '.join(rns), 'COG: COG0001']
+        ko_entries.append('\n'.join((format_field('ENTRY', ['%s                      KO' % ko]),
+                                     format_field('NAME', ['fake%s' % ko]),
+                                     format_field('DBLINKS', dblinks))))
+    rn_entries = ['\n'.join((format_field('ENTRY', ['%s                      Reaction' % rn]),
+                             format_field('EQUATION', ['%s <=> %s' % (' + '.join(subs), ' + '.join(prods))])))
+                  for rn, (subs, prods) in KEGG_RNS.items()]
+    co_entries = list()
+    for co in KEGG_COS:
+        rns = [rn for rn, (subs, prods) in KEGG_RNS.items() if co in subs or co in prods]
+        pathways = ['%s  %s' % (pathway.replace('ko', 'map'), name) for pathway, (name, cos) in KEGG_PATHWAYS.items()
+                    if co in cos]
+        fields = [format_field('ENTRY', ['%s                      Compound' % co]),
+                  format_field('NAME', ['fake %s;' % co])]
+        if len(rns) > 0:
+            fields.append(format_field('REACTION', [' '.join(rns)]))
+        if len(pathways) > 0:
+            fields.append(format_field('PATHWAY', pathways))
+        co_entries.append('\n'.join(fields))
+    pathway_entries = ['\n'.join((format_field('ENTRY', ['%s                     Pathway' % pathway]),
+                                  format_field('NAME', [name]),
+                                  format_field('COMPOUND', ['%s  fake %s' % (co, co) for co in cos])))
+                       for pathway, (name, cos) in KEGG_PATHWAYS.items()]
+    file_locs = dict()
+    for kind, entries in (('ko', ko_entries), ('rn', rn_entries), ('co', co_entries), ('pathway', pathway_entries)):
+        file_loc = str(directory.join('%s.txt' % kind))
+        with open(file_loc, 'w') as f:
+            f.write(''.join('%s\n///\n' % entry for entry in entries))
+        file_locs[kind] = file_loc
+    return file_locs
+
+
+@pytest.fixture(scope='session')
+def kegg_flat_files(tmpdir_factory):
+    return make_kegg_flat_files(tmpdir_factory.mktemp('kegg'))
+
+
+class MockKEGGHandler(BaseHTTPRequestHandler):
+    """Answers KEGG REST get requests from the records in the local flat files and link requests for the KOs of the
+    organisms in KEGG_ORGANISMS"""
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(403)
+            self.end_headers()
+            return
+        if self.path.startswith('/link/ko/'):
+            organism = self.path[len('/link/ko/'):]
+            text = ''.join('%s:%s\tko:%s\n' % (organism, gene, ko)
+                           for gene, ko in KEGG_ORGANISMS.get(organism, dict()).items())
+        else:
+            ids = self.path[len('/get/'):].split('+') if self.path.startswith('/get/') else ()
+            text = ''.join('%s\n///\n' % self.server.raw_records[id_] for id_ in ids
+                           if id_ in self.server.raw_records)
+        self.send_response(200 if len(text) > 0 else 404)
+        self.end_headers()
+        self.wfile.write(text.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def kegg_server(kegg_flat_files):
+    """Local stand in for the KEGG REST API, failures sets how many requests are forbidden before answering"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockKEGGHandler)
+    server.raw_records = dict()
+    for file_loc in kegg_flat_files.values():
+        for raw_record in open(file_loc).read().split('///')[:-1]:
+            raw_record = raw_record.strip()
+            server.raw_records[raw_record.split()[1]] = raw_record
+    server.requests = list()
+    server.failures = 0
+    server.url = 'http://127.0.0.1:%s' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,78 @@
+import pytest
+import pandas as pd
+from os import path
+
+from AMON.batch import read_manifest, load_kegg_records, batch_main
+from AMON.predict_metabolites import main
+
+
+@pytest.fixture()
+def manifest_loc(tmpdir):
+    with open(str(tmpdir.join('microbes.txt')), 'w') as f:
+        f.write('K00001\nK00006\n')
+    with open(str(tmpdir.join('host.txt')), 'w') as f:
+        f.write('K00004\nK00005\n')
+    with open(str(tmpdir.join('detected.txt')), 'w') as f:
+        f.write('C00003\nC00099\n')
+    manifest = pd.DataFrame([['cohort1', 'microbes.txt', 'host.txt', 'detected.txt'],
+                             ['cohort2', 'host.txt', 'microbes.txt', None]],
+                            columns=['name', 'gene_set', 'other_gene_set', 'detected_compounds'])
+    manifest_loc = str(tmpdir.join('manifest.tsv'))
+    manifest.to_csv(manifest_loc, sep='\t', index=False)
+    return manifest_loc
+
+
+def test_read_manifest(manifest_loc):
+    cohorts = read_manifest(manifest_loc)
+    assert [cohort['name'] for cohort in cohorts] == ['cohort1', 'cohort2']
+    assert cohorts[0]['gene_set'] == path.join(path.dirname(manifest_loc), 'microbes.txt')
+    assert cohorts[1]['detected_compounds'] is None
+
+
+def test_load_kegg_records(manifest_loc, kegg_flat_files):
+    kegg_records = load_kegg_records(read_manifest(manifest_loc), ko_file_loc=kegg_flat_files['ko'],
+                                     rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+                                     pathway_file_loc=kegg_flat_files['pathway'])
+    assert set(kegg_records.record_dicts['ko']) == {'K00001', 'K00004', 'K00005', 'K00006'}
+    assert set(kegg_records.record_dicts['rn']) == {'R00001', 'R00002', 'R00007', 'R00008', 'R00009', 'R00010'}
+    assert 'C00003' in kegg_records.record_dicts['co']
+    assert set(kegg_records.get_record_dict('pathway', ['map00010', 'map00099'])) == {'ko00010'}
+    kegg_records = load_kegg_records(read_manifest(manifest_loc), ko_file_loc=kegg_flat_files['ko'],
+                                     rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+                                     pathway_file_loc=kegg_flat_files['pathway'], background_kos={'K00002'})
+    assert 'K00002' in kegg_records.record_dicts['ko']
+    assert {'R00003', 'R00004'} <= set(kegg_records.record_dicts['rn'])
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_batch_main(manifest_loc, kegg_flat_files, tmpdir, processes):
+    output_dir = str(tmpdir.join('batch_output'))
+    names = batch_main(manifest_loc, output_dir, processes=processes, ko_file_loc=kegg_flat_files['ko'],
+                       rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+                       pathway_file_loc=kegg_flat_files['pathway'])
+    assert names == ['cohort1', 'cohort2']
+    single_dir = str(tmpdir.join('single_output'))
+    cohort = read_manifest(manifest_loc)[0]
+    main(cohort['gene_set'], single_dir, cohort['other_gene_set'], cohort['detected_compounds'],
+         ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+         pathway_file_loc=kegg_flat_files['pathway'])
+    assert open(path.join(output_dir, 'cohort1', 'origin_table.tsv')).read() == \
+        open(path.join(single_dir, 'origin_table.tsv')).read()
+    # figures rendered after a cohort's log was written are added to it
+    for cohort in ('cohort1', 'cohort2'):
+        assert 'Enrichment clustermap location' in open(path.join(output_dir, cohort, 'AMON_log.txt')).read()
+    assert path.isfile(path.join(output_dir, 'cohort2', 'origin_table.tsv'))
+
+
+def test_batch_main_stage_cache(manifest_loc, kegg_flat_files, tmpdir):
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'],
+                  stage_cache=str(tmpdir.join('stage_cache')), make_plots=False)
+    batch_main(manifest_loc, str(tmpdir.join('first')), **kwargs)
+    # the second batch finds every stage of the first in the stage cache, keyed by the records it loaded
+    batch_main(manifest_loc, str(tmpdir.join('second')), **kwargs)
+    for cohort in ('cohort1', 'cohort2'):
+        assert open(path.join(str(tmpdir.join('first')), cohort, 'origin_table.tsv')).read() == \
+            open(path.join(str(tmpdir.join('second')), cohort, 'origin_table.tsv')).read()
+        with open(path.join(str(tmpdir.join('second')), cohort, 'AMON_log.txt')) as f:
+            assert 'Stages reused from stage cache: sample KOs, sample compounds, compound pathways' in f.read()
@@ -0,0 +1,63 @@
+import pytest
+import pandas as pd
+from os import path
+
+from KEGG_parser.downloader import get_from_kegg_flat_file
+from KEGG_parser.parsers import parse_ko, parse_rn, parse_co
+
+from AMON.benchmark import make_synthetic_kegg, write_synthetic_kegg, write_synthetic_gene_sets, run_benchmarks, \
+    compare_benchmarks
+from AMON.predict_metabolites import read_in_ids
+
+
+def test_make_synthetic_kegg():
+    ko_rns, rn_equations, pathway_cos = make_synthetic_kegg(100, seed=1)
+    assert len(ko_rns) == 100
+    assert len(rn_equations) == 200
+    assert len(pathway_cos) == 4
+    assert all(len(cos) >= 15 for cos in pathway_cos.values())
+    assert make_synthetic_kegg(100, seed=1) == (ko_rns, rn_equations, pathway_cos)
+
+
+def test_write_synthetic_kegg(tmpdir):
+    file_locs = write_synthetic_kegg(str(tmpdir.join('kegg')), 50)
+    ko_records = {record['ENTRY']: record for record in get_from_kegg_flat_file(file_locs['ko'], parser=parse_ko)}
+    rn_records = {record['ENTRY']: record for record in get_from_kegg_flat_file(file_locs['rn'], parser=parse_rn)}
+    co_records = {record['ENTRY']: record for record in get_from_kegg_flat_file(file_locs['co'], parser=parse_co)}
+    assert len(ko_records) == 50
+    # every linked reaction and product has a record
+    for record in ko_records.values():
+        assert set(record['DBLINKS'].get('RN', ())) <= set(rn_records)
+    for record in rn_records.values():
+        assert set(record['EQUATION'][1]) <= set(co_records)
+
+
+@pytest.mark.parametrize('ending', ['tsv', 'biom'])
+def test_write_synthetic_gene_sets(tmpdir, ending):
+    input_loc = write_synthetic_gene_sets(str(tmpdir.join('gene_sets.%s' % ending)), 25, num_kos=40, chunksize=10)
+    sample_kos = read_in_ids(input_loc, keep_separated=True)
+    assert len(sample_kos) == 25
+    assert all(kos <= {'K%05d' % i for i in range(1, 41)} for kos in sample_kos.values())
+    with pytest.raises(ValueError):
+        write_synthetic_gene_sets(str(tmpdir.join('gene_sets.txt')), 25)
+
+
+def test_run_benchmarks(tmpdir):
+    results = run_benchmarks([3, 6], str(tmpdir), num_kos=100, stages=('read_in_ids', 'calculate_enrichment_batch',
+                                                                          'main'))
+    assert list(results['samples']) == [3, 3, 3, 6, 6, 6]
+    assert list(results['stage'][:3]) == ['read_in_ids', 'calculate_enrichment_batch', 'main']
+    assert (results['seconds'] > 0).all()
+    assert (results['peak memory MB'] > 0).all()
+    assert path.isfile(path.join(str(tmpdir), 'main_3_0', 'origin_table.tsv'))
+    with pytest.raises(ValueError):
+        run_benchmarks([3], str(tmpdir), num_kos=100, stages=('fake_stage',))
+
+
+def test_compare_benchmarks():
+    baseline = pd.DataFrame([[10, 100, 'main', 1., 10.], [10, 100, 'read_in_ids', 1., 10.]],
+                            columns=['samples', 'kos', 'stage', 'seconds', 'peak memory MB'])
+    results = baseline.copy()
+    results.loc[0, 'seconds'] = 2.
+    regressions = compare_benchmarks(results, baseline, tolerance=1.5)
+    assert list(regressions['stage']) == ['main']
@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+from os import path, listdir
+from scipy import sparse
+
+from AMON.benchmark import write_synthetic_kegg, write_synthetic_gene_sets
+from AMON import chunked
+from AMON.chunked import iter_biom_chunks, iter_table_chunks, save_chunk, iter_origin_blocks
+from AMON.predict_metabolites import main, read_in_id_matrix
+from AMON.sparse_engine import IncidenceMatrix
+
+
+@pytest.fixture(scope='module')
+def synthetic_kegg(tmpdir_factory):
+    return write_synthetic_kegg(str(tmpdir_factory.mktemp('synthetic_kegg')), num_kos=200, seed=1)
+
+
+@pytest.mark.parametrize('input_format', ['biom', 'tsv'])
+def test_iter_chunks(tmpdir, input_format):
+    gene_sets_loc = write_synthetic_gene_sets(str(tmpdir.join('gene_sets.%s' % input_format)), 11, 50, .2, seed=2)
+    if input_format == 'biom':
+        chunks = list(iter_biom_chunks(gene_sets_loc, 4))
+    else:
+        chunks = list(iter_table_chunks(gene_sets_loc, 4, '\t'))
+    assert [chunk.shape[0] for chunk in chunks] == [4, 4, 3]
+    id_matrix = read_in_id_matrix(gene_sets_loc)
+    for i, chunk in enumerate(chunks):
+        assert chunk.row_ids == list(id_matrix.row_ids[i * 4:(i + 1) * 4])
+        assert chunk.column_ids == list(id_matrix.column_ids)
+        assert (chunk.matrix != id_matrix.matrix[i * 4:(i + 1) * 4]).nnz == 0
+
+
+def test_iter_origin_blocks(tmpdir, monkeypatch):
+    rng = np.random.RandomState(4)
+    chunks = [sparse.random(num_samples, 30, .2, format='csr', random_state=rng) > 0 for num_samples in (4, 3)]
+    for chunk_number, matrix in enumerate(chunks):
+        save_chunk(str(tmpdir), chunk_number, IncidenceMatrix(matrix, range(matrix.shape[0]), range(30)))
+    keep = [np.array([True, False, True, True]), np.array([True, True, False])]
+    compound_rows = np.array([0, 2, 3, 7, 8, 15, 29])
+    detected = np.arange(len(compound_rows)) % 2 == 0
+    expected = np.hstack([chunks[0].toarray().T[:, keep[0]], chunks[1].toarray().T[:, keep[1]]])[compound_rows]
+    # blocks of three rows of six columns
+    monkeypatch.setattr(chunked, 'ORIGIN_BLOCK_CELLS', 18)
+    blocks = list(iter_origin_blocks(str(tmpdir), [range(4), range(3)], keep, compound_rows, detected))
+    assert [rows.tolist() for rows, _ in blocks] == [[0, 2, 3], [7, 8, 15], [29]]
+    assert np.array_equal(np.vstack([block for _, block in blocks]), np.hstack([expected, detected[:, np.newaxis]]))
+
+
+@pytest.mark.parametrize('input_format', ['biom', 'tsv'])
+def test_main_chunked(synthetic_kegg, tmpdir, input_format):
+    gene_sets_loc = write_synthetic_gene_sets(str(tmpdir.join('gene_sets.%s' % input_format)), 17, 200, .1, seed=2)
+    compounds_loc = str(tmpdir.join('compounds.txt'))
+    with open(compounds_loc, 'w') as f:
+        f.write('\n'.join('C%05d' % i for i in range(1, 400, 3)))
+    options = dict(compounds_loc=compounds_loc, keep_separated=True, detected_only=True, unique_only=True,
+                   unique_max_samples=3, ko_file_loc=synthetic_kegg['ko'], rn_file_loc=synthetic_kegg['rn'],
+                   co_file_loc=synthetic_kegg['co'], pathway_file_loc=synthetic_kegg['pathway'], make_plots=False)
+    whole_dir = str(tmpdir.join('whole_output'))
+    main(gene_sets_loc, whole_dir, **options)
+    chunked_dir = str(tmpdir.join('chunked_output'))
+    main(gene_sets_loc, chunked_dir, sample_chunksize=5, **options)
+    # chunked runs make no KEGG mapper input
+    outputs = [output for output in listdir(whole_dir) if output.endswith('.tsv') and output != 'kegg_mapper.tsv']
+    assert 'origin_table.tsv' in outputs
+    assert len(outputs) > 2
+    assert sorted(outputs) == sorted(output for output in listdir(chunked_dir) if output.endswith('.tsv'))
+    for output in outputs:
+        assert open(path.join(whole_dir, output)).read() == open(path.join(chunked_dir, output)).read()
+    # the chunks are removed once the outputs are written
+    assert all(not path.isdir(path.join(chunked_dir, output)) for output in listdir(chunked_dir))
+
+
+def test_main_chunked_biom_origin_table(synthetic_kegg, tmpdir):
+    from biom import load_table
+    gene_sets_loc = write_synthetic_gene_sets(str(tmpdir.join('gene_sets.biom')), 9, 200, .1, seed=3)
+    options = dict(keep_separated=True, ko_file_loc=synthetic_kegg['ko'], rn_file_loc=synthetic_kegg['rn'],
+                   co_file_loc=synthetic_kegg['co'], pathway_file_loc=synthetic_kegg['pathway'], make_plots=False,
+                   origin_table_format='biom')
+    main(gene_sets_loc, str(tmpdir.join('whole_output')), **options)
+    main(gene_sets_loc, str(tmpdir.join('chunked_output')), sample_chunksize=2, **options)
+    whole_table = load_table(str(tmpdir.join('whole_output', 'origin_table.biom')))
+    chunked_table = load_table(str(tmpdir.join('chunked_output', 'origin_table.biom')))
+    assert whole_table == chunked_table
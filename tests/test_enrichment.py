@@ -0,0 +1,138 @@
+import pytest
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+
+from AMON.enrichment import fdr_bh_rows, make_pathway_co_matrix, calculate_enrichment_batch, split_enrichment_table, \
+    make_unique_masks, PermutationNull, PERMUTATION_COLUMNS
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.predict_metabolites import p_adjust, calculate_enrichment, predict
+from AMON.sparse_engine import IncidenceMatrix
+
+
+def test_fdr_bh_rows():
+    pvalues = np.array([[.001, .05, .5],
+                        [.04, .01, .03],
+                        [.5, .5, .001]])
+    adjusted = fdr_bh_rows(pvalues)
+    for row, adjusted_row in zip(pvalues, adjusted):
+        assert_allclose(adjusted_row, p_adjust(row))
+
+
+@pytest.fixture()
+def pathway_co_dict():
+    return {'one fake pathway': ('C00002', 'C00004', 'C00006'),
+            'two fake pathway': ('C00001', 'C00002', 'C00005'),
+            'three fake pathway': ('C00001', 'C00004', 'C00006', 'C00007', 'C00008')}
+
+
+@pytest.fixture()
+def sample_cos():
+    return {'Sample1': {'C00002', 'C00003', 'C00005'},
+            'Sample2': {'C00001', 'C00004', 'C00006', 'C00007'},
+            'Sample3': {'C00009'}}
+
+
+def test_calculate_enrichment_batch(sample_cos, pathway_co_dict):
+    enrichment_table = calculate_enrichment_batch(IncidenceMatrix.from_dict_of_lists(sample_cos),
+                                                  make_pathway_co_matrix(pathway_co_dict), min_pathway_size=0)
+    assert enrichment_table.shape == (9, 6)
+    for sample, cos in sample_cos.items():
+        expected = calculate_enrichment(cos, pathway_co_dict, min_pathway_size=0)
+        sample_table = enrichment_table.loc[enrichment_table['sample'] == sample].set_index('pathway')
+        sample_table = sample_table.loc[expected.index]
+        assert tuple(sample_table['overlap']) == tuple(expected['overlap'])
+        assert tuple(sample_table['pathway size']) == tuple(expected['pathway size'])
+        assert_allclose(sample_table['probability'], expected['probability'])
+        assert_allclose(sample_table['adjusted probability'], expected['adjusted probability'])
+
+
+def test_calculate_enrichment_batch_min_pathway_size(sample_cos, pathway_co_dict):
+    enrichment_table = calculate_enrichment_batch(IncidenceMatrix.from_dict_of_lists(sample_cos),
+                                                  make_pathway_co_matrix(pathway_co_dict), min_pathway_size=3)
+    assert set(enrichment_table['pathway']) == {'three fake pathway'}
+
+
+def test_split_enrichment_table(sample_cos, pathway_co_dict):
+    enrichment_table = calculate_enrichment_batch(IncidenceMatrix.from_dict_of_lists(sample_cos),
+                                                  make_pathway_co_matrix(pathway_co_dict), min_pathway_size=0)
+    pathway_enrichment_dfs = split_enrichment_table(enrichment_table)
+    for sample, cos in sample_cos.items():
+        expected = calculate_enrichment(cos, pathway_co_dict, min_pathway_size=0)
+        if expected is None:
+            assert sample not in pathway_enrichment_dfs
+        else:
+            pd.testing.assert_frame_equal(pathway_enrichment_dfs[sample], expected, check_dtype=False)
+
+
+@pytest.fixture()
+def element_cos():
+    return IncidenceMatrix.from_dict_of_lists({'K1': ('C00001', 'C00002'), 'K2': ('C00004', 'C00006'),
+                                               'K3': ('C00007', 'C00008'), 'K4': ('C00003',), 'K5': ('C00009',)})
+
+
+def test_permutation_null(element_cos, sample_cos, pathway_co_dict):
+    sample_matrix = IncidenceMatrix.from_dict_of_lists(sample_cos)
+    pathway_cos = make_pathway_co_matrix(pathway_co_dict)
+    tables = [calculate_enrichment_batch(sample_matrix, pathway_cos, min_pathway_size=0,
+                                         null=PermutationNull(element_cos, list(sample_cos), [2, 2, 1],
+                                                              permutations=300, seed=1, processes=processes))
+              for processes in (1, 2)]
+    assert list(tables[0].columns[-2:]) == PERMUTATION_COLUMNS
+    # seeds are spawned per batch of random sets so the number of processes does not change the results
+    pd.testing.assert_frame_equal(tables[0], tables[1])
+    probabilities = tables[0]['permutation probability']
+    assert np.all((probabilities > 0) & (probabilities <= 1))
+    assert np.all(tables[0]['adjusted permutation probability'] >= probabilities)
+    # no random set overlaps a pathway less than not at all
+    assert np.all(probabilities[tables[0]['overlap'] == 0] == 1)
+
+
+def test_permutation_null_masks(element_cos, sample_cos):
+    pathway_cos = make_pathway_co_matrix({'pathway': ('C00001', 'C00002')})
+    overlaps = np.array([[1], [1], [1]])
+    null = PermutationNull(element_cos, list(sample_cos), [5, 5, 5], permutations=50)
+    assert_allclose(null.probabilities(list(sample_cos), pathway_cos, overlaps), 1)
+    null = PermutationNull(element_cos, list(sample_cos), [5, 5, 5], np.zeros(element_cos.shape[1], dtype=bool),
+                           permutations=50)
+    assert_allclose(null.probabilities(list(sample_cos), pathway_cos, overlaps), 1 / 51)
+
+
+def test_make_unique_masks(sample_cos):
+    sample_cos['Sample3'] = {'C00001', 'C00009'}
+    masks = make_unique_masks(IncidenceMatrix.from_dict_of_lists(sample_cos), ['C00001', 'C00002', 'C00010'])
+    assert masks.tolist() == [[False, True, True], [False, False, True], [False, False, True]]
+    masks = make_unique_masks(IncidenceMatrix.from_dict_of_lists(sample_cos), ['C00001', 'C00002', 'C00010'], 2)
+    assert masks.tolist() == [[False, True, True], [True, True, True], [True, True, True]]
+
+
+@pytest.mark.parametrize('null_model', ['ko', 'reaction'])
+def test_predict_permutations(kegg_flat_files, null_model):
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    kos = {'microbiome': {'K00001', 'K00002', 'K00003'}, 'host': {'K00003', 'K00004'}}
+    results = predict(kos, permutations=100, null_model=null_model, null_background=['K00005', 'K00006'], **kwargs)
+    for sample_table in results.pathway_enrichment_dfs.values():
+        assert list(sample_table.columns[-2:]) == PERMUTATION_COLUMNS
+        assert np.all((sample_table['permutation probability'] > 0) &
+                      (sample_table['permutation probability'] <= 1))
+    assert 'permutation null model' in [stage['name'] for stage in results.stages]
+    assert results.logger['Permutation null model'] == '100 random %s sets, seed 0' % null_model
+    repeated = predict(kos, permutations=100, null_model=null_model, null_background=['K00005', 'K00006'], **kwargs)
+    for sample, sample_table in results.pathway_enrichment_dfs.items():
+        pd.testing.assert_frame_equal(sample_table, repeated.pathway_enrichment_dfs[sample])
+    with pytest.raises(ValueError):
+        predict(kos, permutations=100, null_model='compound', **kwargs)
+
+
+def test_predict_permutations_kegg_api(kegg_flat_files, kegg_server):
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    kos = {'microbiome': {'K00001', 'K00002', 'K00003'}, 'host': {'K00003', 'K00004'}}
+    # background KOs the samples' records do not reach are fetched for the null like they are read from flat files
+    results = predict(kos, permutations=100, null_background=['K00005', 'K00006'],
+                      kegg_fetcher=KEGGFetcher(kegg_server.url, rate_limit=None))
+    expected = predict(kos, permutations=100, null_background=['K00005', 'K00006'], **kwargs)
+    assert results.pathway_enrichment_dfs.keys() == expected.pathway_enrichment_dfs.keys()
+    for sample, sample_table in expected.pathway_enrichment_dfs.items():
+        pd.testing.assert_frame_equal(results.pathway_enrichment_dfs[sample], sample_table)
@@ -0,0 +1,83 @@
+import pytest
+import json
+from os import path
+
+import pandas as pd
+
+from AMON.figures import FIGURE_INPUTS, FigureRenderer, make_enrichment_clustermap, render_figures
+from AMON.predict_metabolites import main
+
+
+@pytest.fixture()
+def deferred_run(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00002\nK00003\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00003\nK00004\nK00005\n')
+    compounds_loc = str(tmpdir.join('compounds.txt'))
+    with open(compounds_loc, 'w') as f:
+        f.write('C00002\nC00013\n')
+    output_dir = str(tmpdir.join('output'))
+    main(kos_loc, output_dir, other_kos_loc, compounds_loc, ko_file_loc=kegg_flat_files['ko'],
+         rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+         pathway_file_loc=kegg_flat_files['pathway'], defer_plots=True)
+    return output_dir
+
+
+def test_defer_plots(deferred_run):
+    assert not path.isfile(path.join(deferred_run, 'venn.png'))
+    assert not path.isfile(path.join(deferred_run, 'enrichment_heatmap.png'))
+    figure_inputs = json.load(open(path.join(deferred_run, FIGURE_INPUTS)))
+    assert set(figure_inputs) == {'venn', 'clustermap'}
+    assert figure_inputs['venn']['measured_compounds'] == ['C00002', 'C00013']
+    assert list(figure_inputs['venn']['sample_compounds']) == ['gene_set_1', 'gene_set_2']
+    assert [table for _, table in figure_inputs['clustermap']['enrichment_tables']] == \
+        ['gene_set_1_compound_pathway_enrichment.tsv', 'gene_set_2_compound_pathway_enrichment.tsv']
+    assert 'Figure inputs location' in open(path.join(deferred_run, 'AMON_log.txt')).read()
+
+
+def test_render_figures(deferred_run):
+    locations = render_figures(deferred_run, figure_format='svg', dpi=72)
+    assert locations == {'venn': path.join(deferred_run, 'venn.svg'),
+                         'clustermap': path.join(deferred_run, 'enrichment_heatmap.svg')}
+    assert all(path.isfile(location) for location in locations.values())
+    with pytest.raises(ValueError):
+        render_figures(deferred_run, figure_format='gif')
+
+
+def test_figure_renderer(deferred_run, tmpdir):
+    with FigureRenderer(2, dpi=72) as renderer:
+        renderer.submit(deferred_run)
+        locations = renderer.wait()
+    assert set(locations[deferred_run]) == {'venn', 'clustermap'}
+    assert all(path.isfile(location) for location in locations[deferred_run].values())
+    with pytest.raises(ValueError):
+        FigureRenderer().submit(str(tmpdir))
+
+
+def test_make_enrichment_clustermap_pathways(tmpdir):
+    pathways = ['pathway %s' % i for i in range(6)]
+    enrichment_dfs = {sample: pd.DataFrame({'p-value': [.001 * (i + 1) * (j + 1) for i in range(6)]}, index=pathways)
+                      for j, sample in enumerate(('Sample1', 'Sample2'))}
+    make_enrichment_clustermap(enrichment_dfs, 'p-value', str(tmpdir.join('subsampled.png')), dpi=72, max_pathways=2)
+    make_enrichment_clustermap(enrichment_dfs, 'p-value', str(tmpdir.join('ordered.png')), dpi=72,
+                               pathway_order=pathways[::-1])
+    # a single pathway is plotted without clustering
+    make_enrichment_clustermap(enrichment_dfs, 'p-value', str(tmpdir.join('single.png')), dpi=72, max_pathways=1)
+    assert all(path.isfile(str(tmpdir.join(name))) for name in ('subsampled.png', 'ordered.png', 'single.png'))
+    with pytest.raises(ValueError):
+        make_enrichment_clustermap(enrichment_dfs, 'p-value', str(tmpdir.join('empty.png')), min_p=.0001)
+
+
+def test_failed_figure_keeps_log(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00002\nK00003\n')
+    output_dir = str(tmpdir.join('output'))
+    # no pathway in the order is enriched so the clustermap fails, the run is still logged
+    with pytest.raises(ValueError):
+        main(kos_loc, output_dir, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+             co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], pathway_order=['none'])
+    assert 'Origin table location' in open(path.join(output_dir, 'AMON_log.txt')).read()
@@ -0,0 +1,122 @@
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import path
+
+from KEGG_parser.downloader import get_kegg_record_dict
+
+from AMON.kegg_cache import KEGGCache
+from AMON.kegg_index import RECORD_PARSERS
+from AMON.predict_metabolites import main
+
+
+def fetch_from_flat_files(flat_files, ids, kind):
+    """Local stand in for the KEGG API"""
+    return get_kegg_record_dict(set(ids), RECORD_PARSERS[kind], flat_files[kind])
+
+
+class CountingFetcher(object):
+    def __init__(self, flat_files):
+        self.flat_files = flat_files
+        self.requested = list()
+
+    def __call__(self, ids, kind):
+        self.requested.append((kind, set(ids)))
+        return fetch_from_flat_files(self.flat_files, ids, kind)
+
+
+def count_records(cache_loc):
+    with sqlite3.connect(cache_loc) as connection:
+        return connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+
+def test_kegg_cache_hits_and_misses(kegg_flat_files, tmpdir):
+    fetcher = CountingFetcher(kegg_flat_files)
+    cache_loc = str(tmpdir.join('kegg_cache.sqlite'))
+    kegg_cache = KEGGCache(cache_loc, fetcher=fetcher)
+    records = kegg_cache.get_record_dict('ko', ['K00001', 'K00002'])
+    assert records['K00001']['DBLINKS']['RN'] == ['R00001', 'R00002']
+    assert kegg_cache.misses['ko'] == 2
+    # a new cache object on the same file reuses the stored records
+    kegg_cache = KEGGCache(cache_loc, fetcher=fetcher)
+    assert kegg_cache.get_record_dict('ko', ['K00001', 'K00003']).keys() == {'K00001', 'K00003'}
+    assert kegg_cache.hits['ko'] == 1
+    assert kegg_cache.misses['ko'] == 1
+    assert fetcher.requested == [('ko', {'K00001', 'K00002'}), ('ko', {'K00003'})]
+
+
+def test_kegg_cache_not_found(kegg_flat_files, tmpdir):
+    fetcher = CountingFetcher(kegg_flat_files)
+    cache_loc = str(tmpdir.join('kegg_cache.sqlite'))
+    assert KEGGCache(cache_loc, fetcher=fetcher).get_record_dict('ko', ['K00001', 'K99999']).keys() == {'K00001'}
+    # ids KEGG has no record for are cached and not fetched again
+    kegg_cache = KEGGCache(cache_loc, fetcher=fetcher)
+    assert kegg_cache.get_record_dict('ko', ['K00001', 'K99999']).keys() == {'K00001'}
+    assert kegg_cache.hits['ko'] == 2
+    assert fetcher.requested == [('ko', {'K00001', 'K99999'})]
+    # and expire like records
+    kegg_cache = KEGGCache(cache_loc, max_age=-1, fetcher=fetcher)
+    assert kegg_cache.get_record_dict('ko', ['K99999']) == dict()
+    assert fetcher.requested[-1] == ('ko', {'K99999'})
+    assert count_records(cache_loc) == 0
+
+
+def test_kegg_cache_release(kegg_flat_files, tmpdir):
+    fetcher = CountingFetcher(kegg_flat_files)
+    cache_loc = str(tmpdir.join('kegg_cache.sqlite'))
+    KEGGCache(cache_loc, release='100.0', fetcher=fetcher).get_record_dict('rn', ['R00001'])
+    kegg_cache = KEGGCache(cache_loc, release='101.0', fetcher=fetcher)
+    kegg_cache.get_record_dict('rn', ['R00001'])
+    assert kegg_cache.misses['rn'] == 1
+    assert count_records(cache_loc) == 2
+
+
+def test_kegg_cache_eviction(kegg_flat_files, tmpdir):
+    fetcher = CountingFetcher(kegg_flat_files)
+    cache_loc = str(tmpdir.join('kegg_cache.sqlite'))
+    kegg_cache = KEGGCache(cache_loc, max_records=2, fetcher=fetcher)
+    kegg_cache.get_record_dict('co', ['C00001'])
+    kegg_cache.get_record_dict('co', ['C00002', 'C00003'])
+    assert count_records(cache_loc) == 2
+    # least recently used record was evicted
+    kegg_cache.get_record_dict('co', ['C00002', 'C00003'])
+    assert kegg_cache.hits['co'] == 2
+    # records past the maximum age are fetched again and removed
+    kegg_cache = KEGGCache(cache_loc, max_age=-1, fetcher=fetcher)
+    kegg_cache.get_record_dict('co', ['C00002'])
+    assert kegg_cache.misses['co'] == 1
+    assert count_records(cache_loc) == 0
+
+
+def get_with_new_cache(cache_loc, flat_files, kind, ids):
+    kegg_cache = KEGGCache(cache_loc, fetcher=partial(fetch_from_flat_files, flat_files))
+    return set(kegg_cache.get_record_dict(kind, ids))
+
+
+def test_kegg_cache_concurrent(kegg_flat_files, tmpdir):
+    cache_loc = str(tmpdir.join('kegg_cache.sqlite'))
+    KEGGCache(cache_loc)
+    cos = ['C%05d' % i for i in range(1, 21)]
+    id_sets = [cos[i:i + 8] for i in range(0, 16, 2)]
+    with ProcessPoolExecutor(4) as executor:
+        results = list(executor.map(partial(get_with_new_cache, cache_loc, kegg_flat_files, 'co'), id_sets))
+    assert results == [set(ids) for ids in id_sets]
+    assert count_records(cache_loc) == 20
+
+
+def test_main_with_kegg_cache(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    cache_loc = str(tmpdir.join('kegg_cache.sqlite'))
+    fetcher = CountingFetcher(kegg_flat_files)
+    main(kos_loc, str(tmpdir.join('output1')), other_kos_loc, kegg_cache=KEGGCache(cache_loc, fetcher=fetcher))
+    assert len(fetcher.requested) == 4
+    main(kos_loc, str(tmpdir.join('output2')), other_kos_loc, kegg_cache=KEGGCache(cache_loc, fetcher=fetcher))
+    assert len(fetcher.requested) == 4
+    log = open(path.join(str(tmpdir.join('output2')), 'AMON_log.txt')).read()
+    assert 'KEGG cache ko hits: 4' in log
+    assert 'KEGG cache ko misses: 0' in log
@@ -0,0 +1,64 @@
+import pytest
+import time
+from os import path
+
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.predict_metabolites import main
+
+
+def test_fetch_records(kegg_server):
+    fetcher = KEGGFetcher(kegg_server.url, rate_limit=None)
+    cos = ['C%05d' % i for i in range(1, 21)]
+    records = fetcher.fetch_records(cos + ['C99999'], 'co')
+    assert set(records) == set(cos)
+    assert records['C00001']['REACTION'] == ['R00001']
+    # ids are batched into gets of ten
+    assert len(kegg_server.requests) == 3
+
+
+def test_fetch_records_not_found(kegg_server):
+    assert KEGGFetcher(kegg_server.url, rate_limit=None).fetch_records(['K99999'], 'ko') == dict()
+
+
+def test_fetch_records_retry(kegg_server):
+    kegg_server.failures = 2
+    fetcher = KEGGFetcher(kegg_server.url, rate_limit=None, backoff=.001)
+    assert set(fetcher.fetch_records(['K00001'], 'ko')) == {'K00001'}
+    assert len(kegg_server.requests) == 3
+    kegg_server.failures = 3
+    fetcher = KEGGFetcher(kegg_server.url, rate_limit=None, attempts=3, backoff=.001)
+    with pytest.raises(ValueError):
+        fetcher.fetch_records(['K00001'], 'ko')
+
+
+def test_fetch_records_rate_limit(kegg_server):
+    fetcher = KEGGFetcher(kegg_server.url, batch_size=1, max_requests=5, rate_limit=20)
+    start = time.time()
+    fetcher.fetch_records(['R%05d' % i for i in range(1, 6)], 'rn')
+    assert time.time() - start >= .2
+
+
+def test_fetch_all(kegg_server):
+    fetcher = KEGGFetcher(kegg_server.url, batch_size=1, rate_limit=None)
+    kegg_records = fetcher.fetch_all(['K00001', 'K00006'], extra_cos=['C00020'])
+    assert set(kegg_records.record_dicts['ko']) == {'K00001', 'K00006'}
+    assert set(kegg_records.record_dicts['rn']) == {'R00001', 'R00002'}
+    assert set(kegg_records.record_dicts['co']) == {'C00002', 'C00003', 'C00011', 'C00012', 'C00020'}
+    assert set(kegg_records.record_dicts['pathway']) == {'ko00010', 'ko00020'}
+    # every id is only requested once
+    assert len(kegg_server.requests) == 11
+
+
+def test_main_with_kegg_fetcher(kegg_server, kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    files_dir = str(tmpdir.join('files_output'))
+    main(kos_loc, files_dir, other_kos_loc, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    api_dir = str(tmpdir.join('api_output'))
+    main(kos_loc, api_dir, other_kos_loc, kegg_fetcher=KEGGFetcher(kegg_server.url, rate_limit=None))
+    assert open(path.join(files_dir, 'origin_table.tsv')).read() == open(path.join(api_dir, 'origin_table.tsv')).read()
@@ -0,0 +1,65 @@
+import pytest
+from os import path
+
+from KEGG_parser.downloader import get_from_kegg_flat_file, get_kegg_record_dict
+from KEGG_parser.parsers import parse_ko, parse_rn, parse_co, parse_pathway
+
+from AMON.kegg_flat_file import find_record_ranges, iter_raw_records, get_entry_id, read_flat_file_range, \
+    read_flat_file
+from AMON.benchmark import write_synthetic_kegg
+
+
+@pytest.fixture(scope='module')
+def synthetic_flat_files(tmpdir_factory):
+    return write_synthetic_kegg(str(tmpdir_factory.mktemp('synthetic_kegg')), 200)
+
+
+def test_iter_raw_records(kegg_flat_files):
+    raw_records = list(iter_raw_records(kegg_flat_files['co'], block_size=7))
+    assert len(raw_records) == 20
+    assert raw_records == [raw_record.encode() for raw_record in open(kegg_flat_files['co']).read().split('///')[:-1]]
+
+
+def test_get_entry_id():
+    assert get_entry_id(b'\nENTRY       C00001                      Compound\nNAME        fake;') == 'C00001'
+    assert get_entry_id(b'\n') is None
+
+
+@pytest.mark.parametrize('num_ranges', [1, 2, 3, 7, 50])
+def test_find_record_ranges(synthetic_flat_files, num_ranges):
+    file_loc = synthetic_flat_files['rn']
+    ranges = find_record_ranges(file_loc, num_ranges, block_size=16)
+    assert len(ranges) <= num_ranges
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == path.getsize(file_loc)
+    assert all(end == start for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]))
+    raw_records = [raw_record for start, end in ranges for raw_record in iter_raw_records(file_loc, start, end)]
+    assert raw_records == list(iter_raw_records(file_loc))
+
+
+@pytest.mark.parametrize('kind,parser', [('ko', parse_ko), ('rn', parse_rn), ('co', parse_co),
+                                         ('pathway', parse_pathway)])
+def test_read_flat_file_same_as_kegg_parser(synthetic_flat_files, kind, parser):
+    file_loc = synthetic_flat_files[kind]
+    records = get_from_kegg_flat_file(file_loc, parser=parser)
+    assert read_flat_file(file_loc, parser) == records
+    ids = [record['ENTRY'] for record in records[::3]] + ['X99999']
+    assert read_flat_file(file_loc, parser, ids) == list(get_kegg_record_dict(set(ids), parser, file_loc).values())
+
+
+def test_read_flat_file_range_skips_unrequested(kegg_flat_files):
+    parsed = list()
+
+    def counting_parser(raw_record):
+        parsed.append(raw_record)
+        return parse_co(raw_record)
+    records = read_flat_file_range(kegg_flat_files['co'], counting_parser, {'C00003', 'C00010'})
+    assert [record['ENTRY'] for record in records] == ['C00003', 'C00010']
+    assert len(parsed) == 2
+
+
+def test_read_flat_file_parallel(synthetic_flat_files):
+    file_loc = synthetic_flat_files['co']
+    ids = ['C%05d' % i for i in range(1, 400, 5)]
+    assert read_flat_file(file_loc, parse_co, ids, processes=3) == read_flat_file(file_loc, parse_co, ids)
+    assert read_flat_file(file_loc, parse_co, processes=2) == read_flat_file(file_loc, parse_co)
@@ -0,0 +1,87 @@
+import pytest
+import numpy as np
+import pandas as pd
+from os import path
+
+from KEGG_parser.downloader import get_kegg_record_dict
+from KEGG_parser.parsers import parse_ko, parse_rn, parse_co, parse_pathway
+
+from AMON.kegg_index import KEGGIndex, KEGGRecords, build_index, make_csr
+from AMON.predict_metabolites import main
+
+
+@pytest.fixture(scope='module')
+def kegg_index_dir(kegg_flat_files, tmpdir_factory):
+    index_dir = str(tmpdir_factory.mktemp('index').join('kegg_index'))
+    build_index(kegg_flat_files['ko'], kegg_flat_files['rn'], kegg_flat_files['co'],
+                kegg_flat_files['pathway']).save(index_dir)
+    return index_dir
+
+
+def test_make_csr():
+    indptr, indices = make_csr([[1, 2], [], [0]])
+    assert tuple(indptr) == (0, 2, 2, 3)
+    assert tuple(indices) == (1, 2, 0)
+
+
+def test_load_is_memory_mapped(kegg_index_dir):
+    kegg_index = KEGGIndex.load(kegg_index_dir)
+    assert isinstance(kegg_index.arrays['ko_rn_indices'], np.memmap)
+    assert len(kegg_index.ids('ko')) == 6
+    assert tuple(kegg_index.lookup('ko', ['K00002', 'K99999'])) == (1, -1)
+    # ids longer than the index's ids are not cut down to match them
+    assert tuple(kegg_index.lookup('ko', ['K000011', 'K00001|g__Escherichia', 'K00001'])) == (-1, -1, 0)
+
+
+def test_index_records_match_flat_files(kegg_index_dir, kegg_flat_files):
+    kegg_index = KEGGIndex.load(kegg_index_dir)
+    kos = ['K00001', 'K00006', 'K99999']
+    ko_records = get_kegg_record_dict(kos, parse_ko, kegg_flat_files['ko'])
+    index_ko_records = kegg_index.get_record_dict('ko', kos)
+    assert set(index_ko_records) == set(ko_records) == {'K00001', 'K00006'}
+    assert index_ko_records['K00001']['DBLINKS']['RN'] == ko_records['K00001']['DBLINKS']['RN']
+    assert 'DBLINKS' not in index_ko_records['K00006']
+
+    rns = ['R00001', 'R00010']
+    rn_records = get_kegg_record_dict(rns, parse_rn, kegg_flat_files['rn'])
+    index_rn_records = kegg_index.get_record_dict('rn', rns)
+    for rn in rns:
+        assert index_rn_records[rn]['EQUATION'] == rn_records[rn]['EQUATION']
+
+    cos = ['C00001', 'C00012', 'G00001']
+    co_records = get_kegg_record_dict(cos, parse_co, kegg_flat_files['co'])
+    index_co_records = kegg_index.get_record_dict('co', cos)
+    # glycans are only known through pathway links so have no record
+    assert set(index_co_records) == set(co_records) == {'C00001', 'C00012'}
+    assert index_co_records['C00012']['REACTION'] == co_records['C00012']['REACTION']
+    assert [pathway[0] for pathway in index_co_records['C00012']['PATHWAY']] == ['ko00010', 'ko00020']
+
+    pathway_records = get_kegg_record_dict(['ko00010'], parse_pathway, kegg_flat_files['pathway'])
+    index_pathway_records = kegg_index.get_record_dict('pathway', ['map00010'])
+    assert index_pathway_records['ko00010']['NAME'] == pathway_records['ko00010']['NAME']
+    assert [co[0] for co in index_pathway_records['ko00010']['COMPOUND']] == \
+           [co[0] for co in pathway_records['ko00010']['COMPOUND']]
+
+
+def test_kegg_records():
+    kegg_records = KEGGRecords({'ko': {'K00001': {'ENTRY': 'K00001'}}, 'pathway': {'ko00010': {'ENTRY': 'ko00010'}}})
+    assert kegg_records.get_record_dict('ko', ['K00001', 'K00002']) == {'K00001': {'ENTRY': 'K00001'}}
+    assert set(kegg_records.get_record_dict('pathway', ['map00010'])) == {'ko00010'}
+
+
+def test_main_with_kegg_index(kegg_index_dir, kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    files_dir = str(tmpdir.join('files_output'))
+    main(kos_loc, files_dir, other_kos_loc, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    index_dir = str(tmpdir.join('index_output'))
+    main(kos_loc, index_dir, other_kos_loc, kegg_index=kegg_index_dir)
+    files_origin = pd.read_csv(path.join(files_dir, 'origin_table.tsv'), sep='\t', index_col=0)
+    index_origin = pd.read_csv(path.join(index_dir, 'origin_table.tsv'), sep='\t', index_col=0)
+    pd.testing.assert_frame_equal(files_origin.sort_index(), index_origin.sort_index())
+    assert 'KEGG index location' in open(path.join(index_dir, 'AMON_log.txt')).read()
@@ -0,0 +1,81 @@
+import pytest
+import gzip
+import json
+from os import path
+
+from AMON.kegg_snapshot import SnapshotWriter, load_snapshot
+from AMON.predict_metabolites import main
+
+
+def test_snapshot_round_trip(tmpdir):
+    snapshot_loc = str(tmpdir.join('kegg_entries.jsonl.gz'))
+    ko_records = {'K00001': {'ENTRY': 'K00001', 'DBLINKS': {'RN': ['R00001']}}}
+    with SnapshotWriter(snapshot_loc) as snapshot_writer:
+        snapshot_writer.write_records('ko', ko_records)
+        snapshot_writer.write_records('ko', ko_records)
+        snapshot_writer.write_records('pathway', {'ko00010': {'ENTRY': 'ko00010', 'COMPOUND': [['C00001', 'a']]}})
+    with gzip.open(snapshot_loc, 'rt') as f:
+        assert len(f.readlines()) == 3
+    kegg_records = load_snapshot(snapshot_loc)
+    assert kegg_records.get_record_dict('ko', ['K00001', 'K00002']) == ko_records
+    assert set(kegg_records.get_record_dict('pathway', ['map00010'])) == {'ko00010'}
+
+
+def test_load_snapshot_bad_file(tmpdir):
+    text_loc = str(tmpdir.join('kegg_entries.txt'))
+    with open(text_loc, 'w') as f:
+        f.write('K00001\n')
+    with pytest.raises(ValueError):
+        load_snapshot(text_loc)
+    old_loc = str(tmpdir.join('old_entries.jsonl.gz'))
+    with gzip.open(old_loc, 'wt') as f:
+        f.write(json.dumps({'format': 'AMON KEGG snapshot', 'version': 0}) + '\n')
+    with pytest.raises(ValueError):
+        load_snapshot(old_loc)
+
+
+class NoLookups(object):
+    def fetch_records(self, ids, kind):
+        raise AssertionError('%s records %s were looked up' % (kind, sorted(ids)))
+
+
+def test_main_save_and_load_entries(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    files_dir = str(tmpdir.join('files_output'))
+    main(kos_loc, files_dir, other_kos_loc, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], save_entries=True,
+         make_plots=False)
+    snapshot_loc = path.join(files_dir, 'kegg_entries.jsonl.gz')
+    snapshot_dir = str(tmpdir.join('snapshot_output'))
+    main(kos_loc, snapshot_dir, other_kos_loc, load_entries=snapshot_loc, kegg_fetcher=NoLookups(), make_plots=False)
+    for output in ('origin_table.tsv', 'gene_set_1_compound_pathway_enrichment.tsv'):
+        assert open(path.join(files_dir, output)).read() == open(path.join(snapshot_dir, output)).read()
+
+
+def test_main_load_partial_entries(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\n')
+    partial_dir = str(tmpdir.join('partial_output'))
+    main(kos_loc, partial_dir, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], save_entries=True,
+         make_plots=False)
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00002\n')
+    files_dir = str(tmpdir.join('files_output'))
+    main(kos_loc, files_dir, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], make_plots=False)
+    snapshot_dir = str(tmpdir.join('snapshot_output'))
+    main(kos_loc, snapshot_dir, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], make_plots=False,
+         load_entries=path.join(partial_dir, 'kegg_entries.jsonl.gz'), save_entries=True)
+    assert open(path.join(files_dir, 'origin_table.tsv')).read() == \
+        open(path.join(snapshot_dir, 'origin_table.tsv')).read()
+    # the new snapshot has the loaded records and the ones looked up
+    kegg_records = load_snapshot(path.join(snapshot_dir, 'kegg_entries.jsonl.gz'))
+    assert set(kegg_records.record_dicts['ko']) == {'K00001', 'K00002'}
@@ -0,0 +1,72 @@
+import pytest
+
+from KEGG_parser.parsers import parse_organism
+from KEGG_parser.downloader import get_from_kegg_flat_file
+
+from AMON.kegg_cache import KEGGCache
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.organisms import read_organism_flat_file, get_organism_kos, write_organism_table
+from AMON.predict_metabolites import read_in_ids
+
+GENES = ['ENTRY       b0001             CDS       T00007\n'
+         'NAME        thrL\n'
+         'ORTHOLOGY   K00001  thr operon leader peptide\n'
+         'POSITION    190..255\n'
+         'NTSEQ       66\n'
+         '            atgaaacgcattagcaccaccattaccaccaccattaccacaggtaacggtgcgggctga\n',
+         'ENTRY       b0002             CDS       T00007\n'
+         'NAME        thrA\n'
+         'POSITION    337..2799\n',
+         'ENTRY       b0003             CDS       T00007\n'
+         'NAME        thrB\n'
+         'ORTHOLOGY   K00002  homoserine kinase\n'
+         '            K00003  homoserine dehydrogenase\n'
+         'POSITION    2801..3733\n']
+
+
+@pytest.fixture()
+def organism_files(tmpdir):
+    file_locs = list()
+    for name, genes in (('eco', GENES), ('ecj', GENES[:2])):
+        file_loc = str(tmpdir.join('%s.txt' % name))
+        with open(file_loc, 'w') as f:
+            f.write(''.join('%s///\n' % gene for gene in genes))
+        file_locs.append(file_loc)
+    return file_locs
+
+
+def test_read_organism_flat_file(organism_files):
+    kos = read_organism_flat_file(organism_files[0])
+    # the same as the KOs parse_organism finds
+    org_records = get_from_kegg_flat_file(organism_files[0], parser=parse_organism)
+    assert kos == set(org_record['ORTHOLOGY'][0] for org_record in org_records if 'ORTHOLOGY' in org_record)
+    assert kos == {'K00001', 'K00003'}
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_get_organism_kos_flat_files(organism_files, processes):
+    assert get_organism_kos(organism_files, from_flat_files=True, processes=processes) == \
+        {'eco': {'K00001', 'K00003'}, 'ecj': {'K00001'}}
+    with pytest.raises(ValueError):
+        get_organism_kos(organism_files * 2, from_flat_files=True)
+
+
+def test_get_organism_kos_api(kegg_server, tmpdir):
+    fetcher = KEGGFetcher(kegg_server.url, rate_limit=None)
+    kegg_cache = KEGGCache(str(tmpdir.join('cache.db')), fetcher=fetcher.fetch_records)
+    organism_kos = get_organism_kos(['hsa', 'eco'], kegg_cache=kegg_cache)
+    assert organism_kos == {'hsa': {'K00004', 'K00005'}, 'eco': {'K00001', 'K00002'}}
+    assert sorted(kegg_server.requests) == ['/link/ko/eco', '/link/ko/hsa']
+    # organisms are fetched once and then read from the cache
+    assert get_organism_kos(['eco'], kegg_cache=kegg_cache) == {'eco': {'K00001', 'K00002'}}
+    assert len(kegg_server.requests) == 2
+    with pytest.raises(ValueError):
+        get_organism_kos(['eco', 'xyz'], kegg_fetcher=fetcher)
+
+
+def test_write_organism_table(tmpdir):
+    organism_kos = {'eco': {'K00001', 'K00002'}, 'hsa': {'K00004'}, 'ecj': {'K00001'}}
+    output_loc = str(tmpdir.join('organisms.biom'))
+    write_organism_table(organism_kos, output_loc)
+    assert read_in_ids(output_loc, keep_separated=True) == organism_kos
+    assert read_in_ids(output_loc, name='panel') == {'panel': {'K00001', 'K00002', 'K00004'}}
@@ -1,15 +1,23 @@
 import pytest
+import subprocess
+import json
+import pstats
+import sys
 from numpy.testing import assert_allclose
 import pandas as pd
 from biom.table import Table
-from os.path import isfile
+from biom import load_table
+from os.path import isfile, join
 import numpy as np
 
 from AMON.predict_metabolites import p_adjust, read_in_ids, make_compound_origin_table, get_rns_from_kos, \
                                      get_products_from_rns, get_pathways_from_cos, get_pathway_to_co_dict, \
                                      make_venn, calculate_enrichment, make_enrichment_clustermap, \
                                      make_kegg_mapper_input, reverse_dict_of_lists, merge_dicts_of_lists,\
-                                     get_unique_from_dict_of_lists
+                                     get_unique_from_dict_of_lists, read_in_id_matrix, sniff_delimiter, \
+                                     make_compound_origin_matrix, write_origin_table, write_origin_table_biom, main, \
+                                     Logger, predict, shade_colors, GROUP_COLORS, SHARED_COLOR_RANGE, read_sample_groups
+from AMON.vocabulary import Vocabulary
 
 
 @pytest.fixture()
@@ -122,6 +130,26 @@ def test_read_in_ids_biom_keep_separated(ids_biom):
     assert set(sample_dict['Sample2']) == {'K00001', 'K00003'}
 
 
+def test_sniff_delimiter(ids_csv, ids_tsv):
+    assert sniff_delimiter(ids_csv) == ','
+    assert sniff_delimiter(ids_tsv) == '\t'
+
+
+def test_read_in_id_matrix(ids_csv, ids_tsv, ids_biom):
+    for file_loc in (ids_csv, ids_tsv, ids_biom):
+        id_matrix = read_in_id_matrix(file_loc, chunksize=1)
+        assert id_matrix.row_ids == ['Sample1', 'Sample2']
+        assert id_matrix.to_dict_of_sets() == {'Sample1': {'K00001', 'K00002'}, 'Sample2': {'K00001', 'K00003'}}
+
+
+def test_read_in_ids_tsv_samples_are_columns(tmpdir, list_of_kos):
+    fn = str(tmpdir.join('ko_table.tsv'))
+    df = pd.DataFrame([[1, 1], [1, 0], [0, 1]], index=list_of_kos, columns=('Sample1', 'Sample2'))
+    df.to_csv(fn, sep='\t')
+    sample_dict = read_in_ids(fn, keep_separated=True, samples_are_columns=True)
+    assert sample_dict == {'Sample1': {'K00001', 'K00002'}, 'Sample2': {'K00001', 'K00003'}}
+
+
 def test_read_in_ids_bad_ending():
     with pytest.raises(ValueError):
         ids = read_in_ids('fake.xkcd')
@@ -148,6 +176,13 @@ def test_get_rns_from_kos(dict_of_kos, ko_dict):
     assert len(rns['Sample2']) == 2
 
 
+def test_get_rns_from_kos_encoded(dict_of_kos, ko_dict):
+    vocabulary = Vocabulary()
+    rns = get_rns_from_kos(vocabulary.encode_dict(dict_of_kos), ko_dict, vocabulary)
+    assert rns['Sample1'].dtype == np.int32
+    assert vocabulary.decode_dict(rns) == {'Sample1': {'R00000', 'R00001'}, 'Sample2': {'R00000', 'R00001'}}
+
+
 @pytest.fixture()
 def list_of_rns():
     return ['R00000', 'R00001']
@@ -171,6 +206,12 @@ def test_get_products_from_rns(dict_of_rns, rn_dict):
     assert len(products['Sample1']) == 3
 
 
+def test_get_products_from_rns_encoded(dict_of_rns, rn_dict):
+    vocabulary = Vocabulary()
+    products = get_products_from_rns(vocabulary.encode_dict(dict_of_rns), rn_dict, vocabulary)
+    assert vocabulary.decode_dict(products) == get_products_from_rns(dict_of_rns, rn_dict)
+
+
 def test_reverse_dict_of_lists():
     dict_of_lists = {'Sample1': ['C00001', 'C00002'],
                      'Sample2': ['C00001', 'C00003']}
@@ -181,6 +222,15 @@ def test_reverse_dict_of_lists():
     assert len(reversed_dict_of_lists['C00003']) == 1
 
 
+def test_reverse_dict_of_lists_encoded():
+    vocabulary = Vocabulary()
+    dict_of_codes = vocabulary.encode_dict({'Sample1': ['C00001', 'C00002'], 'Sample2': ['C00001', 'C00003'],
+                                            'Sample3': []})
+    reversed_dict_of_lists = reverse_dict_of_lists(dict_of_codes)
+    assert {vocabulary.ids[code]: keys for code, keys in reversed_dict_of_lists.items()} == \
+        {'C00001': ['Sample1', 'Sample2'], 'C00002': ['Sample1'], 'C00003': ['Sample2']}
+
+
 @pytest.fixture()
 def list_of_cos():
     return ['C00002', 'C00003', 'C00005']
@@ -213,6 +263,26 @@ def test_make_compound_origin_table(dict_of_cos, list_of_measured_cos):
     assert tuple(table2.sum(axis=0)) == (3, 3, 2)
 
 
+def test_make_compound_origin_matrix(dict_of_cos, list_of_measured_cos):
+    origin_matrix = make_compound_origin_matrix(dict_of_cos, list_of_measured_cos)
+    assert origin_matrix.shape == (5, 3)
+    assert origin_matrix.column_ids == ['Sample1', 'Sample2', 'detected']
+    assert origin_matrix.transpose().to_dict_of_sets()['detected'] == {'C00001', 'C00003'}
+
+
+def test_write_origin_table(dict_of_cos, list_of_measured_cos, tmpdir):
+    origin_matrix = make_compound_origin_matrix(dict_of_cos, list_of_measured_cos)
+    tsv_loc = str(tmpdir.join('origin_table.tsv'))
+    write_origin_table(origin_matrix, tsv_loc, chunksize=2)
+    expected = make_compound_origin_table(dict_of_cos, list_of_measured_cos).to_csv(sep='\t')
+    assert open(tsv_loc).read() == expected
+    biom_loc = str(tmpdir.join('origin_table.biom'))
+    write_origin_table_biom(origin_matrix, biom_loc)
+    table = load_table(biom_loc)
+    assert set(table.ids(axis='observation')) == set(origin_matrix.row_ids)
+    assert table.sum() == 8
+
+
 def test_merge_dicts_of_lists(dict_of_kos, dict_of_cos):
     merged_dicts = merge_dicts_of_lists(dict_of_kos, dict_of_cos)
     assert len(merged_dicts) == 2
@@ -234,6 +304,22 @@ def test_make_kegg_mapper_input(list_of_cos, dict_of_cos, list_of_measured_cos):
     assert kegg_mapper_table4['C00002'] == 'green'
     assert kegg_mapper_table4['C00004'] == 'yellow'
     assert kegg_mapper_table4['C00005'] == 'blue'
+    assert kegg_mapper_table4['C00006'] == ',orange'
+
+
+def test_make_kegg_mapper_input_many_samples(dict_of_cos, list_of_measured_cos):
+    sample_cos = dict(dict_of_cos, Sample3=['C00002', 'C00003'])
+    kegg_mapper_table = make_kegg_mapper_input(sample_cos, list_of_measured_cos)
+    assert kegg_mapper_table.shape == (6,)
+    assert kegg_mapper_table['C00005'] == GROUP_COLORS[0]
+    assert kegg_mapper_table['C00004'] == GROUP_COLORS[1]
+    assert kegg_mapper_table['C00001'] == '%s,orange' % GROUP_COLORS[1]
+    assert kegg_mapper_table['C00002'] == SHARED_COLOR_RANGE[1]
+    assert kegg_mapper_table['C00003'] == '%s,orange' % shade_colors([.5])[0]
+    # groups of samples are colored as samples
+    grouped_table = make_kegg_mapper_input(sample_cos, sample_groups={'Sample1': 'bacteria', 'Sample2': 'host',
+                                                                      'Sample3': 'bacteria'})
+    assert grouped_table.sort_index().equals(make_kegg_mapper_input(dict_of_cos).sort_index())
 
 
 def test_get_unique_from_dict_of_lists(dict_of_cos):
@@ -243,6 +329,26 @@ def test_get_unique_from_dict_of_lists(dict_of_cos):
     assert set(unique_dict_of_cos['Sample2']) == {'C00001', 'C00004'}
 
 
+def test_get_unique_from_dict_of_lists_max_keys(dict_of_cos):
+    dict_of_cos['Sample3'] = ['C00002', 'C00004', 'C00002']
+    unique_dict_of_cos = get_unique_from_dict_of_lists(dict_of_cos)
+    assert unique_dict_of_cos['Sample3'] == set()
+    assert unique_dict_of_cos['Sample2'] == {'C00001'}
+    rare_dict_of_cos = get_unique_from_dict_of_lists(dict_of_cos, max_keys=2)
+    assert rare_dict_of_cos['Sample1'] == {'C00003', 'C00005'}
+    assert rare_dict_of_cos['Sample2'] == {'C00001', 'C00004'}
+    assert rare_dict_of_cos['Sample3'] == {'C00004'}
+
+
+def test_get_unique_from_dict_of_lists_encoded(dict_of_cos):
+    dict_of_cos['Sample3'] = ['C00002', 'C00004', 'C00002']
+    vocabulary = Vocabulary()
+    dict_of_codes = vocabulary.encode_dict(dict_of_cos)
+    for max_keys in (1, 2):
+        unique_codes = get_unique_from_dict_of_lists(dict_of_codes, max_keys=max_keys)
+        assert vocabulary.decode_dict(unique_codes) == get_unique_from_dict_of_lists(dict_of_cos, max_keys=max_keys)
+
+
 def test_make_venn(dict_of_cos, list_of_measured_cos, tmpdir):
     with pytest.raises(ValueError):
         make_venn({'Sample1': list_of_measured_cos})
@@ -332,3 +438,188 @@ def test_make_enrichment_clustermap(enrichment_dfs, tmpdir):
     enrichment_path = str(p.join('enrichment_heatmap.png'))
     make_enrichment_clustermap(enrichment_dfs, 'p-value', output_loc=enrichment_path)
     assert isfile(enrichment_path)
+
+
+NO_PLOTS_SCRIPT = """
+import sys
+from AMON.predict_metabolites import main
+heavy_modules = ('matplotlib', 'seaborn', 'statsmodels', 'biom', 'scipy.stats', 'aiohttp')
+assert [module for module in heavy_modules if module in sys.modules] == []
+main(*sys.argv[1:4], ko_file_loc=sys.argv[4], rn_file_loc=sys.argv[5], co_file_loc=sys.argv[6],
+     pathway_file_loc=sys.argv[7], make_plots=False)
+assert [module for module in ('matplotlib', 'seaborn') if module in sys.modules] == []
+"""
+
+
+def test_main_no_plots(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    output_dir = str(tmpdir.join('output'))
+    subprocess.run([sys.executable, '-c', NO_PLOTS_SCRIPT, kos_loc, output_dir, other_kos_loc,
+                    kegg_flat_files['ko'], kegg_flat_files['rn'], kegg_flat_files['co'], kegg_flat_files['pathway']],
+                   check=True)
+    assert isfile(join(output_dir, 'origin_table.tsv'))
+    assert not isfile(join(output_dir, 'venn.png'))
+    assert not isfile(join(output_dir, 'enrichment_heatmap.png'))
+
+
+def test_logger_stages(tmpdir):
+    logger = Logger(str(tmpdir.join('log.txt')), str(tmpdir.join('stages.json')))
+    with logger.stage('sum') as counts:
+        counts['items'] = len(list(range(1000)))
+    with pytest.raises(ValueError):
+        with logger.stage('fail'):
+            raise ValueError()
+    logger.output_log()
+    stages = json.load(open(str(tmpdir.join('stages.json'))))['stages']
+    assert [stage['name'] for stage in stages] == ['sum', 'fail']
+    assert stages[0]['counts'] == {'items': 1000}
+    assert stages[0]['wall time'] >= 0
+    assert 'stage sum: wall time' in open(str(tmpdir.join('log.txt'))).read()
+
+
+def test_logger_stage_peaks(tmpdir):
+    logger = Logger(str(tmpdir.join('log.txt')))
+    with logger.stage('allocate'):
+        with logger.stage('inner'):
+            allocated = np.ones(2 ** 23)
+        del allocated
+    with logger.stage('small'):
+        pass
+    inner, allocate, small = logger.stages
+    if small['process peak rss'] is not None:
+        assert small['process peak rss'] >= allocate['process peak rss'] > 64
+    if small['peak rss'] is not None:
+        # each stage has its own peak, outer stages include the peaks of the stages in them
+        assert allocate['peak rss'] >= inner['peak rss'] > small['peak rss'] + 50
+        assert small['process peak rss'] >= inner['peak rss']
+
+
+def test_main_stages(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    output_dir = str(tmpdir.join('output'))
+    main(kos_loc, output_dir, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], make_plots=False,
+         stage_format='chrome', profile=True)
+    events = json.load(open(join(output_dir, 'AMON_trace.json')))['traceEvents']
+    names = [event['name'] for event in events]
+    assert names[:3] == ['read inputs', 'KO records', 'reactions from KOs']
+    assert events[0]['args']['kos'] == 2
+    assert all(event['ph'] == 'X' for event in events)
+    profiled_stage = max(events, key=lambda event: event['dur'])['name']
+    assert 'Profiled stage: %s' % profiled_stage in open(join(output_dir, 'AMON_log.txt')).read()
+    pstats.Stats(join(output_dir, 'AMON_profile.prof'))
+
+
+def test_predict(kegg_flat_files, tmpdir):
+    results = predict({'microbe': {'K00001', 'K00006'}, 'host': ['K00004', 'K00005']}, compounds=['C00002'],
+                      ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                      co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'],
+                      keep_records=True)
+    assert tmpdir.listdir() == []
+    assert list(results.origin_table.columns) == ['microbe', 'host', 'detected']
+    assert results.origin_table.dtypes.eq(bool).all()
+    assert results.kegg_mapper_input is not None
+    assert set(results.sample_compounds.row_ids) == {'microbe', 'host'}
+    assert set(results.records) == {'ko', 'rn', 'co', 'pathway'}
+    assert [stage['name'] for stage in results.stages][:2] == ['read inputs', 'KO records']
+
+    # writing the results gives the same files as main
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    compounds_loc = str(tmpdir.join('compounds.txt'))
+    with open(compounds_loc, 'w') as f:
+        f.write('C00002\n')
+    main_dir = str(tmpdir.join('main_output'))
+    main(kos_loc, main_dir, other_kos_loc, compounds_loc, 'microbe', 'host', ko_file_loc=kegg_flat_files['ko'],
+         rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+         pathway_file_loc=kegg_flat_files['pathway'], make_plots=False, write_json=True)
+    results_dir = str(tmpdir.join('results_output'))
+    results.write(results_dir, make_plots=False, write_json=True)
+    for output in ('origin_table.tsv', 'microbe_compound_pathway_enrichment.tsv', 'ko_dict.json', 'co_dict.json'):
+        assert open(join(main_dir, output)).read() == open(join(results_dir, output)).read()
+    assert isfile(join(results_dir, 'kegg_mapper.tsv'))
+
+
+def test_read_sample_groups(tmpdir):
+    metadata_loc = str(tmpdir.join('metadata.tsv'))
+    pd.DataFrame({'treatment': ['drug', 'control', None], 'site': ['gut', 'gut', 'skin']},
+                 index=['Sample1', 'Sample2', 'Sample3']).to_csv(metadata_loc, sep='\t')
+    assert read_sample_groups(metadata_loc, 'treatment') == {'Sample1': 'drug', 'Sample2': 'control'}
+    with pytest.raises(ValueError):
+        read_sample_groups(metadata_loc, 'diet')
+
+
+def test_main_sample_groups(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.tsv'))
+    pd.DataFrame([[1, 1, 0, 0], [0, 1, 0, 0], [0, 0, 1, 1], [0, 0, 1, 0]],
+                 index=['Sample1', 'Sample2', 'Sample3', 'Sample4'],
+                 columns=['K00001', 'K00002', 'K00004', 'K00005']).to_csv(kos_loc, sep='\t')
+    metadata_loc = str(tmpdir.join('metadata.csv'))
+    pd.DataFrame({'treatment': ['drug', 'drug', 'control', 'control']},
+                 index=['Sample1', 'Sample2', 'Sample3', 'Sample4']).to_csv(metadata_loc)
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    output_dir = str(tmpdir.join('grouped'))
+    main(kos_loc, output_dir, sample_metadata=metadata_loc, group_by='treatment', make_plots=False, **kwargs)
+    origin_table = pd.read_csv(join(output_dir, 'origin_table.tsv'), sep='\t', index_col=0)
+    assert list(origin_table.columns) == ['drug', 'control']
+    # groups are the same as samples with the union of their KOs
+    separate = predict({'drug': {'K00001', 'K00002'}, 'control': {'K00004', 'K00005'}}, **kwargs)
+    assert origin_table.equals(separate.origin_table)
+    # only KOs of every sample of a group are kept with the all rule
+    results = predict(kos_loc, sample_groups=read_sample_groups(metadata_loc, 'treatment'), group_rule='all',
+                      **kwargs)
+    assert set(results.sample_compounds.row_ids) == {'drug', 'control'}
+    assert results.origin_table.equals(predict({'drug': {'K00002'}, 'control': {'K00004'}}, **kwargs).origin_table)
+    with pytest.raises(ValueError):
+        main(kos_loc, str(tmpdir.join('no_column')), sample_metadata=metadata_loc, **kwargs)
+    with pytest.raises(ValueError):
+        main(kos_loc, str(tmpdir.join('chunked')), sample_metadata=metadata_loc, group_by='treatment',
+             keep_separated=True, sample_chunksize=2, **kwargs)
+
+
+def test_sample_groups_missing_group(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.tsv'))
+    pd.DataFrame([[1, 1, 0, 0], [0, 0, 1, 1], [0, 0, 0, 1]], index=['Sample1', 'Sample2', 'Sample3'],
+                 columns=['K00001', 'K00002', 'K00004', 'K00005']).to_csv(kos_loc, sep='\t')
+    metadata_loc = str(tmpdir.join('metadata.tsv'))
+    pd.DataFrame({'treatment': ['drug', 'control', None]},
+                 index=['Sample1', 'Sample2', 'Sample3']).to_csv(metadata_loc, sep='\t')
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    expected = predict({'drug': {'K00001', 'K00002'}, 'control': {'K00004', 'K00005'}}, **kwargs).origin_table
+    # samples without a group value are left out and counted
+    results = predict(kos_loc, sample_groups=read_sample_groups(metadata_loc, 'treatment'), **kwargs)
+    assert results.origin_table.equals(expected)
+    assert results.logger['Samples without a group left out'] == 1
+    results = predict({'Sample1': {'K00001', 'K00002'}, 'Sample2': {'K00004', 'K00005'}, 'Sample3': {'K00005'}},
+                      sample_groups={'Sample1': 'drug', 'Sample2': 'control'}, **kwargs)
+    assert results.origin_table.equals(expected)
+
+
+def test_sample_groups_numeric_ids(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.tsv'))
+    pd.DataFrame([[1, 1, 0, 0], [0, 0, 1, 1]], index=[1001, 1002],
+                 columns=['K00001', 'K00002', 'K00004', 'K00005']).to_csv(kos_loc, sep='\t')
+    metadata_loc = str(tmpdir.join('metadata.tsv'))
+    pd.DataFrame({'treatment': ['drug', 'control']}, index=[1001, 1002]).to_csv(metadata_loc, sep='\t')
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    expected = predict({'drug': {'K00001', 'K00002'}, 'control': {'K00004', 'K00005'}}, **kwargs).origin_table
+    results = predict(kos_loc, sample_groups=read_sample_groups(metadata_loc, 'treatment'), **kwargs)
+    assert results.origin_table.equals(expected)
+    # numeric ids given directly match too
+    results = predict({1001: {'K00001', 'K00002'}, 1002: {'K00004', 'K00005'}},
+                      sample_groups={1001: 'drug', 1002: 'control'}, **kwargs)
+    assert results.origin_table.equals(expected)
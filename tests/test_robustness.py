@@ -0,0 +1,113 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from AMON.enrichment import calculate_enrichment_batch
+from AMON.predict_metabolites import predict
+from AMON.robustness import estimate_robustness, read_in_count_matrix
+from AMON.sparse_engine import IncidenceMatrix
+
+
+@pytest.fixture()
+def incidence():
+    rng = np.random.default_rng(1)
+    kos = ['K%05d' % i for i in range(40)]
+    cos = ['C%05d' % i for i in range(200)]
+    ko_cos = IncidenceMatrix.from_dict_of_lists({ko: rng.choice(cos, 12, replace=False) for ko in kos},
+                                                column_ids=cos)
+    # the first pathway holds most of what the first KOs make so it is enriched in the first sample
+    pathway_cos = IncidenceMatrix.from_dict_of_lists(
+        {'ko00001': sorted(set(co for ko in kos[:5] for co in ko_cos.to_dict_of_sets()[ko]))[:40],
+         'ko00002': cos[100:150], 'ko00003': cos[:5]}, column_ids=cos)
+    sample_kos = IncidenceMatrix.from_dict_of_lists({'sample1': kos[:5], 'sample2': kos[5:25], 'sample3': []},
+                                                    column_ids=kos)
+    return sample_kos, ko_cos, pathway_cos
+
+
+def test_estimate_robustness(incidence):
+    sample_kos, ko_cos, pathway_cos = incidence
+    compound_stability, pathway_stability = estimate_robustness(sample_kos, ko_cos, pathway_cos, replicates=300)
+    assert list(compound_stability.columns) == sample_kos.row_ids
+    assert list(pathway_stability.index) == ['ko00001', 'ko00002']
+    assert np.all((compound_stability.to_numpy() >= 0) & (compound_stability.to_numpy() <= 1))
+    # compounds not made by a sample are never made by its replicates and all KOs are kept about .8 of the time
+    sample_cos = sample_kos.dot(ko_cos).to_dict_of_sets()
+    for sample, cos in sample_cos.items():
+        assert set(compound_stability.index[compound_stability[sample] > 0]) == cos
+    ko_frequencies = estimate_robustness(sample_kos, IncidenceMatrix.from_dict_of_lists(
+        {ko: [ko] for ko in sample_kos.column_ids}), pathway_cos, replicates=300)[0]
+    assert np.allclose(ko_frequencies['sample2'].loc[sample_kos.column_ids[5:25]], .8, atol=.1)
+    assert pathway_stability.loc['ko00001', 'sample1'] > .5
+    # seeds are spawned per sample so the number of processes does not change the estimates
+    in_processes = estimate_robustness(sample_kos, ko_cos, pathway_cos, replicates=300, processes=2)
+    pd.testing.assert_frame_equal(compound_stability, in_processes[0])
+    pd.testing.assert_frame_equal(pathway_stability, in_processes[1])
+    with pytest.raises(ValueError):
+        estimate_robustness(sample_kos, ko_cos, pathway_cos, method='bootstrap')
+    with pytest.raises(ValueError):
+        estimate_robustness(sample_kos, ko_cos, pathway_cos, fraction=0)
+    with pytest.raises(ValueError):
+        estimate_robustness(sample_kos, ko_cos, pathway_cos, method='rarefy')
+
+
+def test_estimate_robustness_whole_samples(incidence):
+    sample_kos, ko_cos, pathway_cos = incidence
+    compound_stability, pathway_stability = estimate_robustness(sample_kos, ko_cos, pathway_cos, replicates=10,
+                                                                fraction=1)
+    assert np.all(compound_stability[['sample1', 'sample2']].to_numpy()[compound_stability[['sample1', 'sample2']]
+                                                                        .to_numpy() > 0] == 1)
+    # replicates of whole samples find what the samples do
+    enrichment_table = calculate_enrichment_batch(sample_kos.dot(ko_cos), pathway_cos)
+    enriched = enrichment_table.set_index(['pathway', 'sample'])['adjusted probability'] < .05
+    for sample in ('sample1', 'sample2'):
+        for pathway in pathway_stability.index:
+            assert pathway_stability.loc[pathway, sample] == float(enriched[(pathway, sample)])
+
+
+def test_estimate_robustness_rarefy(incidence):
+    sample_kos, ko_cos, pathway_cos = incidence
+    ko_counts = (sample_kos.matrix.astype(np.int64) * 3, sample_kos.row_ids, sample_kos.column_ids)
+    compound_stability, pathway_stability = estimate_robustness(sample_kos, ko_cos, pathway_cos, replicates=50,
+                                                                method='rarefy', depth=15, ko_counts=ko_counts)
+    # sample1 has exactly 15 counts so every replicate keeps all of its KOs, sample3 has too few to be rarefied
+    assert np.all(compound_stability['sample1'].to_numpy()[compound_stability['sample1'].to_numpy() > 0] == 1)
+    assert np.all(np.isnan(compound_stability['sample3']))
+    assert 0 < compound_stability['sample2'].mean() < 1
+
+
+def test_read_in_count_matrix(tmpdir):
+    counts_loc = str(tmpdir.join('counts.tsv'))
+    pd.DataFrame([[1, 0], [2, 5]], index=['sample1', 'sample2'], columns=['K00001', 'K00002']).to_csv(counts_loc,
+                                                                                                    sep='\t')
+    counts, sample_ids, kos = read_in_count_matrix(counts_loc)
+    assert counts.toarray().tolist() == [[1, 0], [2, 5]]
+    assert (sample_ids, kos) == (['sample1', 'sample2'], ['K00001', 'K00002'])
+    assert read_in_count_matrix(counts_loc, samples_are_columns=True)[1] == ['K00001', 'K00002']
+    pd.DataFrame([[.5]], index=['sample1'], columns=['K00001']).to_csv(counts_loc, sep='\t')
+    with pytest.raises(ValueError):
+        read_in_count_matrix(counts_loc)
+
+
+@pytest.mark.parametrize('method', ['subsample', 'rarefy'])
+def test_predict_robustness(kegg_flat_files, tmpdir, method):
+    kwargs = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    kos_loc = str(tmpdir.join('kos.tsv'))
+    pd.DataFrame([[4, 2, 1, 0], [0, 0, 3, 3]], index=['sample1', 'sample2'],
+                 columns=['K00001', 'K00002', 'K00003', 'K00004']).to_csv(kos_loc, sep='\t')
+    results = predict(kos_loc, keep_separated=True, robustness_replicates=50, robustness_method=method,
+                      rarefaction_depth=4, **kwargs)
+    assert 'robustness' in [stage['name'] for stage in results.stages]
+    assert set(results.compound_stability.index) == set(results.sample_compounds.present_column_ids())
+    assert list(results.compound_stability.columns) == ['sample1', 'sample2']
+    assert list(results.pathway_stability.index) == ['Fake glycolysis', 'Fake citrate cycle']
+    output_dir = str(tmpdir.join('output'))
+    results.write(output_dir, make_plots=False)
+    pd.testing.assert_frame_equal(pd.read_csv(str(tmpdir.join('output', 'compound_stability.tsv')), sep='\t',
+                                              index_col=0), results.compound_stability)
+    assert results.logger['Pathway stability location'].endswith('pathway_stability.tsv')
+    with pytest.raises(ValueError):
+        predict({'sample1': ['K00001']}, robustness_replicates=50, robustness_method='rarefy', rarefaction_depth=4,
+                **kwargs)
+    with pytest.raises(ValueError):
+        predict(kos_loc, keep_separated=True, robustness_replicates=50, robustness_method='rarefy', **kwargs)
@@ -0,0 +1,111 @@
+import pytest
+import threading
+from os import path
+
+from AMON.client import send_request, write_response
+from AMON.kegg_index import build_index
+from AMON.server import make_server
+from AMON.predict_metabolites import main
+
+
+@pytest.fixture(params=[1, 2], ids=['threads', 'processes'])
+def amon_server(kegg_flat_files, request):
+    server = make_server(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                         co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'], port=0,
+                         workers=2, processes=request.param)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_predict_request(amon_server, kegg_flat_files, tmpdir):
+    assert send_request(amon_server.url, '/health')['status'] == 'ok'
+    request = {'gene_set': ['K00001', 'K00006'], 'other_gene_set': ['K00004', 'K00005'],
+               'detected_compounds': ['C00002'], 'unique_only': True}
+    response = send_request(amon_server.url, '/predict', request)
+    assert response['origin_table']['columns'] == ['gene_set_1', 'gene_set_2', 'detected']
+    assert [stage['name'] for stage in response['stages']][0] == 'read inputs'
+
+    # written responses match the outputs of main
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    compounds_loc = str(tmpdir.join('compounds.txt'))
+    with open(compounds_loc, 'w') as f:
+        f.write('C00002\n')
+    main_dir = str(tmpdir.join('main_output'))
+    main(kos_loc, main_dir, other_kos_loc, compounds_loc, ko_file_loc=kegg_flat_files['ko'],
+         rn_file_loc=kegg_flat_files['rn'], co_file_loc=kegg_flat_files['co'],
+         pathway_file_loc=kegg_flat_files['pathway'], make_plots=False)
+    response_dir = str(tmpdir.join('response_output'))
+    write_response(response, response_dir)
+    for output in ('origin_table.tsv', 'gene_set_1_compound_pathway_enrichment.tsv'):
+        assert open(path.join(main_dir, output)).read() == open(path.join(response_dir, output)).read()
+    assert sorted(open(path.join(main_dir, 'kegg_mapper.tsv'))) == \
+        sorted(open(path.join(response_dir, 'kegg_mapper.tsv')))
+
+
+def test_concurrent_requests(amon_server):
+    gene_sets = (['K00001', 'K00006'], ['K00004', 'K00005'])
+    requests = [{'gene_set': {'sample%s' % i: gene_sets[i % 2]}} for i in range(8)]
+    responses = [None] * len(requests)
+
+    def send(i):
+        responses[i] = send_request(amon_server.url, '/predict', requests[i])
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i, response in enumerate(responses):
+        assert response['origin_table']['columns'] == ['sample%s' % i]
+    assert responses[0]['origin_table']['index'] == responses[2]['origin_table']['index']
+    assert responses[0]['origin_table']['index'] != responses[1]['origin_table']['index']
+
+
+def test_enrichment_request(amon_server):
+    predict_response = send_request(amon_server.url, '/predict', {'gene_set': ['K00001', 'K00006']})
+    compounds = predict_response['origin_table']['index']
+    response = send_request(amon_server.url, '/enrichment', {'compounds': compounds, 'name': 'gene_set_1'})
+    assert response['enrichment'] == predict_response['enrichment']
+
+
+def test_bad_requests(amon_server, tmpdir):
+    with pytest.raises(ValueError, match='400'):
+        send_request(amon_server.url, '/predict', {'other_gene_set': ['K00001']})
+    with pytest.raises(ValueError, match='400'):
+        send_request(amon_server.url, '/predict', ['K00001'])
+    # compounds given as a string would be read as a file on the server
+    compounds_loc = str(tmpdir.join('compounds.txt'))
+    with open(compounds_loc, 'w') as f:
+        f.write('C00002\n')
+    with pytest.raises(ValueError, match='400'):
+        send_request(amon_server.url, '/predict', {'gene_set': ['K00001'], 'detected_compounds': compounds_loc})
+    # permutations are bounded so one request can not hold a worker for long
+    for permutations in (amon_server.max_permutations + 1, -1, 'all'):
+        with pytest.raises(ValueError, match='400'):
+            send_request(amon_server.url, '/predict', {'gene_set': ['K00001'], 'permutations': permutations})
+    with pytest.raises(ValueError, match='404'):
+        send_request(amon_server.url, '/unknown', {})
+
+
+def test_server_index_location(kegg_flat_files, tmpdir):
+    index_dir = str(tmpdir.join('kegg_index'))
+    build_index(kegg_flat_files['ko'], kegg_flat_files['rn'], kegg_flat_files['co'],
+                kegg_flat_files['pathway']).save(index_dir)
+    # worker processes open the saved index themselves
+    server = make_server(index_dir, port=0, processes=2, max_permutations=10)
+    assert server.temp_dir is None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        response = send_request(server.url, '/predict', {'gene_set': ['K00001', 'K00006'], 'permutations': 10})
+        assert response['origin_table']['columns'] == ['gene_set_1']
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,108 @@
+import pytest
+import numpy as np
+
+from AMON.sparse_engine import IncidenceMatrix, make_ko_rn_matrix, make_rn_co_matrix, get_sample_rns, \
+                               get_sample_cos, predict_compounds
+from AMON.predict_metabolites import get_rns_from_kos, get_products_from_rns
+
+
+@pytest.fixture()
+def ko_dict():
+    ko1 = {'ENTRY': 'K00001', 'DBLINKS': {'RN': ['R00000', 'R00001']}}
+    ko2 = {'ENTRY': 'K00002', 'DBLINKS': {'COG': ['COG0000']}}
+    ko3 = {'ENTRY': 'K00003', 'DBLINKS': {'RN': ['R00001']}}
+    return {'K00001': ko1, 'K00002': ko2, 'K00003': ko3}
+
+
+@pytest.fixture()
+def rn_dict():
+    rn1 = {'ENTRY': 'R00000', 'EQUATION': (('C00001', 'C00002'), ('C00003', 'C00004'))}
+    rn2 = {'ENTRY': 'R00001', 'EQUATION': (('C00006', 'C00005'), ('C00003', 'C00007'))}
+    return {'R00000': rn1, 'R00001': rn2}
+
+
+@pytest.fixture()
+def sample_kos():
+    return {'Sample1': {'K00001', 'K00002'},
+            'Sample2': {'K00003', 'K99999'},
+            'Sample3': {'K00002'}}
+
+
+def test_incidence_matrix_round_trip(sample_kos):
+    matrix = IncidenceMatrix.from_dict_of_lists(sample_kos)
+    assert matrix.shape == (3, 4)
+    assert matrix.to_dict_of_sets() == sample_kos
+
+
+def test_incidence_matrix_shape_mismatch():
+    with pytest.raises(ValueError):
+        IncidenceMatrix(np.ones((2, 2)), ['a', 'b'], ['c'])
+
+
+def test_reindex_rows(sample_kos):
+    matrix = IncidenceMatrix.from_dict_of_lists(sample_kos).reindex_rows(['Sample3', 'Sample4'])
+    assert matrix.to_dict_of_sets() == {'Sample3': {'K00002'}, 'Sample4': set()}
+
+
+def test_make_ko_rn_matrix(ko_dict):
+    ko_rn = make_ko_rn_matrix(ko_dict)
+    assert ko_rn.shape == (3, 2)
+    assert ko_rn.to_dict_of_sets()['K00002'] == set()
+
+
+def test_make_rn_co_matrix(rn_dict):
+    rn_co = make_rn_co_matrix(rn_dict)
+    assert rn_co.to_dict_of_sets() == {'R00000': {'C00003', 'C00004'}, 'R00001': {'C00003', 'C00007'}}
+
+
+def test_get_sample_rns(sample_kos, ko_dict):
+    sample_rns = get_sample_rns(sample_kos, ko_dict)
+    assert sample_rns.present_column_ids() == ['R00000', 'R00001']
+    expected = {sample: set(rns) for sample, rns in get_rns_from_kos(sample_kos, ko_dict).items()}
+    assert sample_rns.to_dict_of_sets() == expected
+
+
+def test_predict_compounds(sample_kos, ko_dict, rn_dict):
+    sample_cos = predict_compounds(sample_kos, ko_dict, rn_dict)
+    expected = get_products_from_rns(get_rns_from_kos(sample_kos, ko_dict), rn_dict)
+    assert sample_cos == expected
+    assert sample_cos['Sample3'] == set()
+    assert get_sample_cos(get_sample_rns(sample_kos, ko_dict), rn_dict).shape == (3, 3)
+
+
+def test_keep_rare_columns(sample_kos):
+    matrix = IncidenceMatrix.from_dict_of_lists(sample_kos)
+    assert tuple(matrix.column_counts()) == (1, 2, 1, 1)
+    assert matrix.keep_rare_columns().to_dict_of_sets() == {'Sample1': {'K00001'}, 'Sample2': {'K00003', 'K99999'},
+                                                            'Sample3': set()}
+    assert matrix.keep_rare_columns(max_rows=2).to_dict_of_sets() == sample_kos
+
+
+def test_dict_of_arrays():
+    matrix = IncidenceMatrix.from_dict_of_lists({'sample1': ['C00002', 'C00001'], 'sample2': ['C00003']})
+    dict_of_arrays = matrix.to_dict_of_arrays()
+    assert [list(codes) for codes in dict_of_arrays.values()] == [[0, 1], [2]]
+    round_trip = IncidenceMatrix.from_dict_of_arrays(dict_of_arrays, matrix.column_ids)
+    assert round_trip.to_dict_of_sets() == matrix.to_dict_of_sets()
+
+
+def test_group_rows(sample_kos):
+    matrix = IncidenceMatrix.from_dict_of_lists(sample_kos)
+    grouped = matrix.group_rows({'Sample1': 'group2', 'Sample2': 'group1', 'Sample3': 'group2'})
+    assert grouped.row_ids == ['group2', 'group1']
+    assert grouped.to_dict_of_sets() == {'group2': set(sample_kos['Sample1']), 'group1': set(sample_kos['Sample2'])}
+    with pytest.raises(ValueError):
+        matrix.group_rows({'Sample1': 'group1'})
+
+
+def test_group_rows_rules(sample_kos):
+    matrix = IncidenceMatrix.from_dict_of_lists(sample_kos)
+    row_groups = {'Sample1': 'group2', 'Sample2': 'group1', 'Sample3': 'group2'}
+    assert matrix.group_rows(row_groups, 'all').to_dict_of_sets() == \
+        {'group2': {'K00002'}, 'group1': set(sample_kos['Sample2'])}
+    assert matrix.group_rows(row_groups, .5).to_dict_of_sets() == \
+        {'group2': {'K00001', 'K00002'}, 'group1': set(sample_kos['Sample2'])}
+    assert matrix.group_rows(row_groups, .6).to_dict_of_sets() == matrix.group_rows(row_groups, 'all').to_dict_of_sets()
+    for rule in ('most', 0, 1.5):
+        with pytest.raises(ValueError):
+            matrix.group_rows(row_groups, rule)
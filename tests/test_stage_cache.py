@@ -0,0 +1,111 @@
+import pytest
+import json
+import pandas as pd
+from os import path
+
+from AMON.kegg_fetcher import KEGGFetcher
+from AMON.stage_cache import StageCache
+from AMON.sparse_engine import IncidenceMatrix
+from AMON.predict_metabolites import main, predict
+
+
+def test_stage_cache_round_trip(tmpdir):
+    stage_cache = StageCache(str(tmpdir.join('stage_cache')))
+    key = stage_cache.key('sample KOs', 'a', 1)
+    assert key == stage_cache.key('sample KOs', 'a', 1)
+    assert key != stage_cache.key('sample KOs', 'a', 2)
+    assert stage_cache.load_dict_of_lists('sample KOs', key) is None
+    sample_kos = {'sample1': {'K00001', 'K00002'}, 'sample2': set(), 'sample3': {'K00003'}}
+    stage_cache.save_dict_of_lists(key, sample_kos)
+    assert stage_cache.load_dict_of_lists('sample KOs', key) == sample_kos
+    matrix = IncidenceMatrix.from_dict_of_lists(sample_kos)
+    stage_cache.save_matrix(key, matrix)
+    loaded = stage_cache.load_matrix('sample KOs', key)
+    assert loaded.row_ids == matrix.row_ids
+    assert loaded.column_ids == matrix.column_ids
+    assert (loaded.matrix != matrix.matrix).nnz == 0
+    assert stage_cache.misses == ['sample KOs']
+    assert stage_cache.hits == ['sample KOs', 'sample KOs']
+
+
+def test_hash_file(tmpdir):
+    file_loc = str(tmpdir.join('kos.txt'))
+    with open(file_loc, 'w') as f:
+        f.write('K00001\n')
+    stage_cache = StageCache(str(tmpdir.join('stage_cache')))
+    file_hash = stage_cache.hash_file(file_loc)
+    # hashes are kept between instances
+    assert StageCache(str(tmpdir.join('stage_cache'))).file_hashes == stage_cache.file_hashes
+    with open(file_loc, 'w') as f:
+        f.write('K00002\n')
+    assert stage_cache.hash_file(file_loc) != file_hash
+
+
+def get_stage_names(output_dir):
+    return [stage['name'] for stage in json.load(open(path.join(output_dir, 'AMON_stages.json')))['stages']]
+
+
+def test_main_resume(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.txt'))
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\nK00006\n')
+    other_kos_loc = str(tmpdir.join('other_kos.txt'))
+    with open(other_kos_loc, 'w') as f:
+        f.write('K00004\nK00005\n')
+    kegg_files = dict(ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                      co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'])
+    output_dir = str(tmpdir.join('output'))
+    main(kos_loc, output_dir, other_kos_loc, unique_only=True, make_plots=False, resume=True, **kegg_files)
+    assert 'KO records' in get_stage_names(output_dir)
+    with pytest.raises(OSError):
+        main(kos_loc, output_dir, other_kos_loc, make_plots=False, **kegg_files)
+
+    # only the filter changed so no records are looked up again
+    main(kos_loc, output_dir, other_kos_loc, unique_only=False, make_plots=False, resume=True, **kegg_files)
+    stage_names = get_stage_names(output_dir)
+    for stage in ('KO records', 'reaction records', 'compound records', 'pathway records'):
+        assert stage not in stage_names
+    assert 'Stages reused from stage cache: sample KOs, sample compounds, compound pathways' in \
+        open(path.join(output_dir, 'AMON_log.txt')).read()
+    fresh_dir = str(tmpdir.join('fresh_output'))
+    main(kos_loc, fresh_dir, other_kos_loc, unique_only=False, make_plots=False, **kegg_files)
+    for output in ('origin_table.tsv', 'gene_set_1_compound_pathway_enrichment.tsv', 'kegg_mapper.tsv'):
+        assert open(path.join(fresh_dir, output)).read() == open(path.join(output_dir, output)).read()
+
+    # a changed input is read again and every stage after it is recomputed
+    with open(kos_loc, 'w') as f:
+        f.write('K00001\n')
+    main(kos_loc, output_dir, other_kos_loc, unique_only=False, make_plots=False, resume=True, **kegg_files)
+    assert 'KO records' in get_stage_names(output_dir)
+    assert 'Stages reused from stage cache: none' in open(path.join(output_dir, 'AMON_log.txt')).read()
+
+
+def test_predict_numeric_sample_ids(kegg_flat_files, tmpdir):
+    kos_loc = str(tmpdir.join('kos.tsv'))
+    pd.DataFrame([[4, 2, 1, 0], [0, 0, 3, 3]], index=[1001, 1002],
+                 columns=['K00001', 'K00002', 'K00003', 'K00004']).to_csv(kos_loc, sep='\t')
+    kwargs = dict(keep_separated=True, ko_file_loc=kegg_flat_files['ko'], rn_file_loc=kegg_flat_files['rn'],
+                  co_file_loc=kegg_flat_files['co'], pathway_file_loc=kegg_flat_files['pathway'],
+                  stage_cache=str(tmpdir.join('stage_cache')), robustness_replicates=20,
+                  robustness_method='rarefy', rarefaction_depth=4)
+    fresh = predict(kos_loc, **kwargs)
+    cached = predict(kos_loc, **kwargs)
+    # sample ids are strings whether the samples are read from the table or from the stage cache
+    assert 'sample KOs' in cached.logger['Stages reused from stage cache']
+    assert fresh.sample_compounds.row_ids == cached.sample_compounds.row_ids == ['1001', '1002']
+    pd.testing.assert_frame_equal(fresh.origin_table, cached.origin_table)
+    # rarefied replicates find the counts of their samples, sample 1001 keeps only some of its KOs
+    pd.testing.assert_frame_equal(fresh.compound_stability, cached.compound_stability)
+    assert fresh.compound_stability['1001'].min() < 1
+
+
+def test_predict_kegg_api_stages_not_cached(kegg_server, tmpdir):
+    kwargs = dict(stage_cache=str(tmpdir.join('stage_cache')), kegg_fetcher=KEGGFetcher(kegg_server.url,
+                                                                                          rate_limit=None))
+    fresh = predict({'sample1': ['K00001', 'K00002']}, **kwargs)
+    num_requests = len(kegg_server.requests)
+    # records from the KEGG API have no release to key stages by so only the samples' KOs are reused
+    cached = predict({'sample1': ['K00001', 'K00002']}, **kwargs)
+    assert cached.logger['Stages reused from stage cache'] == 'sample KOs'
+    assert len(kegg_server.requests) == 2 * num_requests
+    pd.testing.assert_frame_equal(fresh.origin_table, cached.origin_table)
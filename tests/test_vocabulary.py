@@ -0,0 +1,32 @@
+import numpy as np
+
+from AMON.vocabulary import Vocabulary, is_encoded, follow
+
+
+def test_vocabulary_encode_decode():
+    vocabulary = Vocabulary(['K00002', 'K00001'])
+    assert len(vocabulary) == 2
+    codes = vocabulary.encode(['K00001', 'R00001', 'K00001'])
+    assert codes.dtype == np.int32
+    assert list(codes) == [1, 2]
+    assert vocabulary.decode(codes) == ['K00001', 'R00001']
+    assert list(vocabulary.encode(['C00001', 'K00002'], add=False)) == [0]
+    assert 'C00001' not in vocabulary
+
+
+def test_vocabulary_dicts():
+    vocabulary = Vocabulary()
+    dict_of_codes = vocabulary.encode_dict({'Sample1': {'C00001', 'C00002'}, 'Sample2': []})
+    assert is_encoded(dict_of_codes)
+    assert not is_encoded({'Sample1': {'C00001'}})
+    assert vocabulary.decode_dict(dict_of_codes) == {'Sample1': {'C00001', 'C00002'}, 'Sample2': set()}
+
+
+def test_follow():
+    vocabulary = Vocabulary()
+    relation = vocabulary.encode_relation({'K00001': ['R00001', 'R00002'], 'K00002': ['R00002'], 'K00003': []})
+    assert relation.shape == (5, 5)
+    codes = vocabulary.encode(['K00001', 'K00002'])
+    assert vocabulary.decode(follow(relation, codes)) == ['R00001', 'R00002']
+    # codes added after the relation was made link to nothing
+    assert len(follow(relation, vocabulary.encode(['K00004']))) == 0